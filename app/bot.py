@@ -1,39 +1,76 @@
 import asyncio
 import logging
+import time
 from contextlib import suppress
 
+from aiohttp import web
 from aiogram import Bot, Dispatcher
 from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
 from aiogram.exceptions import TelegramNetworkError
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
+from app import metrics
+from app.fsm_storage import SQLiteStorage
+from app.middlewares import HandlerMetricsMiddleware, RequestMetricsMiddleware, UpdateTimingMiddleware
 from app.scheduler import start_scheduler
+from app.sender import close_sender
 from app.handlers.user import router as user_router
 from app.handlers.admin import router as admin_router
-from app.db import init_db, dispose_db
+from app.db import init_db, dispose_db, ping_db
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+class BotSession(AiohttpSession):
+    """
+    AiohttpSession с настройкой TCPConnector: кэш DNS и keep-alive.
+    aiogram создаёт коннектор лениво в create_session() из _connector_init; официального
+    параметра для этих настроек нет. Поэтому aiogram закреплён в requirements.txt, а если после
+    обновления атрибута не окажется, падаем при старте, а не теряем настройки молча.
+    """
+
+    def __init__(self, *, ttl_dns_cache: int, keepalive_timeout: float, **kwargs):
+        super().__init__(**kwargs)
+        connector_init = getattr(self, "_connector_init", None)
+        if not isinstance(connector_init, dict) or "ttl_dns_cache" not in connector_init:
+            raise RuntimeError("aiogram AiohttpSession no longer has _connector_init: update BotSession")
+        connector_init.update(ttl_dns_cache=ttl_dns_cache, keepalive_timeout=keepalive_timeout)
+
+def build_session() -> AiohttpSession:
+    """
+    Сессия Bot API с пулом keep-alive соединений. timeout — для обычных запросов;
+    getUpdates aiogram ждёт timeout + polling_timeout (см. _run_polling).
+    """
+    session_kwargs = {}
+    if Config.TELEGRAM_API_BASE:
+        session_kwargs["api"] = TelegramAPIServer.from_base(Config.TELEGRAM_API_BASE)
+    session = BotSession(
+        timeout=Config.HTTP_TIMEOUT, limit=Config.HTTP_POOL_LIMIT,
+        ttl_dns_cache=Config.HTTP_DNS_TTL, keepalive_timeout=Config.HTTP_KEEPALIVE,
+        **session_kwargs,
+    )
+    session.middleware(RequestMetricsMiddleware())
+    return session
+
 def build_bot() -> Bot:
-    session = AiohttpSession(timeout=75)  # секунды
+    session = build_session()
     return Bot(
         token=Config.BOT_TOKEN,
         session=session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML),
     )
 
-async def run():
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-    )
-    await init_db()
-
-    dp = Dispatcher()
+def build_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=SQLiteStorage())  # FSM переживает рестарт
     dp.include_router(user_router)
     dp.include_router(admin_router)
+    dp.update.outer_middleware(UpdateTimingMiddleware())
+    # внутренние middleware диспетчера действуют на хэндлеры всех вложенных роутеров
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
 
     scheduler_task = None
 
@@ -42,30 +79,120 @@ async def run():
         scheduler_task = start_scheduler(bot)
 
     async def on_shutdown():
+        nonlocal scheduler_task
         if scheduler_task:
             scheduler_task.cancel()
             with suppress(asyncio.CancelledError):
                 await scheduler_task
+            scheduler_task = None
         with suppress(Exception):
-            await dispose_db()
+            await close_sender()
+        # БД и FSM-хранилище закрывает run(): shutdown бывает и при переподключении polling,
+        # а init_db() (и загрузка индекса USER_INDEX) выполняется один раз
 
     dp.startup.register(on_startup)
     dp.shutdown.register(on_shutdown)
+    return dp
+
+def build_webhook_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    """
+    aiohttp-приложение для webhook-режима: POST на WEBHOOK_PATH -> dp.feed_update.
+    Секрет сверяется с заголовком X-Telegram-Bot-Api-Secret-Token.
+    Старт/стоп приложения вызывают startup/shutdown диспетчера (планировщик и т.п.).
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=Config.WEBHOOK_SECRET or None,
+    ).register(app, path=Config.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    async def set_webhook(_app: web.Application):
+        if not Config.WEBHOOK_BASE_URL:
+            logger.warning("WEBHOOK_BASE_URL is empty: setWebhook skipped (local mode)")
+            return
+        await bot.set_webhook(
+            url=Config.WEBHOOK_BASE_URL + Config.WEBHOOK_PATH,
+            secret_token=Config.WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info("Webhook set to %s%s", Config.WEBHOOK_BASE_URL, Config.WEBHOOK_PATH)
+
+    app.on_startup.append(set_webhook)
+    return app
 
+async def _run_webhook(dp: Dispatcher):
+    if not Config.WEBHOOK_SECRET:
+        logger.warning("WEBHOOK_SECRET is empty: webhook requests are not authenticated")
+    bot = build_bot()
+    runner = web.AppRunner(build_webhook_app(dp, bot))
+    await runner.setup()
+    site = web.TCPSite(runner, Config.WEBAPP_HOST, Config.WEBAPP_PORT)
+    await site.start()
+    logger.info("Webhook server listening on %s:%s%s", Config.WEBAPP_HOST, Config.WEBAPP_PORT, Config.WEBHOOK_PATH)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+async def _run_polling(dp: Dispatcher):
+    # один бот и одна сессия на все переподключения: keep-alive соединения и DNS-кэш
+    # не теряются, TLS-рукопожатие не повторяется; битые соединения пул отбрасывает сам
+    bot = build_bot()
+    webhook_checked = False
     backoff = 2
-    while True:
-        bot = build_bot()
-        try:
-            await dp.start_polling(bot)
-            break
-        except TelegramNetworkError as e:
-            logger.warning(f"Polling network error: {e!r}. Retry in {backoff}s")
-            with suppress(Exception):
-                await bot.session.close()
-            await asyncio.sleep(backoff)
-            backoff = min(backoff * 2, 60)
-        except Exception as e:
-            logger.exception(f"Polling crashed: {e!r}. Retry in 5s")
-            with suppress(Exception):
-                await bot.session.close()
-            await asyncio.sleep(5)
+    try:
+        while True:
+            try:
+                if not webhook_checked:
+                    # если раньше работали через webhook, getUpdates вернёт 409 — снимаем его
+                    await bot.delete_webhook(drop_pending_updates=False)
+                    webhook_checked = True
+                await dp.start_polling(bot, polling_timeout=Config.POLL_TIMEOUT, close_bot_session=False)
+                break
+            except TelegramNetworkError as e:
+                logger.warning(f"Polling network error: {e!r}. Retry in {backoff}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+            except Exception as e:
+                logger.exception(f"Polling crashed: {e!r}. Retry in 5s")
+                await asyncio.sleep(5)
+    finally:
+        with suppress(Exception):
+            await bot.session.close()
+
+async def _db_health():
+    return await ping_db(), "ok"
+
+_started_at = time.time()
+
+def _polling_health():
+    last = metrics.POLLING_LAST_SUCCESS.value() or _started_at
+    age = time.time() - last
+    return age < Config.HEALTH_POLL_STALE, round(age, 1)
+
+async def run():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)s | %(name)s | %(message)s",
+    )
+    await init_db()
+    dp = build_dispatcher()
+
+    metrics.add_health_check("db", _db_health)
+    if Config.BOT_MODE != "webhook":
+        metrics.add_health_check("polling", _polling_health)
+    metrics_server = metrics.MetricsServer()
+    await metrics_server.start()
+    try:
+        if Config.BOT_MODE == "webhook":
+            await _run_webhook(dp)
+        else:
+            await _run_polling(dp)
+    finally:
+        await metrics_server.close()
+        with suppress(Exception):
+            await dp.storage.close()  # дописать FSM write-back, пока писатель БД жив
+        with suppress(Exception):
+            await dispose_db()
@@ -0,0 +1,116 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from contextlib import suppress
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+
+from app import metrics
+from app.db import (
+    BroadcastRow,
+    get_active_user_ids_after,
+    get_broadcast,
+    next_running_broadcast,
+    save_broadcast_progress,
+    set_broadcast_status,
+)
+from app.keyboards import broadcast_control_kb
+from app.sender import SendJob, get_sender
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = 30  # страховочный опрос: рассылку могли запустить на другой реплике
+
+_STATUS_TITLES = {
+    "running": "⏳ Рассылка идёт",
+    "paused": "⏸ Рассылка на паузе",
+    "cancelled": "⏹ Рассылка отменена",
+    "done": "✅ Рассылка завершена",
+}
+
+_wakeup = asyncio.Event()
+
+
+def wake() -> None:
+    """Сообщить воркеру, что рассылку запустили или продолжили."""
+    _wakeup.set()
+
+
+def progress_text(b: BroadcastRow) -> str:
+    done = b.sent + b.failed
+    percent = min(100, done * 100 // b.total) if b.total else 100
+    return (f"{_STATUS_TITLES.get(b.status, b.status)} (#{b.id})\n\n"
+            f"Обработано: <b>{done}</b> из ~{b.total} ({percent}%)\n"
+            f"Доставлено: <b>{b.sent}</b>\n"
+            f"Ошибок: <b>{b.failed}</b>")
+
+
+async def show_progress(bot: Bot, b: BroadcastRow) -> None:
+    """Обновить сообщение с прогрессом (ошибки правки не мешают рассылке)."""
+    if b.chat_id is None or b.message_id is None:
+        return
+    try:
+        await bot.edit_message_text(progress_text(b), chat_id=b.chat_id, message_id=b.message_id,
+                                    reply_markup=broadcast_control_kb(b.id, b.status))
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e).lower():
+            logger.info("broadcast %s: cannot edit progress: %s", b.id, e)
+    except Exception as e:
+        logger.warning("broadcast %s: cannot edit progress: %r", b.id, e)
+
+
+async def run_broadcast(bot: Bot, b: BroadcastRow) -> None:
+    """
+    Разослать b.text активным пользователям с user_id > b.cursor.
+    Получатели читаются пачками по BROADCAST_CHUNK, отправка — через общий SendPipeline
+    (его лимиты делим с уведомлениями). После каждой пачки курсор и счётчики пишутся в БД:
+    после рестарта рассылка продолжится со следующей пачки, повторно может уйти
+    максимум одна незаписанная пачка. Статус перечитывается между пачками — так
+    срабатывают пауза и отмена.
+    """
+    sender = get_sender(bot)
+    last_shown = 0.0
+    while True:
+        b = await get_broadcast(b.id)
+        if b is None:
+            return
+        if b.status != "running":
+            await show_progress(bot, b)
+            return
+        if time.monotonic() - last_shown >= Config.BROADCAST_PROGRESS_SECONDS:
+            last_shown = time.monotonic()
+            await show_progress(bot, b)
+
+        user_ids = await get_active_user_ids_after(b.cursor, Config.BROADCAST_CHUNK)
+        if not user_ids:
+            await set_broadcast_status(b.id, "done", ("running",))
+            b = await get_broadcast(b.id)
+            logger.info("broadcast %s finished: sent=%s failed=%s", b.id, b.sent, b.failed)
+            await show_progress(bot, b)
+            return
+
+        results = await sender.send_many([SendJob(uid, b.text) for uid in user_ids])
+        sent = sum(1 for r in results if r.ok)
+        failed = len(results) - sent
+        metrics.BROADCAST_MESSAGES.inc(sent, status="sent")
+        metrics.BROADCAST_MESSAGES.inc(failed, status="failed")
+        await save_broadcast_progress(b.id, user_ids[-1], sent, failed)
+
+
+async def worker_loop(bot: Bot) -> None:
+    """Фоновый исполнитель рассылок: по одной, в порядке создания."""
+    while True:
+        _wakeup.clear()
+        try:
+            b = await next_running_broadcast()
+            while b is not None:
+                logger.info("broadcast %s: running from user_id > %s", b.id, b.cursor)
+                await run_broadcast(bot, b)
+                b = await next_running_broadcast()
+        except Exception:
+            logger.exception("broadcast worker error")
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_SECONDS)
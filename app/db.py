@@ -1,179 +1,721 @@
 from __future__ import annotations
-from typing import Optional
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Iterable, NamedTuple, Optional, TypeVar
+from collections import OrderedDict
 from pathlib import Path
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 import logging
-from sqlalchemy import Column, Integer, String, Boolean, select
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.exc import OperationalError,DBAPIError
+from sqlalchemy import Column, Integer, Float, String, Boolean, Index, event, select, update, delete, func, tuple_, case, bindparam
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession, create_async_engine
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import NullPool
 import asyncio
 import contextlib
 import os
+import time as _time
+
+from app import metrics
+from app.reminders import ANCHORS, Rule, next_due_minute, parse_local_time, render, timing_signature, user_events
+
+if TYPE_CHECKING:
+    from app.user_index import UserIndex
 
 logger = logging.getLogger(__name__)
 
 DB_PATH = Path(os.getenv("DB_PATH", "/data/bot.db"))
+WRITE_BATCH_SIZE = int(os.getenv("DB_WRITE_BATCH", "64"))          # операций на транзакцию
+WRITE_BATCH_WINDOW = float(os.getenv("DB_WRITE_WINDOW_MS", "5")) / 1000  # сколько ждём попутчиков
+DB_READ_POOL = int(os.getenv("DB_READ_POOL", "4"))                  # соединений на чтение
+DB_CACHE_KB = int(os.getenv("DB_CACHE_KB", "8192"))                  # page cache на соединение
+DB_MMAP_BYTES = int(os.getenv("DB_MMAP_BYTES", str(64 * 1024 * 1024)))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "10"))  # секунды; записи других реплик видны не позже
+STREAM_CHUNK = int(os.getenv("DB_STREAM_CHUNK", "1000"))  # строк за одну выборку курсора в stream_*
+USER_INDEX = bool(int(os.getenv("USER_INDEX", "0")))  # users/pending в памяти (app/user_index.py); одна реплика
 Base = declarative_base()
 
+# end_time хранится как локальное время Берлина
+TZ = ZoneInfo("Europe/Berlin")
+END_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Больше id не бывает у Telegram; на это рассчитаны упакованные ключи app.user_index.
+MAX_USER_ID = (1 << 53) - 1
+
 class User(Base):
     __tablename__ = 'users'
     user_id  = Column(Integer, primary_key=True)
     name     = Column(String)                      # <-- НОВОЕ: имя пользователя
     end_time = Column(String)                      # "YYYY-MM-DD HH:MM:SS"
+    expiry   = Column(Integer)                     # end_time в UTC epoch (секунды)
     active   = Column(Boolean, default=False)
     approved = Column(Boolean, default=False)
 
-    tminus3_sent = Column(Boolean, default=False)
-    onday_sent   = Column(Boolean, default=False)
-    after_sent   = Column(Boolean, default=False)
+    tz          = Column(String)                   # IANA-пояс; NULL — Config.DEFAULT_TZ
+    notify_hour = Column(Integer)                  # час напоминаний; NULL — Config.REMINDER_HOUR
+    next_due    = Column(Integer)                  # минута UTC (epoch // 60) ближайшего уведомления
+
+    __table_args__ = (
+        Index("ix_users_active_expiry", "active", "expiry"),
+        Index("ix_users_expiry_uid", "expiry", "user_id"),  # порядок дашборда
+        Index("ix_users_next_due", "next_due"),             # корзины планировщика
+    )
 
 class Pending(Base):
     __tablename__ = 'pending'
     user_id    = Column(Integer, primary_key=True)
     created_at = Column(String)                    # "YYYY-MM-DD HH:MM:SS"
 
+# Очередь исходящих уведомлений: намерение пишется в той же транзакции, что и флаг
+class Outbox(Base):
+    __tablename__ = 'outbox'
+    id         = Column(Integer, primary_key=True, autoincrement=True)
+    idem_key   = Column(String, nullable=False, unique=True)  # "<тип>:<user_id>:<expiry>"
+    user_id    = Column(Integer, nullable=False)
+    kind       = Column(String)
+    text       = Column(String)
+    status     = Column(String, default="pending")           # pending|sending|sent|failed|expired|unknown
+    attempts   = Column(Integer, default=0)
+    next_at    = Column(Integer)                              # epoch: не раньше этого момента
+    expires_at = Column(Integer)                              # epoch: позже — не отправлять
+    created_at = Column(Integer)
+    sent_at    = Column(Integer)
+    error      = Column(String)
+    claimed_by = Column(String)                               # INSTANCE_ID, переведший запись в sending
+    claimed_at = Column(Integer)                              # epoch перевода в sending
+
+    __table_args__ = (
+        Index("ix_outbox_status_next", "status", "next_at"),
+    )
+
+# Аренды лидерства между репликами (одна строка на роль, напр. "scheduler")
+class Lease(Base):
+    __tablename__ = 'leases'
+    name       = Column(String, primary_key=True)
+    holder     = Column(String, nullable=False)   # id реплики
+    expires_at = Column(Float, nullable=False)    # epoch: после — аренду может забрать другой
+    renewed_at = Column(Float)
+
+# Состояния FSM aiogram (app/fsm_storage.py): переживают рестарт, старые чистятся по TTL
+class FsmState(Base):
+    __tablename__ = 'fsm_states'
+    key        = Column(String, primary_key=True)   # DefaultKeyBuilder: fsm:<bot>:<chat>:<user>:<destiny>
+    state      = Column(String)
+    data       = Column(String)                     # JSON
+    updated_at = Column(Integer, nullable=False)    # epoch
+
+    __table_args__ = (
+        Index("ix_fsm_states_updated", "updated_at"),
+    )
+
+# Рассылки админа (app/broadcast.py): прогресс сохраняется после каждой пачки
+class Broadcast(Base):
+    __tablename__ = 'broadcasts'
+    id          = Column(Integer, primary_key=True, autoincrement=True)
+    text        = Column(String, nullable=False)     # HTML
+    status      = Column(String, default="running")  # running|paused|cancelled|done
+    cursor      = Column(Integer, default=0)         # последний обработанный user_id
+    total       = Column(Integer, default=0)         # получателей на момент запуска
+    sent        = Column(Integer, default=0)
+    failed      = Column(Integer, default=0)
+    chat_id     = Column(Integer)                    # сообщение с прогрессом
+    message_id  = Column(Integer)
+    created_at  = Column(Integer)
+    finished_at = Column(Integer)
+
+# Правила уведомлений (см. app.reminders.Rule): новое напоминание — новая строка, без миграций
+class NotificationRule(Base):
+    __tablename__ = 'notification_rules'
+    id              = Column(Integer, primary_key=True, autoincrement=True)
+    code            = Column(String, nullable=False, unique=True)  # tminus3 | onday | after | ...
+    title           = Column(String)                               # подпись в меню админа
+    anchor          = Column(String, nullable=False, default="day")  # day | expiry
+    offset_days     = Column(Integer, nullable=False, default=0)
+    offset_minutes  = Column(Integer, nullable=False, default=0)
+    local_time      = Column(String)                               # "HH:MM"; NULL — час пользователя
+    window_minutes  = Column(Integer, nullable=False, default=5)
+    template        = Column(String, nullable=False)               # str.format, доступно {end}
+    only_before_end = Column(Boolean, default=False)
+    deactivate      = Column(Boolean, default=False)
+    enabled         = Column(Boolean, default=True)
+
+# Что уже отправлено: одно уведомление на (пользователь, версия end_time, правило)
+class NotificationLog(Base):
+    __tablename__ = 'notification_log'
+    user_id    = Column(Integer, primary_key=True)
+    version    = Column(Integer, primary_key=True)  # users.expiry на момент отправки
+    rule_id    = Column(Integer, primary_key=True)
+    created_at = Column(Integer)
+
+# Версия схемы (MIGRATIONS): одна строка id=1
+class SchemaVersion(Base):
+    __tablename__ = 'schema_version'
+    id         = Column(Integer, primary_key=True, default=1)
+    version    = Column(Integer, nullable=False)
+    updated_at = Column(Integer)                     # epoch
+
 # Глобальные настройки уведомлений
 class Settings(Base):
     __tablename__ = 'settings'
     id = Column(Integer, primary_key=True, default=1)
     notif_master  = Column(Boolean, default=True)
+    # notif_tminus3/onday/after — только начальные значения notification_rules.enabled
     notif_tminus3 = Column(Boolean, default=True)
     notif_onday   = Column(Boolean, default=True)
     notif_after   = Column(Boolean, default=True)
+    rules_hash    = Column(String)                   # reminders.timing_signature последнего пересчёта next_due
+
+# PRAGMA, которые действуют только в рамках соединения: ставим на каждое новое.
+_CONNECTION_PRAGMAS = (
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    f"PRAGMA cache_size=-{DB_CACHE_KB}",
+    f"PRAGMA mmap_size={DB_MMAP_BYTES}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+def _apply_pragmas(dbapi_connection, pragmas) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in pragmas:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+_DB_URL = f"sqlite+aiosqlite:///{DB_PATH}"
+
+# Писатель: ровно одно соединение, им постоянно владеет _Writer.
+engine = create_async_engine(
+    _DB_URL, echo=False, pool_size=1, max_overflow=0, connect_args={"timeout": 30},
+)
+# Миграции и PRAGMA journal_mode: своё короткоживущее соединение, а не соединение писателя —
+# иначе после первой записи engine.begin() ждал бы его до таймаута пула.
+migrate_engine = create_async_engine(
+    _DB_URL, echo=False, poolclass=NullPool, connect_args={"timeout": 30},
+)
+# Аренды лидерства: своё соединение мимо очереди писателя — продление не ждёт импорты
+# и пересчёты, а отменённое ожидание (wait_for в app.leader) отменяет и саму запись.
+lease_engine = create_async_engine(
+    _DB_URL, echo=False, pool_size=1, max_overflow=0, connect_args={"timeout": 30},
+)
+# Читатели: в WAL не блокируют друг друга и писателя, поэтому держим пул.
+read_engine = create_async_engine(
+    _DB_URL, echo=False, pool_size=DB_READ_POOL, max_overflow=0, connect_args={"timeout": 30},
+)
 
-engine = create_async_engine(f"sqlite+aiosqlite:///{DB_PATH}?timeout=30", echo=False, pool_pre_ping=True, connect_args={"timeout": 30},)
-async_session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+@event.listens_for(engine.sync_engine, "connect")
+@event.listens_for(migrate_engine.sync_engine, "connect")
+@event.listens_for(lease_engine.sync_engine, "connect")
+def _on_write_connect(dbapi_connection, _record):
+    _apply_pragmas(dbapi_connection, _CONNECTION_PRAGMAS)
 
-async def _safe_commit(session, retries: int = 10) -> None:
+@event.listens_for(read_engine.sync_engine, "connect")
+def _on_read_connect(dbapi_connection, _record):
+    _apply_pragmas(dbapi_connection, _CONNECTION_PRAGMAS + ("PRAGMA query_only=ON",))
+
+async_session = sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
+
+# ---------- единственный писатель ----------
+T = TypeVar("T")
+WriteOp = Callable[[AsyncSession], Awaitable[T]]
+
+def _is_lock_error(e: BaseException) -> bool:
+    msg = str(e).lower()
+    return "database is locked" in msg or "database is busy" in msg
+
+class DatabaseClosed(RuntimeError):
+    """Запись после dispose_db(): писатель остановлен и сам не перезапускается."""
+
+class _Writer:
     """
-    Надёжный коммит с ретраями для SQLite:
-    - на 'database is locked' делаем rollback и ждём с экспоненциальной задержкой
-    - без рекурсии, чтобы не упираться в RecursionError
+    Все записи идут через одну задачу и одно соединение.
+    Операции (async fn(session) -> result) копятся в очереди и коммитятся группами:
+    до WRITE_BATCH_SIZE штук или WRITE_BATCH_WINDOW секунд ожидания — одна транзакция.
+    Внутри процесса писатель один, поэтому конкуренции за блокировку SQLite нет;
+    "locked" возможен только из-за другого процесса — тогда группа целиком повторяется.
     """
-    delay = 0.1
-    for attempt in range(1, retries + 1):
+
+    def __init__(self):
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._conn = None
+        self.closed = False  # после close() — до init_db()
+
+    def _ensure_started(self) -> asyncio.Queue:
+        if self.closed:
+            raise DatabaseClosed("DB writer is closed (dispose_db)")
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+        return self._queue  # type: ignore[return-value]
+
+    async def submit(self, op: WriteOp) -> T:
+        fut = asyncio.get_running_loop().create_future()
+        self._ensure_started().put_nowait((op, fut))
+        return await fut
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        stopping = False
         try:
-            await session.commit()
-            return
-        except OperationalError as e:
-            msg = str(e).lower()
-            # типичные тексты ошибок блокировок у sqlite/aiosqlite
-            if "database is locked" in msg or "database is busy" in msg or "locked" in msg:
-                # откатываем текущую транзакцию, ждём и пробуем снова
-                with contextlib.suppress(Exception):
-                    await session.rollback()
-                await asyncio.sleep(delay)
-                delay = min(delay * 2, 2.0)  # backoff до 2 сек
-                continue
-            # не наша ошибка — отдаём дальше
-            raise
-        except DBAPIError as e:
-            # если соединение инвалидировано — подождём и попробуем ещё раз
-            if getattr(e, "connection_invalidated", False) and attempt < retries:
+            while not stopping:
+                item = await queue.get()
+                if item is None:
+                    break
+                batch = [item]
+                deadline = loop.time() + WRITE_BATCH_WINDOW
+                while len(batch) < WRITE_BATCH_SIZE:
+                    if queue.empty():
+                        timeout = deadline - loop.time()
+                        if timeout <= 0:
+                            break
+                        try:
+                            item = await asyncio.wait_for(queue.get(), timeout)
+                        except asyncio.TimeoutError:
+                            break
+                    else:
+                        item = queue.get_nowait()
+                    if item is None:  # close(): дописываем набранное и выходим
+                        stopping = True
+                        break
+                    batch.append(item)
+                await self._commit_group(batch)
+        finally:
+            if self._conn is not None:
                 with contextlib.suppress(Exception):
+                    await self._conn.close()
+                self._conn = None
+
+    async def _connection(self):
+        if self._conn is None or self._conn.closed:
+            self._conn = await engine.connect()
+        return self._conn
+
+    async def _run_ops(self, batch) -> list:
+        conn = await self._connection()
+        delay = 0.1
+        metrics.DB_WRITE_BATCH.observe(len(batch))
+        for attempt in range(1, 11):
+            async with AsyncSession(bind=conn, expire_on_commit=False) as session:
+                try:
+                    with metrics.DB_COMMIT_SECONDS.time():
+                        results = [await op(session) for op, _fut in batch]
+                        await session.commit()
+                    _run_after_commit(session)
+                    return results
+                except OperationalError as e:
                     await session.rollback()
-                await asyncio.sleep(delay)
-                delay = min(delay * 2, 2.0)
-                continue
-            raise
-    # если все попытки исчерпаны — бросаем явную ошибку
-    raise RuntimeError("Commit failed after retries due to database locks")
-
-
-async def _migrate_users_table():
-    async with engine.begin() as conn:
-        res = await conn.exec_driver_sql("PRAGMA table_info('users')")
-        cols = {row[1] for row in res.fetchall()}
-        if "name" not in cols:
-            await conn.exec_driver_sql("ALTER TABLE users ADD COLUMN name TEXT")  # <- добавили имя
-        if "approved" not in cols:
-            await conn.exec_driver_sql("ALTER TABLE users ADD COLUMN approved BOOLEAN DEFAULT 0")
-        if "tminus3_sent" not in cols:
-            await conn.exec_driver_sql("ALTER TABLE users ADD COLUMN tminus3_sent BOOLEAN DEFAULT 0")
-        if "onday_sent" not in cols:
-            await conn.exec_driver_sql("ALTER TABLE users ADD COLUMN onday_sent BOOLEAN DEFAULT 0")
-        if "after_sent" not in cols:
-            await conn.exec_driver_sql("ALTER TABLE users ADD COLUMN after_sent BOOLEAN DEFAULT 0")
-
-async def _ensure_settings_row():
-    async with async_session() as session:
-        row = await session.get(Settings, 1)
-        if not row:
-            session.add(Settings(id=1, notif_master=True, notif_tminus3=True, notif_onday=True, notif_after=True))
-            await _safe_commit(session)
+                    if not _is_lock_error(e) or attempt == 10:
+                        raise
+            metrics.DB_LOCK_RETRIES.inc()
+            metrics.DB_LOCK_WAIT_SECONDS.inc(delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 2.0)
+        raise RuntimeError("unreachable")
 
-async def init_db():
-    """
-    1) Сначала пытаемся выставить безопасные PRAGMA:
-       - busy_timeout (чтобы эта коннекция ждала при локах)
-       - проверяем journal_mode; если не WAL — пробуем включить
-       - включаем synchronous=NORMAL и foreign_keys=ON
-       Все действия с ретраями (до ~60 сек суммарно).
-    2) Создаём таблицы (идемпотентно) — тоже с ретраями.
-    3) Локальные миграции и дефолтные настройки.
-    """
-    # --- Шаг 1: PRAGMA с ретраями ---
-    attempt = 0
-    while True:
-        attempt += 1
+    async def _commit_group(self, batch) -> None:
         try:
-            async with engine.begin() as conn:
-                # Важно: сначала увеличим busy_timeout для самой этой коннекции
-                await conn.exec_driver_sql("PRAGMA busy_timeout=30000;")
-
-                # Проверим текущий journal_mode, чтобы не дергать WAL зря
-                cur_mode = (await conn.exec_driver_sql("PRAGMA journal_mode;")).scalar()
-                cur_mode = (str(cur_mode) if cur_mode is not None else "").lower()
-
-                if cur_mode != "wal":
-                    # Попробуем включить WAL (может требовать эксклюзивный лок)
-                    try:
-                        new_mode = (await conn.exec_driver_sql("PRAGMA journal_mode=WAL;")).scalar()
-                        logger.info(f"SQLite journal_mode set to: {new_mode}")
-                    except OperationalError as e:
-                        if "database is locked" in str(e).lower():
-                            # Это не критично — просто оставим текущий режим и пойдём дальше
-                            logger.warning("Unable to switch to WAL now (locked). Continue with current journal_mode.")
-                        else:
-                            raise
-
-                # Остальные безопасные PRAGMA
-                await conn.exec_driver_sql("PRAGMA synchronous=NORMAL;")
-                await conn.exec_driver_sql("PRAGMA foreign_keys=ON;")
-
-            break  # PRAGMA этап прошёл
-        except OperationalError as e:
-            if "database is locked" in str(e).lower():
-                # Подождём и повторим (экспоненциальная задержка до 5 сек)
-                delay = min(0.5 * attempt, 5.0)
-                logger.warning(f"PRAGMA phase locked (attempt {attempt}), retrying in {delay:.1f}s...")
-                await asyncio.sleep(delay)
-                # Дадим шанс до 30 попыток (~минуту)
-                if attempt < 30:
-                    continue
-            raise
+            results = await self._run_ops(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                _op, fut = batch[0]
+                if not fut.done():
+                    fut.set_exception(e)
+                return
+            # разбираем группу по одной операции, чтобы ошибка одной не задела соседей
+            for item in batch:
+                await self._commit_group([item])
+            return
+        for (_op, fut), result in zip(batch, results):
+            if not fut.done():
+                fut.set_result(result)
+
+    async def close(self) -> None:
+        """Дописать очередь и остановить писателя; новые записи — DatabaseClosed."""
+        self.closed = True
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        if not task.done():
+            self._queue.put_nowait(None)  # type: ignore[union-attr]
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+_writer = _Writer()
+
+def _after_commit(session, hook: Callable[[], None]) -> None:
+    """Выполнить hook в писателе сразу после успешного коммита этой транзакции (в порядке коммитов)."""
+    session.info.setdefault("after_commit", []).append(hook)
+
+def _run_after_commit(session) -> None:
+    for hook in session.info.pop("after_commit", ()):
+        try:
+            hook()
+        except Exception:
+            logger.exception("after-commit hook failed")
+
+async def _write(op: WriteOp) -> T:
+    """Выполнить операцию записи через единственного писателя."""
+    return await _writer.submit(op)
+
+
+# ---------- схема и миграции ----------
+# Шаги применяются по порядку, начиная с версии из schema_version. Каждый шаг
+# идемпотентен (DDL в SQLite не откатывается, а процесс может упасть до записи версии)
+# и выполняется в своей транзакции вместе с записью новой версии.
+# Применяет init_db() или заранее, без бота: python -m app.migrate
+MigrationStep = Callable[[AsyncConnection], Awaitable[None]]
+
+async def _table_columns(conn: AsyncConnection, table: str) -> set[str]:
+    res = await conn.exec_driver_sql(f"PRAGMA table_info('{table}')")
+    return {row[1] for row in res.fetchall()}
+
+async def _m_create_tables(conn: AsyncConnection) -> None:
+    await conn.run_sync(Base.metadata.create_all)
+
+async def _m_users_columns(conn: AsyncConnection) -> None:
+    cols = await _table_columns(conn, "users")
+    for col, ddl in (("name", "TEXT"), ("approved", "BOOLEAN DEFAULT 0"), ("expiry", "INTEGER"),
+                     ("tz", "TEXT"), ("notify_hour", "INTEGER"), ("next_due", "INTEGER")):
+        if col not in cols:
+            await conn.exec_driver_sql(f"ALTER TABLE users ADD COLUMN {col} {ddl}")
+    await conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_users_active_expiry ON users (active, expiry)")
+    await conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_users_expiry_uid ON users (expiry, user_id)")
+    await conn.exec_driver_sql("CREATE INDEX IF NOT EXISTS ix_users_next_due ON users (next_due)")
+
+async def _m_backfill_expiry(conn: AsyncConnection) -> None:
+    """users.expiry из текстового end_time."""
+    res = await conn.exec_driver_sql(
+        "SELECT user_id, end_time FROM users WHERE expiry IS NULL AND end_time IS NOT NULL"
+    )
+    updates = []
+    for user_id, end_time in res.fetchall():
+        expiry = _end_time_to_epoch(end_time)
+        if expiry is not None:
+            updates.append((expiry, user_id))
+    if updates:
+        await conn.exec_driver_sql("UPDATE users SET expiry = ? WHERE user_id = ?", updates)
+        logger.info("Backfilled users.expiry for %d rows", len(updates))
+
+async def _m_settings(conn: AsyncConnection) -> None:
+    if "rules_hash" not in await _table_columns(conn, "settings"):
+        await conn.exec_driver_sql("ALTER TABLE settings ADD COLUMN rules_hash TEXT")
+    await conn.execute(_settings_row_insert())
+
+def _settings_row_insert():
+    return (sqlite_insert(Settings)
+            .values(id=1, notif_master=True, notif_tminus3=True, notif_onday=True, notif_after=True)
+            .on_conflict_do_nothing())
+
+# Встроенные правила = прежние три уведомления
+_DEFAULT_RULES = (
+    dict(code="tminus3", title="За 3 дня", anchor="day", offset_days=-3, window_minutes=5,
+         only_before_end=True, template="⚠️ Напоминание\n\nВаш доступ истекает через 3 дня — {end:%Y-%m-%d %H:%M}."),
+    dict(code="onday", title="В день окончания", anchor="day", offset_days=0, window_minutes=5,
+         only_before_end=True,
+         template="⏳ Сегодня — последний день\n\nДоступ истекает сегодня в {end:%H:%M} ({end:%Y-%m-%d})."),
+    dict(code="after", title="После окончания (1ч)", anchor="expiry", offset_days=0, window_minutes=60,
+         deactivate=True, template="❌ Доступ завершён\n\nСрок действия истёк: {end:%Y-%m-%d %H:%M}."),
+)
+
+async def _m_default_rules(conn: AsyncConnection) -> None:
+    """Встроенные правила, если таблица пуста (enabled — из старых тумблеров settings)."""
+    if (await conn.execute(select(func.count()).select_from(NotificationRule))).scalar_one():
+        return
+    row = (await conn.execute(
+        select(Settings.notif_tminus3, Settings.notif_onday, Settings.notif_after).where(Settings.id == 1)
+    )).first()
+    enabled = dict(zip(("tminus3", "onday", "after"), row)) if row else {}
+    await conn.execute(sqlite_insert(NotificationRule), [
+        {"offset_minutes": 0, "local_time": None, "only_before_end": False, "deactivate": False,
+         **rule, "enabled": _truthy(enabled.get(rule["code"], True))}
+        for rule in _DEFAULT_RULES
+    ])
+
+async def _m_flags_to_log(conn: AsyncConnection) -> None:
+    """Старые флаги users.*_sent -> notification_log для текущей версии end_time."""
+    cols = await _table_columns(conn, "users")
+    now_ts = int(_time.time())
+    moved = 0
+    for code in ("tminus3", "onday", "after"):
+        flag = f"{code}_sent"
+        if flag not in cols:
+            continue
+        res = await conn.exec_driver_sql(
+            "INSERT OR IGNORE INTO notification_log (user_id, version, rule_id, created_at) "
+            f"SELECT u.user_id, u.expiry, r.id, ? FROM users u JOIN notification_rules r ON r.code = ? "
+            f"WHERE u.{flag} = 1 AND u.expiry IS NOT NULL",
+            (now_ts, code),
+        )
+        moved += max(res.rowcount or 0, 0)
+        await conn.exec_driver_sql(f"UPDATE users SET {flag} = 0 WHERE {flag} = 1")
+    if moved:
+        logger.info("Moved %d sent flags to notification_log", moved)
+
+# (версия, описание, шаг) — только дописывать в конец; номера не переиспользовать
+async def _m_outbox_claims(conn: AsyncConnection) -> None:
+    cols = await _table_columns(conn, "outbox")
+    for col, ddl in (("claimed_by", "TEXT"), ("claimed_at", "INTEGER")):
+        if col not in cols:
+            await conn.exec_driver_sql(f"ALTER TABLE outbox ADD COLUMN {col} {ddl}")
+
+MIGRATIONS: tuple[tuple[int, str, MigrationStep], ...] = (
+    (1, "таблицы и индексы по моделям", _m_create_tables),
+    (2, "users: name, approved, expiry, tz, notify_hour, next_due и индексы", _m_users_columns),
+    (3, "users.expiry из end_time", _m_backfill_expiry),
+    (4, "settings: строка id=1 и rules_hash", _m_settings),
+    (5, "встроенные правила уведомлений", _m_default_rules),
+    (6, "флаги users.*_sent -> notification_log", _m_flags_to_log),
+    (7, "outbox: claimed_by, claimed_at", _m_outbox_claims),
+)
+SCHEMA_VERSION = MIGRATIONS[-1][0]
 
-    # --- Шаг 2: create_all с ретраями ---
+async def _retry_locked(what: str, fn: Callable[[], Awaitable[T]]) -> T:
+    """fn() с ретраями на 'database is locked' (другой процесс держит БД): до ~60 сек суммарно."""
     attempt = 0
     while True:
         attempt += 1
         try:
-            async with engine.begin() as conn:
-                await conn.run_sync(Base.metadata.create_all)
-            break
+            return await fn()
         except OperationalError as e:
-            if "database is locked" in str(e).lower() and attempt < 30:
+            if _is_lock_error(e) and attempt < 30:
                 delay = min(0.5 * attempt, 5.0)
-                logger.warning(f"create_all locked (attempt {attempt}), retrying in {delay:.1f}s...")
+                logger.warning(f"{what} locked (attempt {attempt}), retrying in {delay:.1f}s...")
                 await asyncio.sleep(delay)
                 continue
             raise
 
-    # --- Шаг 3: миграции и дефолтные значения ---
-    await _migrate_users_table()
-    await _ensure_settings_row()
+async def _ensure_wal() -> None:
+    """journal_mode хранится в файле БД: включаем WAL один раз, при миграции."""
+    async with migrate_engine.begin() as conn:
+        cur_mode = (await conn.exec_driver_sql("PRAGMA journal_mode;")).scalar()
+        if (str(cur_mode) if cur_mode is not None else "").lower() == "wal":
+            return
+        try:
+            new_mode = (await conn.exec_driver_sql("PRAGMA journal_mode=WAL;")).scalar()
+            logger.info(f"SQLite journal_mode set to: {new_mode}")
+        except OperationalError as e:
+            if not _is_lock_error(e):
+                raise
+            # не критично: останемся в текущем режиме до следующей миграции
+            logger.warning("Unable to switch to WAL now (locked). Continue with current journal_mode.")
+
+async def _read_schema_version(session) -> int:
+    """Версия схемы; 0 — таблицы schema_version ещё нет (новая или доверсионная база)."""
+    try:
+        return (await session.execute(select(SchemaVersion.version).where(SchemaVersion.id == 1))).scalar() or 0
+    except OperationalError as e:
+        if "no such table" in str(e).lower():
+            return 0
+        raise
+
+async def get_schema_version() -> int:
+    async with async_session() as session:
+        return await _read_schema_version(session)
+
+async def migrate() -> list[int]:
+    """
+    Применить недостающие шаги MIGRATIONS; возвращает номера применённых версий.
+    Шаги идут через migrate_engine, поэтому вызывать можно и после записей через писателя.
+    """
+    current = await get_schema_version()
+    if current > SCHEMA_VERSION:
+        logger.warning("DB schema version %d is newer than this build (%d)", current, SCHEMA_VERSION)
+    pending = [m for m in MIGRATIONS if m[0] > current]
+    if not pending:
+        return []
+    await _retry_locked("PRAGMA phase", _ensure_wal)
+    for version, title, step in pending:
+        async def apply(version=version, step=step) -> None:
+            async with migrate_engine.begin() as conn:
+                await step(conn)
+                stmt = sqlite_insert(SchemaVersion).values(id=1, version=version, updated_at=int(_time.time()))
+                await conn.execute(stmt.on_conflict_do_update(
+                    index_elements=[SchemaVersion.id],
+                    set_={"version": func.max(SchemaVersion.version, stmt.excluded.version),
+                          "updated_at": stmt.excluded.updated_at},
+                ))
+        await _retry_locked(f"migration {version}", apply)
+        logger.info("DB schema migrated to version %d: %s", version, title)
+    return [m[0] for m in pending]
+
+async def init_db():
+    """
+    Быстрый путь: схема актуальна — одна читающая транзакция (версия, settings, правила).
+    Иначе migrate() и то же чтение. PRAGMA уровня соединения ставит хук _on_*_connect.
+    Если с прошлого запуска изменились правила уведомлений — пересчитываем next_due.
+    USER_INDEX=1 — затем загружаем users/pending в память.
+    """
+    _writer.closed = False
+    rules_hash = await _startup_read()
+    if rules_hash is None:
+        await migrate()
+        rules_hash = await _startup_read(migrated=True)
+    await _recompute_next_due_if_rules_changed(rules_hash)
+    if USER_INDEX:
+        await _load_user_index()
 
 # ---------- helpers ----------
+def _end_time_to_epoch(end_time: Optional[str]) -> Optional[int]:
+    """'YYYY-MM-DD HH:MM:SS' (Берлин) -> UTC epoch; None, если строка не парсится."""
+    if not end_time:
+        return None
+    try:
+        naive = datetime.strptime(end_time, END_TIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+    return int(naive.replace(tzinfo=TZ).timestamp())
+
+def _next_due(expiry: Optional[int], tz: Optional[str], hour: Optional[int], active,
+              sent: frozenset[int] = frozenset(),
+              now: Optional[datetime] = None, include_open: bool = True) -> Optional[int]:
+    """Значение users.next_due для строки (см. app.reminders.next_due_minute)."""
+    if expiry is None or not _truthy(active):
+        return None
+    events = user_events(expiry, tz, hour, _rules(), sent)
+    return next_due_minute(events, now or datetime.now(TZ), include_open)
+
+def _parse_sent(raw) -> frozenset[int]:
+    """group_concat(rule_id) -> множество id правил."""
+    return frozenset(int(x) for x in str(raw).split(",")) if raw else frozenset()
+
+def _select_with_sent(*columns):
+    """
+    SELECT columns + id отправленных правил для текущей версии end_time.
+    Коррелированный подзапрос по PK notification_log, а не JOIN + GROUP BY: без временного
+    B-дерева на всю выборку, поэтому строки можно отдавать потоком.
+    """
+    sent = (
+        select(func.group_concat(NotificationLog.rule_id))
+        .where(NotificationLog.user_id == User.user_id, NotificationLog.version == User.expiry)
+        .scalar_subquery()
+    )
+    return select(*columns, sent).select_from(User)
+
+async def _refresh_next_due(session, user_ids: Iterable[int], include_open: bool = True,
+                            now: Optional[datetime] = None) -> None:
+    """
+    Пересчитать next_due пользователям по текущим значениям в транзакции (Core, без ORM-объектов).
+    Прочитанные строки с новым next_due заодно уходят в индекс в памяти (вместо _index_capture).
+    """
+    conn = await session.connection()
+    ids = list(dict.fromkeys(user_ids))
+    now = now or datetime.now(TZ)
+    stmt = update(User).where(User.user_id == bindparam("uid")).values(next_due=bindparam("due"))
+    captured = []
+    for i in range(0, len(ids), BULK_CHUNK):
+        rows = (await conn.execute(
+            _select_with_sent(*_INDEX_COLUMNS).where(User.user_id.in_(ids[i:i + BULK_CHUNK]))
+        )).fetchall()
+        params = []
+        for uid, name, end_time, expiry, active, approved, tz, hour, _due, sent in rows:
+            due = _next_due(expiry, tz, hour, active, _parse_sent(sent), now=now, include_open=include_open)
+            params.append(dict(uid=uid, due=due))
+            captured.append((uid, name, end_time, expiry, active, approved, tz, hour, due, sent))
+        if params:
+            await conn.execute(stmt, params)
+    index = _index
+    if index is not None and captured:
+        _after_commit(session, lambda: index.apply(captured))
+
+# ---------- индекс users/pending в памяти (USER_INDEX=1) ----------
+# Загружается в init_db(). Каждая запись users/pending перечитывает затронутые строки
+# в своей транзакции, а писатель применяет их к индексу после коммита — в порядке коммитов.
+# Предполагается, что в БД пишет только этот процесс (одна реплика).
+_index: Optional["UserIndex"] = None
+_INDEX_COLUMNS = (User.user_id, User.name, User.end_time, User.expiry, User.active, User.approved,
+                  User.tz, User.notify_hour, User.next_due)
+
+async def _index_capture(session, user_ids: Iterable[int]) -> None:
+    """Перечитать пользователей в текущей транзакции; в индекс — после коммита."""
+    index = _index
+    if index is None:
+        return
+    await session.flush()
+    conn = await session.connection()
+    ids = list(dict.fromkeys(user_ids))
+    rows = []
+    for i in range(0, len(ids), BULK_CHUNK):
+        rows += (await conn.execute(
+            _select_with_sent(*_INDEX_COLUMNS).where(User.user_id.in_(ids[i:i + BULK_CHUNK]))
+        )).fetchall()
+    _after_commit(session, lambda: index.apply(rows))
+
+def _index_capture_pending(session, user_ids: Iterable[int], created_at: Optional[str]) -> None:
+    """Заявки добавлены (created_at) или удалены (None) — в индекс после коммита."""
+    index = _index
+    if index is None:
+        return
+    ids = list(user_ids)
+    _after_commit(session, lambda: [index.set_pending(uid, created_at) for uid in ids])
+
+async def _db_summary(session) -> dict:
+    """Агрегаты users/pending — сверка с UserIndex.summary()."""
+    row = (await session.execute(select(
+        func.count(), func.count(User.expiry), func.coalesce(func.sum(User.expiry), 0),
+        func.count(User.next_due), func.coalesce(func.sum(User.next_due), 0),
+        func.coalesce(func.sum(case((User.active == True, 1), else_=0)), 0),
+        func.coalesce(func.sum(case((User.approved == True, 1), else_=0)), 0),
+    ))).one()
+    pending = (await session.execute(select(func.count()).select_from(Pending))).scalar_one()
+    return dict(users=row[0], active=row[5], dated=row[1], approved=row[6], expiry_sum=row[2],
+                due=row[3], due_sum=row[4], pending=pending)
+
+async def _load_user_index() -> None:
+    """Загрузить индекс (потоково, одним снимком) и сверить его с БД отдельным чтением."""
+    global _index
+    from app.user_index import UserIndex
+
+    started = _time.perf_counter()
+    index = UserIndex()
+    async with async_session() as session:
+        q = _select_with_sent(*_INDEX_COLUMNS).order_by(User.user_id)
+        result = await session.stream(q.execution_options(yield_per=STREAM_CHUNK))
+        async for part in result.partitions():
+            index.load_rows(part)
+        pending = (await session.execute(select(Pending.user_id, Pending.created_at))).fetchall()
+    index.build((r[0], r[1]) for r in pending)
+    _index = index
+    if not await verify_user_index():
+        _index = None
+        logger.error("User index disabled: it does not match the database (another writer?)")
+        return
+    logger.info("User index loaded: %d users, %d pending in %.2fs",
+                index.counts()[0], len(pending), _time.perf_counter() - started)
+
+async def verify_user_index() -> bool:
+    """Сверить агрегаты индекса с таблицами; True — совпадают (или индекс выключен)."""
+    if _index is None:
+        return True
+    async with async_session() as session:
+        expected = await _db_summary(session)
+    actual = _index.summary()
+    if actual != expected:
+        logger.error("User index mismatch: index=%s db=%s", actual, expected)
+        return False
+    return True
+
+# Подписчики на изменения пользователя (end_time/active), например планировщик.
+_user_listeners: list[Callable[[int], None]] = []
+
+def add_user_listener(callback: Callable[[int], None]) -> None:
+    if callback not in _user_listeners:
+        _user_listeners.append(callback)
+
+def remove_user_listener(callback: Callable[[int], None]) -> None:
+    with contextlib.suppress(ValueError):
+        _user_listeners.remove(callback)
+
+def _notify_user_changed(user_id: int) -> None:
+    _user_cache.invalidate(user_id)
+    for callback in list(_user_listeners):
+        try:
+            callback(user_id)
+        except Exception:
+            logger.exception("user listener failed for %s", user_id)
+
 def _truthy(val) -> bool:
     if val is None:
         return False
@@ -186,22 +728,96 @@ def _truthy(val) -> bool:
         return s in {"1", "true", "t", "yes", "y"}
     return bool(val)
 
+# ---------- кэш статуса пользователя ----------
+class UserStatus(NamedTuple):
+    approved: bool
+    end_time: Optional[str]
+    active: bool
+
+class _UserStatusCache:
+    """
+    LRU + TTL кэш UserStatus по user_id для горячего пути хэндлеров.
+    Инвалидация увеличивает эпоху: результат запроса, начатого до неё, в кэш не попадёт.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.epoch = 0
+        self._data: OrderedDict[int, tuple[float, UserStatus]] = OrderedDict()
+
+    def get(self, user_id: int) -> Optional[UserStatus]:
+        item = self._data.get(user_id)
+        if item is None or item[0] < _time.monotonic():
+            if item is not None:
+                del self._data[user_id]
+            self.misses += 1
+            return None
+        self._data.move_to_end(user_id)
+        self.hits += 1
+        return item[1]
+
+    def put(self, user_id: int, status: UserStatus, epoch: int) -> None:
+        if epoch != self.epoch or self.maxsize <= 0:
+            return
+        self._data[user_id] = (_time.monotonic() + self.ttl, status)
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        self.epoch += 1
+        self._data.pop(user_id, None)
+
+    def clear(self) -> None:
+        self.epoch += 1
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return dict(hits=self.hits, misses=self.misses, size=len(self._data), maxsize=self.maxsize)
+
+_user_cache = _UserStatusCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+def user_cache_stats() -> dict:
+    return _user_cache.stats()
+
+async def get_user_status(user_id: int) -> UserStatus:
+    """approved/end_time/active одним запросом (или из кэша / индекса в памяти)."""
+    if _index is not None:
+        r = _index.get(user_id)
+        return UserStatus(r.approved, r.end_time, r.active) if r else UserStatus(False, None, False)
+    cached = _user_cache.get(user_id)
+    if cached is not None:
+        return cached
+    epoch = _user_cache.epoch
+    async with async_session() as session:
+        result = await session.execute(
+            select(User.approved, User.end_time, User.active).where(User.user_id == user_id)
+        )
+        row = result.first()
+    status = UserStatus(_truthy(row[0]), row[1], _truthy(row[2])) if row else UserStatus(False, None, False)
+    _user_cache.put(user_id, status, epoch)
+    return status
+
 # ---------- users ----------
 async def add_user(user_id: int):
-    async with async_session() as session:
+    async def op(session):
         row = await session.get(User, user_id)
         if not row:
             session.add(User(
                 user_id=user_id, name=None, end_time=None,
                 active=False, approved=False,
-                tminus3_sent=False, onday_sent=False, after_sent=False
             ))
-            await _safe_commit(session)
+            await _index_capture(session, [user_id])
+    await _write(op)
+    _user_cache.invalidate(user_id)
 
 async def approve_user(user_id: int, name: str):
     """Одобрить пользователя и сохранить имя (создать при необходимости)."""
     name = (name or "").strip()
-    async with async_session() as session:
+    async def op(session):
         row = await session.get(User, user_id)
         if row:
             row.approved = True
@@ -211,142 +827,805 @@ async def approve_user(user_id: int, name: str):
             session.add(User(
                 user_id=user_id, name=(name or None), end_time=None,
                 active=False, approved=True,
-                tminus3_sent=False, onday_sent=False, after_sent=False
             ))
-        await _safe_commit(session)
+        await _index_capture(session, [user_id])
+    await _write(op)
+    _user_cache.invalidate(user_id)
 
 async def set_end_time(user_id: int, end_time: str):
-    async with async_session() as session:
+    """Новая дата — новая версия для notification_log: все правила сработают заново."""
+    async def op(session):
         row = await session.get(User, user_id)
         if row:
             row.end_time = end_time
+            row.expiry = _end_time_to_epoch(end_time)
             row.active = True
-            row.tminus3_sent = False
-            row.onday_sent = False
-            row.after_sent = False
         else:
             session.add(User(
                 user_id=user_id, name=None, end_time=end_time,
+                expiry=_end_time_to_epoch(end_time),
                 active=True, approved=True,
-                tminus3_sent=False, onday_sent=False, after_sent=False
             ))
-        await _safe_commit(session)
+        await session.flush()
+        await _refresh_next_due(session, [user_id])
+    await _write(op)
+    _notify_user_changed(user_id)
 
 async def get_user_end_time(user_id: int) -> Optional[str]:
-    async with async_session() as session:
-        result = await session.execute(select(User.end_time).where(User.user_id == user_id))
-        return result.scalar()
+    return (await get_user_status(user_id)).end_time
 
 async def is_user_approved(user_id: int) -> bool:
+    return (await get_user_status(user_id)).approved
+
+async def _stream(q, chunk: int) -> AsyncIterator:
+    """
+    Строки запроса через серверный курсор: в памяти не больше chunk строк.
+    Всё чтение — одна транзакция (согласованный снимок), соединение из пула читателей
+    занято до конца итерации; при досрочном выходе закрывайте генератор (contextlib.aclosing).
+    """
     async with async_session() as session:
-        result = await session.execute(select(User.approved).where(User.user_id == user_id))
-        return _truthy(result.scalar())
+        result = await session.stream(q.execution_options(yield_per=chunk))
+        async for row in result:
+            yield row
+
+# NULL в SQLite идут первыми; user_id — rowid, он и так последний ключ индекса: без сортировки в памяти
+_ACTIVE_ORDER = (User.expiry, User.user_id)
+
+async def stream_active_users(chunk: int = STREAM_CHUNK) -> AsyncIterator[tuple[int, Optional[str]]]:
+    """
+    (user_id, end_time) активных в порядке ix_users_active_expiry: сначала без даты,
+    затем по (expiry, user_id) — так же обходит UserIndex.active_batches.
+    """
+    if _index is not None:
+        for batch in _index.active_batches(chunk):
+            for row in [(r.user_id, r.end_time) for r in batch]:
+                yield row
+        return
+    q = select(User.user_id, User.end_time).where(User.active == True).order_by(*_ACTIVE_ORDER)
+    async for r in _stream(q, chunk):
+        yield (r[0], r[1])
 
 async def get_active_users() -> list[tuple[int, str]]:
-    async with async_session() as session:
-        result = await session.execute(select(User.user_id, User.end_time).where(User.active == True))
-        return [(r[0], r[1]) for r in result.fetchall()]
+    return [row async for row in stream_active_users()]
+
+async def stream_active_users_with_flags(
+    chunk: int = STREAM_CHUNK,
+) -> AsyncIterator[tuple[int, Optional[str], bool, bool, bool]]:
+    """
+    (user_id, end_time, tminus3, onday, after) — отправлены ли встроенные правила для текущей даты;
+    порядок — как у stream_active_users.
+    """
+    ids = [next((r.id for r in _rules() if r.code == code), None) for code in ("tminus3", "onday", "after")]
+    if _index is not None:
+        for batch in _index.active_batches(chunk):
+            for row in [(r.user_id, r.end_time, *(rule_id in r.sent for rule_id in ids)) for r in batch]:
+                yield row
+        return
+    q = _select_with_sent(User.user_id, User.end_time).where(User.active == True).order_by(*_ACTIVE_ORDER)
+    async for uid, end_time, raw in _stream(q, chunk):
+        sent = _parse_sent(raw)
+        yield (uid, end_time, *(rule_id in sent for rule_id in ids))
 
 async def get_active_users_with_flags() -> list[tuple[int, Optional[str], bool, bool, bool]]:
+    return [row async for row in stream_active_users_with_flags()]
+
+# ---------- корзины уведомлений (range scan по ix_users_next_due) ----------
+class DueUser(NamedTuple):
+    user_id: int
+    end_time: Optional[str]
+    expiry: Optional[int]
+    tz: Optional[str]
+    notify_hour: Optional[int]
+    sent: frozenset[int]  # id правил, уже отправленных для этой версии end_time
+
+async def get_due_users(until_minute: int, limit: int) -> list[DueUser]:
+    """
+    Пользователи с next_due <= until_minute (обычно — одна текущая минута), по возрастанию next_due,
+    вместе с отправленными правилами — один запрос по ix_users_next_due + PK notification_log.
+    """
+    if _index is not None:
+        return [DueUser(r.user_id, r.end_time, r.expiry, r.tz, r.notify_hour, r.sent)
+                for r in _index.due(until_minute, limit)]
     async with async_session() as session:
         result = await session.execute(
-            select(User.user_id, User.end_time, User.tminus3_sent, User.onday_sent, User.after_sent)
-            .where(User.active == True)
+            _select_with_sent(User.user_id, User.end_time, User.expiry, User.tz, User.notify_hour)
+            .where(User.next_due <= until_minute)
+            .order_by(User.next_due)
+            .limit(limit)
         )
-        return [tuple(r) for r in result.fetchall()]  # type: ignore
+        return [DueUser(r[0], r[1], r[2], r[3], r[4], _parse_sent(r[5])) for r in result.fetchall()]
 
-async def update_active_status(user_id: int, active: bool):
+async def get_next_due_minute() -> Optional[int]:
+    """Ближайшая непустая корзина (MIN по индексу)."""
+    if _index is not None:
+        return _index.next_due_minute()
+    async with async_session() as session:
+        return (await session.execute(select(func.min(User.next_due)))).scalar()
+
+async def get_user_schedule(user_id: int) -> Optional[tuple[Optional[str], Optional[int]]]:
+    """(tz, notify_hour) или None, если пользователя нет."""
+    if _index is not None:
+        r = _index.get(user_id)
+        return (r.tz, r.notify_hour) if r else None
     async with async_session() as session:
+        row = (await session.execute(
+            select(User.tz, User.notify_hour).where(User.user_id == user_id)
+        )).first()
+        return (row[0], row[1]) if row else None
+
+async def set_user_schedule(user_id: int, tz: Optional[str], hour: Optional[int]) -> bool:
+    """Пояс и час напоминаний (None — по умолчанию); next_due пересчитывается сразу."""
+    async def op(session):
+        row = await session.get(User, user_id)
+        if not row:
+            return False
+        row.tz = tz
+        row.notify_hour = hour
+        await session.flush()
+        await _refresh_next_due(session, [user_id])
+        return True
+    changed = await _write(op)
+    if changed:
+        _notify_user_changed(user_id)
+    return changed
+
+async def update_active_status(user_id: int, active: bool):
+    async def op(session):
         row = await session.get(User, user_id)
         if row:
             row.active = active
-            await _safe_commit(session)
+            await session.flush()
+            await _refresh_next_due(session, [user_id])
+    await _write(op)
+    _notify_user_changed(user_id)
+
+BULK_CHUNK = 500  # держимся ниже лимита SQLite на число параметров
+
+# ---------- outbox ----------
+class OutboxIntent(NamedTuple):
+    user_id: int
+    kind: str
+    idem_key: str
+    text: str
+    expires_at: int
+    rule_id: int          # в notification_log вместе с постановкой в очередь
+    version: int          # users.expiry, для которого отправляем
+    deactivate: bool = False
+
+async def enqueue_notifications(intents: list[OutboxIntent], touched: Iterable[int] = (),
+                                now: Optional[datetime] = None) -> int:
+    """
+    Поставить уведомления в outbox и в той же транзакции записать их в notification_log
+    (и снять active, если так велит правило). Повтор с тем же idem_key игнорируется.
+    Возвращает число новых записей outbox.
+    touched — пользователи, разобранные планировщиком: им next_due сдвигается на следующее
+    будущее событие после now (открытые окна уже разобраны).
+    """
+    touched = list(touched)
+    if not intents and not touched:
+        return 0
+    deactivate = list(dict.fromkeys(i.user_id for i in intents if i.deactivate))
+    now_ts = int(_time.time())
+
+    async def op(session):
+        conn = await session.connection()  # Core: нужен rowcount, а не ORM bulk insert
+        created = 0
+        for i in range(0, len(intents), BULK_CHUNK):
+            chunk = intents[i:i + BULK_CHUNK]
+            result = await conn.execute(
+                sqlite_insert(Outbox).on_conflict_do_nothing(index_elements=["idem_key"]),
+                [dict(idem_key=it.idem_key, user_id=it.user_id, kind=it.kind, text=it.text,
+                      status="pending", attempts=0, next_at=now_ts, expires_at=it.expires_at,
+                      created_at=now_ts) for it in chunk],
+            )
+            created += max(result.rowcount or 0, 0)
+            await conn.execute(
+                sqlite_insert(NotificationLog).on_conflict_do_nothing(),
+                [dict(user_id=it.user_id, version=it.version, rule_id=it.rule_id, created_at=now_ts)
+                 for it in chunk],
+            )
+        for i in range(0, len(deactivate), BULK_CHUNK):
+            await conn.execute(
+                update(User).where(User.user_id.in_(deactivate[i:i + BULK_CHUNK])).values(active=False)
+            )
+        await _refresh_next_due(session, touched + [it.user_id for it in intents], include_open=False, now=now)
+        return created
+    created = await _write(op)
+    for user_id in deactivate:
+        _notify_user_changed(user_id)
+    return created
+
+async def claim_outbox(limit: int, now_ts: int, holder: str) -> list[tuple[int, int, str, str, int, Optional[int]]]:
+    """
+    Забрать до limit готовых к отправке записей, переведя их в 'sending' от имени holder.
+    (id, user_id, kind, text, attempts, expires_at)
+    """
+    async def op(session):
+        result = await session.execute(
+            select(Outbox.id, Outbox.user_id, Outbox.kind, Outbox.text, Outbox.attempts, Outbox.expires_at)
+            .where(Outbox.status == "pending", Outbox.next_at <= now_ts)
+            .order_by(Outbox.next_at, Outbox.id)
+            .limit(limit)
+        )
+        rows = [tuple(r) for r in result.fetchall()]
+        if rows:
+            await session.execute(
+                update(Outbox).where(Outbox.id.in_([r[0] for r in rows]))
+                .values(status="sending", attempts=Outbox.attempts + 1, claimed_by=holder, claimed_at=now_ts)
+            )
+        return rows
+    return await _write(op)
+
+async def complete_outbox(sent: list[int], retry: list[tuple[int, int, str]],
+                          failed: list[tuple[int, str, str]]) -> None:
+    """
+    Записать итоги отправки одной транзакцией.
+    sent — id; retry — (id, next_at, ошибка); failed — (id, статус, ошибка).
+    """
+    now_ts = int(_time.time())
+
+    async def op(session):
+        for i in range(0, len(sent), BULK_CHUNK):
+            await session.execute(
+                update(Outbox).where(Outbox.id.in_(sent[i:i + BULK_CHUNK]))
+                .values(status="sent", sent_at=now_ts, error=None)
+            )
+        for outbox_id, next_at, error in retry:
+            await session.execute(
+                update(Outbox).where(Outbox.id == outbox_id)
+                .values(status="pending", next_at=next_at, error=error[:500])
+            )
+        for outbox_id, status, error in failed:
+            await session.execute(
+                update(Outbox).where(Outbox.id == outbox_id).values(status=status, error=error[:500])
+            )
+    await _write(op)
+
+async def recover_outbox(holder: str, stale_before: int) -> int:
+    """
+    Записи в 'sending', отправитель которых пропал, могли уйти в Telegram до падения.
+    Повторно их не шлём (at-most-once для этого окна), помечаем 'unknown'.
+    Пропавшим считаем себя (holder: прошлый запуск с тем же INSTANCE_ID) и любого,
+    кто держит запись с момента раньше stale_before. Свежие чужие записи не трогаем:
+    прежний лидер, потерявший аренду, может ещё их отправлять и сам запишет итог.
+    """
+    async def op(session):
+        result = await session.execute(
+            update(Outbox).where(
+                Outbox.status == "sending",
+                (Outbox.claimed_by == holder) | Outbox.claimed_at.is_(None) | (Outbox.claimed_at < stale_before),
+            ).values(status="unknown")
+        )
+        return max(result.rowcount or 0, 0)
+    return await _write(op)
+
+async def prune_outbox(before_ts: int) -> int:
+    """Удалить завершённые записи старше before_ts."""
+    async def op(session):
+        result = await session.execute(
+            delete(Outbox).where(Outbox.status != "pending", Outbox.status != "sending",
+                                 Outbox.created_at < before_ts)
+        )
+        return max(result.rowcount or 0, 0)
+    return await _write(op)
+
+# ---------- leases ----------
+async def acquire_lease(name: str, holder: str, ttl: float) -> bool:
+    """
+    Взять или продлить аренду name на ttl секунд. Удаётся, если аренды нет,
+    она уже наша или истекла. Один UPSERT — атомарно между процессами.
+    Через lease_engine, а не _write: см. комментарий к нему.
+    """
+    now = _time.time()
+    stmt = sqlite_insert(Lease).values(name=name, holder=holder, expires_at=now + ttl, renewed_at=now)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["name"],
+        set_=dict(holder=stmt.excluded.holder, expires_at=stmt.excluded.expires_at,
+                  renewed_at=stmt.excluded.renewed_at),
+        where=(Lease.holder == holder) | (Lease.expires_at < now),
+    )
+
+    async with lease_engine.begin() as conn:  # отмена до коммита — rollback
+        result = await conn.execute(stmt)
+        return result.rowcount == 1
+
+async def release_lease(name: str, holder: str) -> None:
+    """Отдать аренду досрочно (если она ещё наша)."""
+    async with lease_engine.begin() as conn:
+        await conn.execute(delete(Lease).where(Lease.name == name, Lease.holder == holder))
 
-async def mark_flag(user_id: int, field: str, value: bool = True):
-    if field not in {"tminus3_sent", "onday_sent", "after_sent"}:
+# ---------- FSM ----------
+async def fsm_load(key: str) -> Optional[tuple[Optional[str], Optional[str], int]]:
+    """(state, data JSON, updated_at) или None."""
+    async with async_session() as session:
+        row = (await session.execute(
+            select(FsmState.state, FsmState.data, FsmState.updated_at).where(FsmState.key == key)
+        )).first()
+        return (row[0], row[1], row[2]) if row else None
+
+async def fsm_save_many(rows: list[tuple[str, Optional[str], Optional[str], int]]) -> None:
+    """
+    Записать пачку (key, state, data JSON, updated_at) одной транзакцией.
+    Пустая запись (нет state и данных) удаляется.
+    """
+    upserts = [dict(key=k, state=st, data=d, updated_at=ts) for k, st, d, ts in rows if st is not None or d]
+    deletes = [k for k, st, d, _ts in rows if st is None and not d]
+    if not upserts and not deletes:
         return
+    stmt = sqlite_insert(FsmState)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["key"],
+        set_=dict(state=stmt.excluded.state, data=stmt.excluded.data, updated_at=stmt.excluded.updated_at),
+    )
+
+    async def op(session):
+        conn = await session.connection()
+        for i in range(0, len(upserts), BULK_CHUNK):
+            await conn.execute(stmt, upserts[i:i + BULK_CHUNK])
+        for i in range(0, len(deletes), BULK_CHUNK):
+            await conn.execute(delete(FsmState).where(FsmState.key.in_(deletes[i:i + BULK_CHUNK])))
+    await _write(op)
+
+async def fsm_prune(before_ts: int) -> int:
+    """Удалить состояния, не менявшиеся с before_ts."""
+    async def op(session):
+        result = await session.execute(delete(FsmState).where(FsmState.updated_at < before_ts))
+        return max(result.rowcount or 0, 0)
+    return await _write(op)
+
+# ---------- broadcasts ----------
+_BROADCAST_COLUMNS = (Broadcast.id, Broadcast.text, Broadcast.status, Broadcast.cursor, Broadcast.total,
+                     Broadcast.sent, Broadcast.failed, Broadcast.chat_id, Broadcast.message_id)
+
+class BroadcastRow(NamedTuple):
+    id: int
+    text: str
+    status: str
+    cursor: int
+    total: int
+    sent: int
+    failed: int
+    chat_id: Optional[int]
+    message_id: Optional[int]
+
+async def count_active_users() -> int:
+    if _index is not None:
+        return _index.active_count()
     async with async_session() as session:
-        row = await session.get(User, user_id)
-        if row:
-            setattr(row, field, value)
-            await _safe_commit(session)
+        return (await session.execute(select(func.count()).where(User.active == True))).scalar_one()
+
+async def create_broadcast(text: str, chat_id: int, message_id: int) -> int:
+    total = await count_active_users()
+
+    async def op(session):
+        row = Broadcast(text=text, status="running", cursor=0, total=total, sent=0, failed=0,
+                        chat_id=chat_id, message_id=message_id, created_at=int(_time.time()))
+        session.add(row)
+        await session.flush()
+        return row.id
+    return await _write(op)
+
+async def get_broadcast(broadcast_id: int) -> Optional[BroadcastRow]:
+    async with async_session() as session:
+        row = (await session.execute(select(*_BROADCAST_COLUMNS).where(Broadcast.id == broadcast_id))).first()
+        return BroadcastRow(*row) if row else None
+
+async def next_running_broadcast() -> Optional[BroadcastRow]:
+    async with async_session() as session:
+        row = (await session.execute(
+            select(*_BROADCAST_COLUMNS).where(Broadcast.status == "running").order_by(Broadcast.id).limit(1)
+        )).first()
+        return BroadcastRow(*row) if row else None
+
+async def set_broadcast_status(broadcast_id: int, status: str, expected: Iterable[str]) -> bool:
+    """Сменить статус, только если текущий в expected (done/cancelled не воскрешаем)."""
+    async def op(session):
+        values = dict(status=status)
+        if status in ("done", "cancelled"):
+            values["finished_at"] = int(_time.time())
+        result = await session.execute(
+            update(Broadcast).where(Broadcast.id == broadcast_id, Broadcast.status.in_(list(expected)))
+            .values(**values)
+        )
+        return result.rowcount == 1
+    return await _write(op)
+
+async def save_broadcast_progress(broadcast_id: int, cursor: int, sent: int, failed: int) -> None:
+    """Чекпоинт после пачки: счётчики прибавляются, курсор сдвигается."""
+    async def op(session):
+        await session.execute(
+            update(Broadcast).where(Broadcast.id == broadcast_id)
+            .values(cursor=cursor, sent=Broadcast.sent + sent, failed=Broadcast.failed + failed)
+        )
+    await _write(op)
+
+async def get_active_user_ids_after(after: int, limit: int) -> list[int]:
+    """Следующая keyset-страница активных user_id (> after, по возрастанию)."""
+    if _index is not None:
+        return [r.user_id for r in _index.ids_after(after, limit, active_only=True)]
+    async with async_session() as session:
+        result = await session.execute(
+            select(User.user_id).where(User.active == True, User.user_id > after)
+            .order_by(User.user_id).limit(limit)
+        )
+        return [r[0] for r in result.fetchall()]
 
 # ---------- pending ----------
 async def add_pending(user_id: int) -> bool:
-    async with async_session() as session:
+    async def op(session):
         row = await session.get(User, user_id)
         if row and _truthy(row.approved):
             return False
         if await session.get(Pending, user_id):
             return False
-        from datetime import datetime
-        session.add(Pending(user_id=user_id, created_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-        await _safe_commit(session)
+        created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        session.add(Pending(user_id=user_id, created_at=created_at))
+        _index_capture_pending(session, [user_id], created_at)
         return True
+    return await _write(op)
 
 async def remove_pending(user_id: int):
-    async with async_session() as session:
+    async def op(session):
         row = await session.get(Pending, user_id)
         if row:
             await session.delete(row)
-            await _safe_commit(session)
+            _index_capture_pending(session, [user_id], None)
+    await _write(op)
 
 async def get_pending_users() -> list[tuple[int, str]]:
+    if _index is not None:
+        return _index.pending()
     async with async_session() as session:
         result = await session.execute(select(Pending.user_id, Pending.created_at))
         return [(r[0], r[1]) for r in result.fetchall()]
 
 # ---------- dashboard / lists ----------
-async def get_all_users() -> list[tuple[int, Optional[str], Optional[str], bool, bool]]:
-    """(user_id, name, end_time, approved, active)"""
+# Порядок списков: сначала с датой по (expiry, user_id), затем без даты по user_id.
+# Оба сегмента читаются по индексу ix_users_expiry_uid, без сортировки всей таблицы.
+DashboardRow = tuple[int, Optional[str], Optional[str], bool, bool, Optional[int]]
+_DASHBOARD_COLUMNS = (User.user_id, User.name, User.end_time, User.approved, User.active, User.expiry)
+
+async def get_dashboard_counts() -> tuple[int, int]:
+    """(всего, с датой) одним агрегатом."""
+    if _index is not None:
+        return _index.counts()
     async with async_session() as session:
-        result = await session.execute(
-            select(User.user_id, User.name, User.end_time, User.approved, User.active)
-        )
-        return [tuple(r) for r in result.fetchall()]  # type: ignore
+        result = await session.execute(select(func.count(), func.count(User.expiry)))
+        total, with_date = result.one()
+        return int(total), int(with_date)
 
-# ---------- settings ----------
-async def get_settings() -> dict:
+async def _dated_rows(session, cursor, backward: bool, limit: int) -> list:
+    if _index is not None:
+        return _index.dated_rows(cursor, backward, limit)
+    stmt = select(*_DASHBOARD_COLUMNS).where(User.expiry.is_not(None))
+    key = tuple_(User.expiry, User.user_id)
+    if cursor is not None:
+        stmt = stmt.where(key < tuple_(*cursor) if backward else key > tuple_(*cursor))
+    if backward:
+        stmt = stmt.order_by(User.expiry.desc(), User.user_id.desc())
+    else:
+        stmt = stmt.order_by(User.expiry, User.user_id)
+    return (await session.execute(stmt.limit(limit))).fetchall()
+
+async def _undated_rows(session, after_uid: Optional[int], backward: bool, limit: int) -> list:
+    if _index is not None:
+        return _index.undated_rows(after_uid, backward, limit)
+    stmt = select(*_DASHBOARD_COLUMNS).where(User.expiry.is_(None))
+    if after_uid is not None:
+        stmt = stmt.where(User.user_id < after_uid if backward else User.user_id > after_uid)
+    stmt = stmt.order_by(User.user_id.desc() if backward else User.user_id)
+    return (await session.execute(stmt.limit(limit))).fetchall()
+
+async def get_dashboard_page(
+    filter_mode: str,
+    cursor: Optional[tuple[Optional[int], int]] = None,
+    backward: bool = False,
+    limit: int = 20,
+) -> tuple[list[DashboardRow], bool]:
+    """
+    Keyset-страница дашборда.
+    cursor — (expiry, user_id) строки, после которой (или до которой при backward) читаем;
+    None — с начала (или с конца при backward). filter_mode: all / with / without.
+    Возвращает (строки в прямом порядке, есть ли ещё строки в направлении чтения).
+    """
+    want_dated = filter_mode in ("all", "with")
+    want_undated = filter_mode in ("all", "without")
+    cursor_dated = cursor is not None and cursor[0] is not None
+    cursor_undated = cursor is not None and cursor[0] is None
+    fetch = limit + 1
+    rows: list = []
     async with async_session() as session:
-        row = await session.get(Settings, 1)
-        if not row:
-            row = Settings(id=1)
-            session.add(row)
-            await _safe_commit(session)
-        return dict(
-            master=bool(row.notif_master),
-            tminus3=bool(row.notif_tminus3),
-            onday=bool(row.notif_onday),
-            after=bool(row.notif_after),
+        if not backward:
+            if want_dated and not cursor_undated:
+                rows += await _dated_rows(session, cursor if cursor_dated else None, False, fetch)
+            if want_undated and len(rows) < fetch:
+                after = cursor[1] if cursor_undated else None
+                rows += await _undated_rows(session, after, False, fetch - len(rows))
+        else:
+            if want_undated and not cursor_dated:
+                before = cursor[1] if cursor_undated else None
+                rows += await _undated_rows(session, before, True, fetch)
+            if want_dated and len(rows) < fetch:
+                rows += await _dated_rows(session, cursor if cursor_dated else None, True, fetch - len(rows))
+    more = len(rows) > limit
+    rows = [tuple(r) for r in rows[:limit]]
+    if backward:
+        rows.reverse()
+    return rows, more  # type: ignore
+
+async def get_users_slice(offset: int, limit: int) -> list[DashboardRow]:
+    """Срез [offset, offset+limit) в порядке дашборда (для пикера с номерами страниц)."""
+    if _index is not None:
+        return _index.slice(offset, limit)
+    _total, with_date = await get_dashboard_counts()
+    rows: list = []
+    async with async_session() as session:
+        if offset < with_date:
+            result = await session.execute(
+                select(*_DASHBOARD_COLUMNS).where(User.expiry.is_not(None))
+                .order_by(User.expiry, User.user_id).offset(offset).limit(limit)
+            )
+            rows += result.fetchall()
+        if len(rows) < limit:
+            result = await session.execute(
+                select(*_DASHBOARD_COLUMNS).where(User.expiry.is_(None))
+                .order_by(User.user_id).offset(max(0, offset - with_date)).limit(limit - len(rows))
+            )
+            rows += result.fetchall()
+    return [tuple(r) for r in rows]  # type: ignore
+
+# ---------- импорт / экспорт ----------
+IMPORT_CHUNK = 400  # строк на один INSERT: 7 параметров на строку, ниже лимита SQLite
+
+async def upsert_users(rows: Iterable[tuple[int, Optional[str], Optional[str]]]) -> tuple[int, int]:
+    """
+    Импорт пачки (user_id, name, end_time) одной транзакцией: то же, что approve_user + set_end_time.
+    Пустые name/end_time не затирают текущие. Уведомления привязаны к версии end_time
+    (notification_log), так что повторный импорт того же файла ничего не переотправит.
+    Возвращает (inserted, updated).
+    """
+    by_uid: dict[int, tuple[Optional[str], Optional[str]]] = {}
+    for user_id, name, end_time in rows:
+        if not 0 < int(user_id) <= MAX_USER_ID:
+            raise ValueError(f"user_id out of range: {user_id}")
+        by_uid[int(user_id)] = (name or None, end_time or None)  # дубликаты: побеждает последняя строка
+    if not by_uid:
+        return 0, 0
+
+    values = [
+        dict(user_id=uid, name=name, end_time=end_time, expiry=_end_time_to_epoch(end_time),
+             active=end_time is not None, approved=True)
+        for uid, (name, end_time) in by_uid.items()
+    ]
+    stmt = sqlite_insert(User)
+    ex = stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id"],
+        set_=dict(
+            name=func.coalesce(ex.name, User.name),
+            end_time=func.coalesce(ex.end_time, User.end_time),
+            expiry=func.coalesce(ex.expiry, User.expiry),
+            approved=True,
+            active=case((ex.end_time.is_not(None), True), else_=User.active),
+        ),
+    )
+
+    async def op(session):
+        conn = await session.connection()
+        existing = 0
+        for i in range(0, len(values), IMPORT_CHUNK):
+            chunk = values[i:i + IMPORT_CHUNK]
+            ids = [v["user_id"] for v in chunk]
+            existing += (await conn.execute(
+                select(func.count()).select_from(User).where(User.user_id.in_(ids))
+            )).scalar_one()
+            await conn.execute(stmt, chunk)
+            await _refresh_next_due(session, [v["user_id"] for v in chunk if v["end_time"] is not None])
+            await conn.execute(delete(Pending).where(Pending.user_id.in_(ids)))
+            await _index_capture(session, [v["user_id"] for v in chunk if v["end_time"] is None])
+            _index_capture_pending(session, ids, None)
+        return existing
+    updated = await _write(op)
+
+    for uid, (_name, end_time) in by_uid.items():
+        if end_time is not None:
+            _notify_user_changed(uid)  # планировщику — только тем, у кого новая дата
+        else:
+            _user_cache.invalidate(uid)
+    return len(values) - updated, updated
+
+async def stream_all_users(
+    chunk: int = STREAM_CHUNK,
+) -> AsyncIterator[tuple[int, Optional[str], Optional[str], bool, bool]]:
+    """Все пользователи (user_id, name, end_time, approved, active) по возрастанию user_id."""
+    if _index is not None:
+        after = None
+        while batch := _index.ids_after(after, chunk):
+            after = batch[-1].user_id
+            for row in [(r.user_id, r.name, r.end_time, r.approved, r.active) for r in batch]:
+                yield row
+        return
+    q = select(User.user_id, User.name, User.end_time, User.approved, User.active).order_by(User.user_id)
+    async for r in _stream(q, chunk):
+        yield (r[0], r[1], r[2], _truthy(r[3]), _truthy(r[4]))
+
+async def get_all_users() -> list[tuple[int, Optional[str], Optional[str], bool, bool]]:
+    """(user_id, name, end_time, approved, active) — весь список в памяти; для больших таблиц stream_all_users()."""
+    return [row async for row in stream_all_users()]
+
+# ---------- settings и правила уведомлений ----------
+# Меняются редко: держим копию в памяти процесса.
+# Заполняется в init_db(), обновляется toggle_setting()/set_all_notifications() после коммита.
+# Их может поменять другая реплика — планировщик перечитывает кэш каждый тик (reload_settings).
+_settings_cache: Optional[dict] = None
+_rules_cache: tuple[Rule, ...] = ()
+
+def _rule_from_row(row: NotificationRule) -> Optional[Rule]:
+    """Строка -> Rule; битое правило (якорь, время, шаблон) пропускаем с ошибкой в лог."""
+    try:
+        rule = Rule(
+            id=row.id, code=row.code, title=row.title or row.code, anchor=row.anchor,
+            offset_days=row.offset_days or 0, offset_minutes=row.offset_minutes or 0,
+            local_time=parse_local_time(row.local_time),
+            window=timedelta(minutes=row.window_minutes or 0),
+            template=row.template, only_before_end=_truthy(row.only_before_end),
+            deactivate=_truthy(row.deactivate), enabled=_truthy(row.enabled),
         )
+        if rule.anchor not in ANCHORS:
+            raise ValueError(f"unknown anchor {rule.anchor!r}")
+        render(rule, datetime.now(TZ))
+        return rule
+    except Exception as e:
+        logger.error("Notification rule %s (%s) is invalid, skipped: %r", row.id, row.code, e)
+        return None
 
-async def toggle_setting(key: str) -> dict:
-    key_map = {"master": "notif_master", "tminus3": "notif_tminus3", "onday": "notif_onday", "after": "notif_after"}
-    if key not in key_map:
-        return await get_settings()
-    attr = key_map[key]
+def _rules() -> tuple[Rule, ...]:
+    return _rules_cache
+
+def get_rules() -> tuple[Rule, ...]:
+    """Действующие правила уведомлений (включая выключенные), по id."""
+    return _rules_cache
+
+def _settings_dict(master, rules: tuple[Rule, ...]) -> dict:
+    """{"master": bool, <code правила>: enabled, ...}"""
+    return dict(master=bool(master), **{r.code: r.enabled for r in rules})
+
+def _apply_settings(master: Optional[bool], enabled: dict[int, bool]) -> None:
+    """Кэши — из значений, закоммиченных писателем (after-commit), без повторного чтения."""
+    global _settings_cache, _rules_cache
+    _rules_cache = tuple(r._replace(enabled=enabled[r.id]) if r.id in enabled else r for r in _rules_cache)
+    if master is None:
+        master = (_settings_cache or {}).get("master", True)
+    _settings_cache = _settings_dict(master, _rules_cache)
+
+async def _read_settings(session) -> Optional[Settings]:
+    """Строка settings + правила -> кэши процесса; None, если строки нет."""
+    global _settings_cache, _rules_cache
+    row = await session.get(Settings, 1)
+    if row is None:
+        return None
+    rule_rows = (await session.execute(select(NotificationRule).order_by(NotificationRule.id))).scalars().all()
+    _rules_cache = tuple(r for r in map(_rule_from_row, rule_rows) if r is not None)
+    _settings_cache = _settings_dict(row.notif_master, _rules_cache)
+    return row
+
+async def reload_settings() -> dict:
+    """Перечитать settings и правила из БД в кэш: чтение по PK и маленькая таблица правил."""
     async with async_session() as session:
-        row = await session.get(Settings, 1)
-        if not row:
-            row = Settings(id=1)
-            session.add(row)
-        current = bool(getattr(row, attr, False))
-        setattr(row, attr, not current)
-        await _safe_commit(session)
+        row = await _read_settings(session)
+    if row is None:
+        async def op(session):
+            await session.execute(_settings_row_insert())
+        await _write(op)
+        async with async_session() as session:
+            await _read_settings(session)
+    return dict(_settings_cache)
+
+async def _startup_read(migrated: bool = False) -> Optional[str]:
+    """
+    Одна читающая транзакция при старте: версия схемы, settings и правила.
+    Возвращает settings.rules_hash ("" — пересчёта ещё не было) или None, если нужна миграция.
+    """
+    async with async_session() as session:
+        version = await _read_schema_version(session)
+        if version < SCHEMA_VERSION:
+            if migrated:
+                raise RuntimeError(f"DB schema is at version {version} after migration, expected {SCHEMA_VERSION}")
+            return None
+        row = await _read_settings(session)
+    if row is None:
+        await reload_settings()  # строку удалили руками — создаём заново
+        return ""
+    return row.rules_hash or ""
+
+async def get_settings() -> dict:
+    if _settings_cache is None:
+        return await reload_settings()
+    return dict(_settings_cache)
+
+async def toggle_setting(key: str) -> dict:
+    """Переключить "master" или правило по code."""
+    async def op(session):
+        if key == "master":
+            row = await session.get(Settings, 1)
+            if not row:
+                row = Settings(id=1, notif_master=True)
+                session.add(row)
+            master = row.notif_master = not bool(row.notif_master)
+            _after_commit(session, lambda: _apply_settings(master, {}))
+        else:
+            rule = (await session.execute(
+                select(NotificationRule).where(NotificationRule.code == key)
+            )).scalar_one_or_none()
+            if rule is not None:
+                rule.enabled = not _truthy(rule.enabled)
+                enabled = {rule.id: rule.enabled}
+                _after_commit(session, lambda: _apply_settings(None, enabled))
+    await _write(op)
     return await get_settings()
 
 async def set_all_notifications(value: bool) -> dict:
-    async with async_session() as session:
+    async def op(session):
         row = await session.get(Settings, 1)
         if not row:
             row = Settings(id=1)
             session.add(row)
         row.notif_master = value
-        row.notif_tminus3 = value
-        row.notif_onday = value
-        row.notif_after = value
-        await _safe_commit(session)
+        await session.execute(update(NotificationRule).values(enabled=value))
+        _after_commit(session, lambda: _apply_settings(value, {r.id: value for r in _rules_cache}))
+    await _write(op)
     return await get_settings()
 
+async def recompute_next_due(chunk: int = BULK_CHUNK) -> int:
+    """Пересчитать next_due всем активным (после изменения правил), пачками через писателя."""
+    stale = (func.coalesce(User.active, False) == False, User.next_due.is_not(None))
+
+    async def clear(session):
+        ids = [r[0] for r in (await session.execute(select(User.user_id).where(*stale))).fetchall()] \
+            if _index is not None else []
+        await session.execute(update(User).where(*stale).values(next_due=None))
+        await _index_capture(session, ids)
+    await _write(clear)
+    after, total = None, 0
+    while True:
+        async with async_session() as session:
+            q = select(User.user_id).where(User.active == True)
+            if after is not None:
+                q = q.where(User.user_id > after)
+            ids = [r[0] for r in (await session.execute(q.order_by(User.user_id).limit(chunk))).fetchall()]
+        if not ids:
+            return total
+
+        async def op(session, ids=ids):
+            await _refresh_next_due(session, ids)
+        await _write(op)
+        total += len(ids)
+        after = ids[-1]
+
+async def _recompute_next_due_if_rules_changed(current: Optional[str]) -> None:
+    """Правила (или пояс/час по умолчанию) поменялись с прошлого запуска — пересчитать next_due."""
+    signature = timing_signature(_rules())
+    if current == signature:
+        return
+    total = await recompute_next_due()
+
+    async def op(session):
+        await session.execute(update(Settings).where(Settings.id == 1).values(rules_hash=signature))
+    await _write(op)
+    logger.info("Notification timing changed: next_due recomputed for %d users", total)
+
+async def ping_db() -> bool:
+    """Проверка для /healthz: читающее соединение отвечает."""
+    async with read_engine.connect() as conn:
+        await conn.exec_driver_sql("SELECT 1")
+    return True
+
 async def dispose_db():
+    """Только при выходе процесса: после неё нужен init_db() (в том числе для индекса в памяти)."""
+    global _index
+    await _writer.close()
+    _index = None
     await engine.dispose()
+    await read_engine.dispose()
+    await migrate_engine.dispose()
+    await lease_engine.dispose()
@@ -0,0 +1,162 @@
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from app.db import DatabaseClosed, fsm_load, fsm_prune, fsm_save_many
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+PRUNE_EVERY = 3600  # сек между чистками таблицы по TTL
+
+
+@dataclass
+class _Record:
+    state: Optional[str]
+    data: str          # JSON
+    updated_at: int    # epoch
+    dirty: bool = False
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище aiogram в таблице fsm_states.
+    - чтение: LRU-кэш на cache_size ключей, промах — один SELECT по PK;
+    - запись: write-back — изменения копятся в кэше и раз в flush_interval
+      уходят одной транзакцией через писателя БД (за сбой теряется не больше интервала);
+    - состояния старше ttl считаются пустыми и периодически удаляются из таблицы.
+    Кэш у каждого процесса свой: при нескольких репликах в webhook-режиме апдейты
+    одного пользователя должны приходить на одну реплику.
+    """
+
+    def __init__(
+        self,
+        ttl: float = Config.FSM_TTL,
+        cache_size: int = Config.FSM_CACHE_SIZE,
+        flush_interval: float = Config.FSM_FLUSH_SECONDS,
+        key_builder: Optional[KeyBuilder] = None,
+    ):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache: OrderedDict[str, _Record] = OrderedDict()
+        self._evicted: Dict[str, _Record] = {}  # вытеснены из кэша, но ещё не записаны
+        self._flusher: Optional[asyncio.Task] = None
+        self._last_prune = 0.0
+
+    # --- BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f"Data must be a dict, got {type(data).__name__}")
+        record = await self._record(key)
+        record.data = json.dumps(data, ensure_ascii=False) if data else ""  # TypeError — сразу в хэндлере
+        self._touch(record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        record = await self._record(key)
+        return json.loads(record.data) if record.data else {}
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            task, self._flusher = self._flusher, None
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        await self.flush()
+
+    # --- кэш ---
+
+    def _expired(self, record: _Record) -> bool:
+        return self.ttl > 0 and record.updated_at < time.time() - self.ttl
+
+    async def _record(self, key: StorageKey) -> _Record:
+        k = self.key_builder.build(key)
+        record = self._cache.get(k)
+        if record is None:
+            record = self._evicted.pop(k, None)
+            if record is None:
+                row = await fsm_load(k)
+                record = self._cache.get(k)  # пока ждали БД, ключ мог появиться
+                if record is None:
+                    record = _Record(row[0], row[1] or "", row[2]) if row else _Record(None, "", int(time.time()))
+            self._put(k, record)
+        else:
+            self._cache.move_to_end(k)
+        if self._expired(record):
+            record.state, record.data = None, ""
+            self._touch(record)
+        return record
+
+    def _put(self, k: str, record: _Record) -> None:
+        self._cache[k] = record
+        while len(self._cache) > self.cache_size:
+            old_key, old = self._cache.popitem(last=False)
+            if old.dirty:
+                self._evicted[old_key] = old
+
+    def _touch(self, record: _Record) -> None:
+        record.updated_at = int(time.time())
+        record.dirty = True
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    # --- write-back ---
+
+    async def flush(self) -> int:
+        """Записать все изменённые состояния. Возвращает их число."""
+        # вытесненные остаются в _evicted до конца записи, иначе промах кэша
+        # во время await прочитал бы из БД старую версию
+        evicted = list(self._evicted.items())
+        batch = evicted + [(k, r) for k, r in self._cache.items() if r.dirty]
+        if not batch:
+            return 0
+        rows = [(k, r.state, r.data, r.updated_at) for k, r in batch]
+        for _k, r in batch:
+            r.dirty = False
+        try:
+            await fsm_save_many(rows)
+        except Exception:
+            for _k, r in batch:
+                r.dirty = True
+            raise
+        for k, r in evicted:
+            if self._evicted.get(k) is r and not r.dirty:
+                del self._evicted[k]
+        return len(rows)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if self.ttl > 0 and time.monotonic() - self._last_prune > PRUNE_EVERY:
+                    self._last_prune = time.monotonic()
+                    pruned = await fsm_prune(int(time.time() - self.ttl))
+                    if pruned:
+                        logger.info("FSM: pruned %d stale states", pruned)
+            except DatabaseClosed:
+                # БД закрыта при выходе (dispose_db); изменения после close() не сохранятся
+                logger.warning("FSM: database closed, %d unsaved states dropped",
+                               len(self._evicted) + sum(1 for r in self._cache.values() if r.dirty))
+                return
+            except Exception:
+                logger.exception("FSM flush failed")
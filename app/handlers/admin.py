@@ -1,48 +1,57 @@
+import html
+import os
+import tempfile
+from contextlib import aclosing
+from datetime import datetime
+
 from aiogram import Router, F, types
 from aiogram.fsm.context import FSMContext
 from aiogram.exceptions import TelegramBadRequest
 
 from app.db import (
-    get_pending_users, approve_user, remove_pending, get_active_users,
-    get_user_end_time, set_end_time, get_all_users,
-    get_settings, toggle_setting, set_all_notifications,
+    get_pending_users, approve_user, remove_pending, stream_active_users,
+    get_user_end_time, set_end_time,
+    get_dashboard_counts, get_dashboard_page, get_users_slice,
+    reload_settings, get_rules, toggle_setting, set_all_notifications,
+    count_active_users, create_broadcast, get_broadcast, set_broadcast_status, MAX_USER_ID,
 )
 from app.keyboards import (
     admin_menu_kb, approvals_keyboard_from_list, back_to_admin_menu_kb,
     admin_dashboard_kb, admin_notifications_kb,
     admin_set_picker_kb, back_to_set_list_kb,
+    broadcast_confirm_kb,
 )
-from app.states import AddUserSG, SetEndSG, CheckUserSG, ApproveUserSG
+from app import broadcast
+from app.sender import get_sender
+from app.states import AddUserSG, SetEndSG, CheckUserSG, ApproveUserSG, ImportUsersSG, BroadcastSG
+from app.user_io import import_users_file, export_users_csv
 from config import Config
 
 router = Router()
 
 PAGE_SIZE = 20
+ACTIVE_LIST_CHARS = 3500  # список активных — в одно сообщение (лимит Telegram 4096)
+
+def _cursor_str(row) -> str:
+    """Ключ строки для callback_data: '<expiry|->.<user_id>'."""
+    expiry = row[5]
+    return f"{'-' if expiry is None else expiry}.{row[0]}"
+
+def _parse_cursor(raw: str) -> tuple[int | None, int]:
+    expiry, uid = raw.split(".", 1)
+    return (None if expiry == "-" else int(expiry)), int(uid)
 
 def _format_dashboard_page(
-    users: list[tuple[int, str|None, str|None, bool, bool]],
+    rows: list[tuple[int, str|None, str|None, bool, bool, int|None]],
+    total: int,
+    with_date_cnt: int,
     filter_mode: str,
     page: int,
-) -> tuple[str, bool, bool, int, int]:
-    total = len(users)
-    with_date_cnt = sum(1 for _, __, et, ___, ____ in users if et)
+) -> tuple[str, int, int]:
     without_date_cnt = total - with_date_cnt
-
-    if filter_mode == "with":
-        users_f = [u for u in users if u[2]]
-    elif filter_mode == "without":
-        users_f = [u for u in users if not u[2]]
-    else:
-        users_f = list(users)
-
-    users_f.sort(key=lambda u: (0 if u[2] else 1, u[2] or "9999-99-99 99:99:99"))
-
-    total_pages = max(1, (len(users_f) + PAGE_SIZE - 1) // PAGE_SIZE)
+    filtered = {"with": with_date_cnt, "without": without_date_cnt}.get(filter_mode, total)
+    total_pages = max(1, (filtered + PAGE_SIZE - 1) // PAGE_SIZE)
     page = max(0, min(page, total_pages - 1))
-    start, end = page * PAGE_SIZE, page * PAGE_SIZE + PAGE_SIZE
-    page_slice = users_f[start:end]
-    has_prev = page > 0
-    has_next = page < (total_pages - 1)
 
     header = (
         "📊 <b>Дэшборд пользователей</b>\n"
@@ -50,14 +59,14 @@ def _format_dashboard_page(
         f"Стр. {page+1}/{total_pages} | Фильтр: <i>"
         f"{'все' if filter_mode=='all' else ('с датой' if filter_mode=='with' else 'без даты')}</i>\n"
     )
-    if not page_slice:
-        return header + "\n(нет записей для показа)", has_prev, has_next, page, total_pages
+    if not rows:
+        return header + "\n(нет записей для показа)", page, total_pages
 
     lines = [
         "<pre>NAME                  UID        END_TIME            APPROVED ACTIVE",
         "-------------------------------------------------------------------"
     ]
-    for uid, name, et, approved, active in page_slice:
+    for uid, name, et, approved, active, _expiry in rows:
         nm = (name or "—")[:20]
         et_disp = et if et else "—"
         appr = "✅" if approved else "❌"
@@ -65,7 +74,39 @@ def _format_dashboard_page(
         lines.append(f"{nm:<20} {str(uid):<10} {et_disp:<19} {appr:^8} {act:^6}")
     lines.append("</pre>")
     text = header + "\n".join(lines)
-    return text, has_prev, has_next, page, total_pages
+    return text, page, total_pages
+
+async def _dashboard_view(filter_mode: str, page: int = 0, direction: str | None = None,
+                          cursor: tuple[int | None, int] | None = None):
+    """Текст и клавиатура страницы дашборда (keyset: page — только для подписи)."""
+    backward = direction == "p"
+    if cursor is None:
+        page, backward = 0, False
+    rows, more = await get_dashboard_page(filter_mode, cursor, backward, PAGE_SIZE)
+    if not rows and cursor is not None:
+        # данные изменились между нажатиями — начинаем сначала
+        rows, more = await get_dashboard_page(filter_mode, None, False, PAGE_SIZE)
+        page, cursor, backward = 0, None, False
+    total, with_date_cnt = await get_dashboard_counts()
+    text, page, _ = _format_dashboard_page(rows, total, with_date_cnt, filter_mode, page)
+    if backward:
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = cursor is not None, more
+    kb = admin_dashboard_kb(
+        filter_mode, page, has_prev, has_next,
+        prev_cursor=_cursor_str(rows[0]) if rows else None,
+        next_cursor=_cursor_str(rows[-1]) if rows else None,
+    )
+    return text, kb
+
+async def _set_picker_items(page: int):
+    total, _with_date = await get_dashboard_counts()
+    total_pages = max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
+    page = max(0, min(page, total_pages - 1))
+    rows = await get_users_slice(page * PAGE_SIZE, PAGE_SIZE)
+    items = [(uid, name, et) for uid, name, et, _appr, _act, _exp in rows]
+    return items, page, total_pages
 
 # ----- back -----
 @router.callback_query(F.data == "admin_back")
@@ -87,9 +128,7 @@ async def admin_dashboard(cb: types.CallbackQuery):
     if cb.from_user.id != Config.ADMIN_ID:
         await cb.answer("Недостаточно прав.", show_alert=True)
         return
-    users = await get_all_users()
-    text, has_prev, has_next, page, _ = _format_dashboard_page(users, "all", 0)
-    kb = admin_dashboard_kb("all", page, has_prev, has_next)
+    text, kb = await _dashboard_view("all")
     try:
         await cb.message.edit_text(text, reply_markup=kb)
     except TelegramBadRequest:
@@ -104,17 +143,19 @@ async def admin_dashboard_page(cb: types.CallbackQuery):
     if cb.from_user.id != Config.ADMIN_ID:
         await cb.answer("Недостаточно прав.", show_alert=True)
         return
+    # admin_dash:<filter>:<page>[:<n|p>:<cursor>]
+    direction, cursor = None, None
     try:
-        _, filter_mode, page_str = cb.data.split(":", 2)
-        page = int(page_str)
+        parts = cb.data.split(":")
+        filter_mode, page = parts[1], int(parts[2])
+        if len(parts) == 5 and parts[3] in {"n", "p"}:
+            direction, cursor = parts[3], _parse_cursor(parts[4])
         if filter_mode not in {"all", "with", "without"}:
-            filter_mode = "all"
+            filter_mode, direction, cursor = "all", None, None
     except Exception:
-        filter_mode, page = "all", 0
+        filter_mode, page, direction, cursor = "all", 0, None, None
 
-    users = await get_all_users()
-    text, has_prev, has_next, page, _ = _format_dashboard_page(users, filter_mode, page)
-    kb = admin_dashboard_kb(filter_mode, page, has_prev, has_next)
+    text, kb = await _dashboard_view(filter_mode, page, direction, cursor)
     try:
         await cb.message.edit_text(text, reply_markup=kb)
     except TelegramBadRequest as e:
@@ -127,22 +168,20 @@ async def admin_dashboard_page(cb: types.CallbackQuery):
             raise
     await cb.answer()
 
-# ----- notifications (без изменений) -----
+# ----- notifications: master + правила notification_rules -----
+def _notifications_view(s: dict, footer: str = "") -> tuple[str, types.InlineKeyboardMarkup]:
+    rules = get_rules()
+    lines = [f"Все: {'<b>Вкл</b>' if s['master'] else '<b>Выкл</b>'}"]
+    lines += [f"{html.escape(r.title)}: {'Вкл' if r.enabled else 'Выкл'}" for r in rules]
+    text = "🔔 <b>Уведомления</b>\n" + "\n".join(lines) + "\n" + footer
+    return text, admin_notifications_kb(s, rules)
+
 @router.callback_query(F.data == "admin_notifications")
 async def admin_notifications(cb: types.CallbackQuery):
     if cb.from_user.id != Config.ADMIN_ID:
         await cb.answer("Недостаточно прав.", show_alert=True)
         return
-    s = await get_settings()
-    text = (
-        "🔔 <b>Уведомления</b>\n"
-        f"Все: {'<b>Вкл</b>' if s['master'] else '<b>Выкл</b>'}\n"
-        f"−3 дня в 11:00: {'Вкл' if s['tminus3'] else 'Выкл'}\n"
-        f"В день 11:00: {'Вкл' if s['onday'] else 'Выкл'}\n"
-        f"После окончания (1ч): {'Вкл' if s['after'] else 'Выкл'}\n"
-        "\nНажмите на пункт, чтобы переключить."
-    )
-    kb = admin_notifications_kb(s)
+    text, kb = _notifications_view(await reload_settings(), "\nНажмите на пункт, чтобы переключить.")
     try:
         await cb.message.edit_text(text, reply_markup=kb)
     except TelegramBadRequest:
@@ -158,15 +197,7 @@ async def admin_notifications_toggle(cb: types.CallbackQuery):
         await cb.answer("Недостаточно прав.", show_alert=True)
         return
     key = cb.data.split(":", 1)[1]
-    s = await toggle_setting(key)
-    text = (
-        "🔔 <b>Уведомления</b>\n"
-        f"Все: {'<b>Вкл</b>' if s['master'] else '<b>Выкл</b>'}\n"
-        f"−3 дня в 11:00: {'Вкл' if s['tminus3'] else 'Выкл'}\n"
-        f"В день 11:00: {'Вкл' if s['onday'] else 'Выкл'}\n"
-        f"После окончания (1ч): {'Вкл' if s['after'] else 'Выкл'}\n"
-    )
-    kb = admin_notifications_kb(s)
+    text, kb = _notifications_view(await toggle_setting(key))
     try:
         await cb.message.edit_text(text, reply_markup=kb)
     except TelegramBadRequest as e:
@@ -185,15 +216,7 @@ async def admin_notifications_setall(cb: types.CallbackQuery):
         await cb.answer("Недостаточно прав.", show_alert=True)
         return
     val = cb.data.split(":", 1)[1]
-    s = await set_all_notifications(val == "on")
-    text = (
-        "🔔 <b>Уведомления</b>\n"
-        f"Все: {'<b>Вкл</b>' if s['master'] else '<b>Выкл</b>'}\n"
-        f"−3 дня в 11:00: {'Вкл' if s['tminus3'] else 'Выкл'}\n"
-        f"В день 11:00: {'Вкл' if s['onday'] else 'Выкл'}\n"
-        f"После окончания (1ч): {'Вкл' if s['after'] else 'Выкл'}\n"
-    )
-    kb = admin_notifications_kb(s)
+    text, kb = _notifications_view(await set_all_notifications(val == "on"))
     try:
         await cb.message.edit_text(text, reply_markup=kb)
     except TelegramBadRequest:
@@ -268,15 +291,14 @@ async def admin_approve_save_name(message: types.Message, state: FSMContext):
     await remove_pending(int(uid))
     await state.clear()
 
-    # уведомим пользователя
-    try:
-        await message.bot.send_message(int(uid), "✅ Ваша заявка одобрена. Добро пожаловать!")
+    # уведомим пользователя (ошибки доставки конвейер только логирует)
+    sender = get_sender(message.bot)
+    result = await sender.send(int(uid), "✅ Ваша заявка одобрена. Добро пожаловать!")
+    if result.ok:
         et = await get_user_end_time(int(uid))
         from app.keyboards import user_menu_kb
-        await message.bot.send_message(int(uid), ("Доступ закрыт." if not et else f"Ваш доступ заканчивается: {et}"),
-                                       reply_markup=user_menu_kb())
-    except Exception:
-        pass
+        await sender.send(int(uid), ("Доступ закрыт." if not et else f"Ваш доступ заканчивается: {et}"),
+                          reply_markup=user_menu_kb())
 
     await message.answer(f"✅ Одобрено. Пользователь <b>{name}</b> (UID {uid}) сохранён.",
                          reply_markup=admin_menu_kb())
@@ -292,10 +314,7 @@ async def admin_reject(cb: types.CallbackQuery):
         await cb.answer("Ошибка данных.", show_alert=True)
         return
     await remove_pending(uid)
-    try:
-        await cb.bot.send_message(uid, "❌ Ваша заявка отклонена.")
-    except Exception:
-        pass
+    await get_sender(cb.bot).send(uid, "❌ Ваша заявка отклонена.")
     await cb.answer("Пользователь отклонён.")
     rows = await get_pending_users()
     if rows:
@@ -317,11 +336,7 @@ async def admin_set_end_open_list(cb: types.CallbackQuery, state: FSMContext):
     if cb.from_user.id != Config.ADMIN_ID:
         await cb.answer("Недостаточно прав.", show_alert=True)
         return
-    users = await get_all_users()
-    users.sort(key=lambda u: (0 if u[2] else 1, u[2] or "9999-99-99 99:99:99"))
-    page = 0
-    total_pages = max(1, (len(users) + PAGE_SIZE - 1) // PAGE_SIZE)
-    items = [(uid, name, et) for uid, name, et, _appr, _act in users[0:PAGE_SIZE]]
+    items, page, total_pages = await _set_picker_items(0)
     text = "⏱ <b>Выберите пользователя, чтобы установить дату окончания</b>"
     kb = admin_set_picker_kb(items, page, total_pages)
     try:
@@ -344,12 +359,7 @@ async def admin_set_end_paginate(cb: types.CallbackQuery, state: FSMContext):
     except Exception:
         page = 0
 
-    users = await get_all_users()
-    users.sort(key=lambda u: (0 if u[2] else 1, u[2] or "9999-99-99 99:99:99"))
-    total_pages = max(1, (len(users) + PAGE_SIZE - 1) // PAGE_SIZE)
-    page = max(0, min(page, total_pages - 1))
-    start, end = page * PAGE_SIZE, page * PAGE_SIZE + PAGE_SIZE
-    items = [(uid, name, et) for uid, name, et, _appr, _act in users[start:end]]
+    items, page, total_pages = await _set_picker_items(page)
 
     text = "⏱ <b>Выберите пользователя, чтобы установить дату окончания</b>"
     kb = admin_set_picker_kb(items, page, total_pages)
@@ -408,12 +418,7 @@ async def admin_set_end_dt(message: types.Message, state: FSMContext):
     await set_end_time(uid, dt.strftime("%Y-%m-%d %H:%M:%S"))
     await message.answer(f"✅ Время окончания для <b>{uid}</b> установлено: <b>{dt}</b>")
 
-    users = await get_all_users()
-    users.sort(key=lambda u: (0 if u[2] else 1, u[2] or "9999-99-99 99:99:99"))
-    total_pages = max(1, (len(users) + PAGE_SIZE - 1) // PAGE_SIZE)
-    page = max(0, min(page, total_pages - 1))
-    start, end = page * PAGE_SIZE, page * PAGE_SIZE + PAGE_SIZE
-    items = [(u, n, et) for u, n, et, _appr, _act in users[start:end]]
+    items, page, total_pages = await _set_picker_items(page)
 
     text = "⏱ <b>Выберите пользователя, чтобы установить дату окончания</b>"
     kb = admin_set_picker_kb(items, page, total_pages)
@@ -437,6 +442,8 @@ async def admin_add_user_id(message: types.Message, state: FSMContext):
         return
     try:
         uid = int(message.text.strip())
+        if not 0 < uid <= MAX_USER_ID:
+            raise ValueError(uid)
     except ValueError:
         await message.answer("❗ Введите корректный целочисленный user_id.",
                              reply_markup=back_to_admin_menu_kb())
@@ -474,9 +481,22 @@ async def admin_list_active(cb: types.CallbackQuery):
     if cb.from_user.id != Config.ADMIN_ID:
         await cb.answer("Недостаточно прав.", show_alert=True)
         return
-    rows = await get_active_users()
-    text = "Активных пользователей нет." if not rows else \
-        "Активные пользователи:\n" + "\n".join([f"• {uid} — до {et}" for uid, et in rows])
+    # потоково и только то, что влезает в сообщение: таблица может быть большой
+    lines, size = [], 0
+    async with aclosing(stream_active_users()) as rows:
+        async for uid, et in rows:
+            line = f"• {uid} — до {et}"
+            if size + len(line) > ACTIVE_LIST_CHARS:
+                break
+            lines.append(line)
+            size += len(line) + 1
+    if not lines:
+        text = "Активных пользователей нет."
+    else:
+        text = "Активные пользователи:\n" + "\n".join(lines)
+        rest = await count_active_users() - len(lines)
+        if rest > 0:
+            text += f"\n… и ещё {rest} (полный список — «📤 Экспорт пользователей»)"
     try:
         await cb.message.edit_text(text, reply_markup=admin_menu_kb())
     except TelegramBadRequest:
@@ -507,3 +527,121 @@ async def admin_check_user_id(message: types.Message, state: FSMContext):
     except ValueError:
         await message.answer("❗ Введите корректный целочисленный user_id.",
                              reply_markup=back_to_admin_menu_kb())
+
+# ----- импорт / экспорт пользователей -----
+@router.callback_query(F.data == "admin_import")
+async def admin_import_btn(cb: types.CallbackQuery, state: FSMContext):
+    if cb.from_user.id != Config.ADMIN_ID:
+        await cb.answer("Недостаточно прав.", show_alert=True)
+        return
+    await state.set_state(ImportUsersSG.file)
+    await cb.message.edit_text(
+        "Пришлите файл <b>CSV</b> (<code>user_id,name,end_time</code>) или <b>JSON</b> "
+        "(массив или по объекту на строку).\n"
+        "Дата: <code>YYYY-MM-DD HH:MM:SS</code>; пустые name/end_time не меняют текущие.",
+        reply_markup=back_to_admin_menu_kb(),
+    )
+    await cb.answer()
+
+@router.message(ImportUsersSG.file, F.document)
+async def admin_import_file(message: types.Message, state: FSMContext):
+    if message.from_user.id != Config.ADMIN_ID:
+        return
+    fd, path = tempfile.mkstemp(prefix="import_", suffix=".dat")
+    os.close(fd)
+    try:
+        await message.bot.download(message.document, destination=path)  # на диск, не в память
+        report = await import_users_file(path)
+    except UnicodeDecodeError:
+        await message.answer("❗ Файл должен быть в UTF-8. Строки до места ошибки могли быть уже импортированы.",
+                             reply_markup=back_to_admin_menu_kb())
+        return
+    finally:
+        os.remove(path)
+    await state.clear()
+
+    text = (f"✅ Импорт завершён\n\n"
+            f"Добавлено: <b>{report.inserted}</b>\n"
+            f"Обновлено: <b>{report.updated}</b>\n"
+            f"Отклонено: <b>{report.rejected}</b>")
+    if report.errors:
+        text += "\n\n" + "\n".join(f"• <code>{html.escape(e[:200])}</code>" for e in report.errors)
+    await message.answer(text, reply_markup=admin_menu_kb())
+
+@router.callback_query(F.data == "admin_export")
+async def admin_export(cb: types.CallbackQuery):
+    if cb.from_user.id != Config.ADMIN_ID:
+        await cb.answer("Недостаточно прав.", show_alert=True)
+        return
+    await cb.answer("Готовлю файл…")
+    fd, path = tempfile.mkstemp(prefix="users_", suffix=".csv")
+    os.close(fd)
+    try:
+        count = await export_users_csv(path)
+        await cb.message.answer_document(
+            types.FSInputFile(path, filename=f"users_{datetime.now():%Y%m%d_%H%M}.csv"),
+            caption=f"Пользователей: {count}",
+        )
+    finally:
+        os.remove(path)
+
+# ----- рассылка: текст -> подтверждение -> фоновая отправка -----
+# действие -> (новый статус, из каких статусов можно)
+_BROADCAST_ACTIONS = {
+    "pause": ("paused", ("running",)),
+    "resume": ("running", ("paused",)),
+    "cancel": ("cancelled", ("running", "paused")),
+}
+
+@router.callback_query(F.data == "admin_broadcast")
+async def admin_broadcast_btn(cb: types.CallbackQuery, state: FSMContext):
+    if cb.from_user.id != Config.ADMIN_ID:
+        await cb.answer("Недостаточно прав.", show_alert=True)
+        return
+    await state.set_state(BroadcastSG.text)
+    await cb.message.edit_text("Пришлите текст рассылки для всех активных пользователей.\n"
+                               "Форматирование сообщения сохранится.",
+                               reply_markup=back_to_admin_menu_kb())
+    await cb.answer()
+
+@router.message(BroadcastSG.text, F.text)
+async def admin_broadcast_text(message: types.Message, state: FSMContext):
+    if message.from_user.id != Config.ADMIN_ID:
+        return
+    await state.update_data(text=message.html_text)
+    recipients = await count_active_users()
+    await message.answer(f"{message.html_text}\n\n———\nПолучателей: <b>{recipients}</b>. Отправить?",
+                         reply_markup=broadcast_confirm_kb())
+
+@router.callback_query(F.data == "admin_bc_start")
+async def admin_broadcast_start(cb: types.CallbackQuery, state: FSMContext):
+    if cb.from_user.id != Config.ADMIN_ID:
+        await cb.answer("Недостаточно прав.", show_alert=True)
+        return
+    text = (await state.get_data()).get("text")
+    if not text:
+        await cb.answer("Текст рассылки не найден, начните заново.", show_alert=True)
+        return
+    await state.clear()
+    broadcast_id = await create_broadcast(text, cb.message.chat.id, cb.message.message_id)
+    await broadcast.show_progress(cb.bot, await get_broadcast(broadcast_id))
+    broadcast.wake()
+    await cb.answer("Рассылка запущена")
+
+@router.callback_query(F.data.startswith("admin_bc:"))
+async def admin_broadcast_control(cb: types.CallbackQuery):
+    if cb.from_user.id != Config.ADMIN_ID:
+        await cb.answer("Недостаточно прав.", show_alert=True)
+        return
+    _, action, raw_id = cb.data.split(":", 2)
+    if action not in _BROADCAST_ACTIONS:
+        await cb.answer()
+        return
+    status, expected = _BROADCAST_ACTIONS[action]
+    changed = await set_broadcast_status(int(raw_id), status, expected)
+    b = await get_broadcast(int(raw_id))
+    if b is not None:
+        await broadcast.show_progress(cb.bot, b)
+    if changed and status == "running":
+        broadcast.wake()
+    await cb.answer("Готово" if changed else "Статус уже изменился")
@@ -1,11 +1,14 @@
 from aiogram import Router, F, types
 from aiogram.filters import CommandStart, StateFilter
+from aiogram.fsm.context import FSMContext
 from aiogram.exceptions import TelegramBadRequest
 
 from app.db import (
-    add_pending, is_user_approved, get_user_end_time
+    add_pending, get_user_status, get_user_schedule, set_user_schedule
 )
-from app.keyboards import user_menu_kb, approval_inline_kb, admin_menu_kb
+from app.keyboards import user_menu_kb, approval_inline_kb, admin_menu_kb, reminder_time_cancel_kb
+from app.reminders import parse_zone, user_hour, user_zone
+from app.states import ReminderTimeSG
 from config import Config
 
 router = Router()
@@ -18,8 +21,9 @@ async def start(message: types.Message):
         await message.answer("Вы администратор. Выберите действие:", reply_markup=admin_menu_kb())
         return
 
-    if await is_user_approved(user_id):
-        end_time = await get_user_end_time(user_id)
+    status = await get_user_status(user_id)
+    if status.approved:
+        end_time = status.end_time
         text = "Доступ закрыт." if not end_time else f"Ваш доступ заканчивается: {end_time}"
         await message.answer(text, reply_markup=user_menu_kb())
         return
@@ -53,17 +57,19 @@ async def fallback_menu(message: types.Message):
     if message.from_user.id == Config.ADMIN_ID:
         await message.answer("Меню администратора:", reply_markup=admin_menu_kb())
     else:
-        if not await is_user_approved(message.from_user.id):
+        if not (await get_user_status(message.from_user.id)).approved:
             await message.answer("⏳ Ваша заявка на рассмотрении у администратора.")
             return
         await message.answer("Меню:", reply_markup=user_menu_kb())
 
 @router.callback_query(F.data == "user_check")
-async def user_check(cb: types.CallbackQuery):
-    if not await is_user_approved(cb.from_user.id):
+async def user_check(cb: types.CallbackQuery, state: FSMContext):
+    await state.clear()  # кнопка меню под ошибкой ввода времени — выходим из ввода
+    status = await get_user_status(cb.from_user.id)
+    if not status.approved:
         await cb.answer("Ваша заявка ещё не одобрена.", show_alert=True)
         return
-    end_time = await get_user_end_time(cb.from_user.id)
+    end_time = status.end_time
     text = "Доступ закрыт." if not end_time else f"Ваш доступ заканчивается: {end_time}"
     try:
         await cb.message.edit_text(text, reply_markup=user_menu_kb())
@@ -71,3 +77,66 @@ async def user_check(cb: types.CallbackQuery):
         if "message is not modified" not in str(e).lower():
             raise
     await cb.answer()
+
+# ----- пояс и час напоминаний -----
+def _parse_reminder_time(text: str) -> tuple[str | None, int | None] | None:
+    """'Europe/Moscow 9' | 'Europe/Moscow' | '9' | '-' (сброс) -> (tz, hour); None — не разобрали."""
+    tz, hour = None, None
+    parts = text.split()
+    if parts == ["-"]:
+        return None, None
+    if not 1 <= len(parts) <= 2:
+        return None
+    for part in parts:
+        if part.isdigit():
+            if hour is not None or not 0 <= int(part) <= 23:
+                return None
+            hour = int(part)
+        elif tz is None and parse_zone(part) is not None:
+            tz = part
+        else:
+            return None
+    return tz, hour
+
+@router.callback_query(F.data == "user_reminder_time")
+async def user_reminder_time(cb: types.CallbackQuery, state: FSMContext):
+    schedule = await get_user_schedule(cb.from_user.id)
+    if schedule is None or not (await get_user_status(cb.from_user.id)).approved:
+        await cb.answer("Ваша заявка ещё не одобрена.", show_alert=True)
+        return
+    tz, hour = schedule
+    await state.set_state(ReminderTimeSG.value)
+    await cb.message.edit_text(
+        f"Сейчас напоминания приходят в <b>{user_hour(hour)}:00</b> ({user_zone(tz).key}).\n\n"
+        "Пришлите часовой пояс и час, например: <code>Europe/Moscow 9</code>\n"
+        "Можно только пояс или только час; <code>-</code> — вернуть по умолчанию.",
+        reply_markup=reminder_time_cancel_kb(),
+    )
+    await cb.answer()
+
+@router.callback_query(F.data == "user_reminder_cancel")
+async def user_reminder_cancel(cb: types.CallbackQuery, state: FSMContext):
+    await state.clear()  # расписание не трогаем — в отличие от "-"
+    try:
+        await cb.message.edit_text("Меню:", reply_markup=user_menu_kb())
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e).lower():
+            raise
+    await cb.answer()
+
+@router.message(ReminderTimeSG.value, F.text)
+async def user_reminder_time_value(message: types.Message, state: FSMContext):
+    parsed = _parse_reminder_time(message.text or "")
+    if parsed is None:
+        await message.answer("❗ Не понял. Пример: <code>Asia/Almaty 10</code> или <code>8</code>.",
+                             reply_markup=user_menu_kb(cancel=True))
+        return
+    tz, hour = parsed
+    if message.text.strip() != "-":
+        current_tz, current_hour = await get_user_schedule(message.from_user.id) or (None, None)
+        tz = tz if tz is not None else current_tz
+        hour = hour if hour is not None else current_hour
+    await set_user_schedule(message.from_user.id, tz, hour)
+    await state.clear()
+    await message.answer(f"✅ Напоминания будут приходить в {user_hour(hour)}:00 ({user_zone(tz).key}).",
+                         reply_markup=user_menu_kb())
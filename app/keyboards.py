@@ -1,9 +1,19 @@
 from aiogram import types
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-def user_menu_kb() -> types.InlineKeyboardMarkup:
+def user_menu_kb(cancel: bool = False) -> types.InlineKeyboardMarkup:
+    """cancel=True — ещё кнопка выхода из ввода времени напоминаний."""
     kb = InlineKeyboardBuilder()
     kb.button(text="🔎 Проверить доступ", callback_data="user_check")
+    kb.button(text="🕐 Время напоминаний", callback_data="user_reminder_time")
+    if cancel:
+        kb.button(text="⬅️ Отмена", callback_data="user_reminder_cancel")
+    kb.adjust(1)
+    return kb.as_markup()
+
+def reminder_time_cancel_kb() -> types.InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    kb.button(text="⬅️ Отмена", callback_data="user_reminder_cancel")
     return kb.as_markup()
 
 def admin_menu_kb() -> types.InlineKeyboardMarkup:
@@ -15,6 +25,9 @@ def admin_menu_kb() -> types.InlineKeyboardMarkup:
     kb.button(text="⏱ Установить дату окончания", callback_data="admin_set_end")
     kb.button(text="🟢 Активные пользователи", callback_data="admin_list_active")
     kb.button(text="🔎 Проверить доступ пользователя", callback_data="admin_check_user")
+    kb.button(text="📥 Импорт пользователей", callback_data="admin_import")
+    kb.button(text="📤 Экспорт пользователей", callback_data="admin_export")
+    kb.button(text="📣 Рассылка", callback_data="admin_broadcast")
     kb.adjust(1)
     return kb.as_markup()
 
@@ -40,12 +53,16 @@ def approvals_keyboard_from_list(pending: list[tuple[int, str]]) -> types.Inline
     kb.adjust(2, 1)
     return kb.as_markup()
 
-def admin_dashboard_kb(filter_mode: str, page: int, has_prev: bool, has_next: bool) -> types.InlineKeyboardMarkup:
+def admin_dashboard_kb(filter_mode: str, page: int, has_prev: bool, has_next: bool,
+                       prev_cursor: str | None = None, next_cursor: str | None = None) -> types.InlineKeyboardMarkup:
+    """prev_cursor/next_cursor — ключи первой/последней строки страницы (keyset-пагинация)."""
     kb = InlineKeyboardBuilder()
     if has_prev:
-        kb.button(text="◀️", callback_data=f"admin_dash:{filter_mode}:{page-1}")
+        prev_data = f"admin_dash:{filter_mode}:{page-1}" + (f":p:{prev_cursor}" if prev_cursor else "")
+        kb.button(text="◀️", callback_data=prev_data)
     if has_next:
-        kb.button(text="▶️", callback_data=f"admin_dash:{filter_mode}:{page+1}")
+        next_data = f"admin_dash:{filter_mode}:{page+1}" + (f":n:{next_cursor}" if next_cursor else "")
+        kb.button(text="▶️", callback_data=next_data)
     if has_prev or has_next:
         kb.adjust(2)
     kb.row(
@@ -59,13 +76,13 @@ def admin_dashboard_kb(filter_mode: str, page: int, has_prev: bool, has_next: bo
     kb.row(types.InlineKeyboardButton(text="⬅️ В меню", callback_data="admin_back"))
     return kb.as_markup()
 
-def admin_notifications_kb(settings: dict) -> types.InlineKeyboardMarkup:
+def admin_notifications_kb(settings: dict, rules) -> types.InlineKeyboardMarkup:
+    """rules — app.reminders.Rule: по кнопке-переключателю на правило."""
     def mark(b: bool) -> str: return "✅ Вкл" if b else "❌ Выкл"
     kb = InlineKeyboardBuilder()
     kb.button(text=f"Все: {mark(settings['master'])}", callback_data="admin_notif_toggle:master")
-    kb.button(text=f"−3 дня 11:00: {mark(settings['tminus3'])}", callback_data="admin_notif_toggle:tminus3")
-    kb.button(text=f"В день 11:00: {mark(settings['onday'])}", callback_data="admin_notif_toggle:onday")
-    kb.button(text=f"После окончания: {mark(settings['after'])}", callback_data="admin_notif_toggle:after")
+    for rule in rules:
+        kb.button(text=f"{rule.title}: {mark(rule.enabled)}", callback_data=f"admin_notif_toggle:{rule.code}")
     kb.adjust(1)
     kb.button(text="Включить всё", callback_data="admin_notif_setall:on")
     kb.button(text="Выключить всё", callback_data="admin_notif_setall:off")
@@ -103,3 +120,23 @@ def back_to_set_list_kb(page: int) -> types.InlineKeyboardMarkup:
     kb.button(text="⬅️ В меню", callback_data="admin_back")
     kb.adjust(2)
     return kb.as_markup()
+
+def broadcast_confirm_kb() -> types.InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    kb.button(text="🚀 Отправить", callback_data="admin_bc_start")
+    kb.button(text="⬅️ Отмена", callback_data="admin_back")
+    kb.adjust(2)
+    return kb.as_markup()
+
+def broadcast_control_kb(broadcast_id: int, status: str) -> types.InlineKeyboardMarkup | None:
+    """Кнопки под сообщением с прогрессом; у завершённой рассылки их нет."""
+    kb = InlineKeyboardBuilder()
+    if status == "running":
+        kb.button(text="⏸ Пауза", callback_data=f"admin_bc:pause:{broadcast_id}")
+    elif status == "paused":
+        kb.button(text="▶️ Продолжить", callback_data=f"admin_bc:resume:{broadcast_id}")
+    else:
+        return None
+    kb.button(text="⏹ Отменить", callback_data=f"admin_bc:cancel:{broadcast_id}")
+    kb.adjust(2)
+    return kb.as_markup()
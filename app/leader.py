@@ -0,0 +1,71 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from contextlib import suppress
+from typing import Awaitable, Callable, Optional
+
+from app.db import acquire_lease, release_lease
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+async def run_as_leader(
+    name: str,
+    work: Callable[[], Awaitable[None]],
+    holder: str = Config.INSTANCE_ID,
+    ttl: float = Config.LEASE_TTL,
+    renew_every: float = Config.LEASE_RENEW,
+) -> None:
+    """
+    Запускать work() только пока эта реплика держит аренду name.
+    - аренда продлевается каждые renew_every секунд;
+    - если продлить не удалось (аренду забрали или БД недоступна дольше ttl),
+      work отменяется, и реплика снова становится кандидатом;
+    - чужая аренда забирается, только когда истекла (держатель упал).
+    """
+    task: Optional[asyncio.Task] = None
+    deadline = 0.0  # monotonic: до какого момента аренда точно наша
+    try:
+        while True:
+            started = time.monotonic()
+            # пока работаем, ждать БД дольше остатка аренды нельзя: её уже могут забрать
+            timeout = max(0.1, deadline - started) if task is not None else ttl
+            try:
+                leader = await asyncio.wait_for(acquire_lease(name, holder, ttl), timeout)
+            except Exception as e:
+                logger.warning("lease %s: renew failed: %r", name, e)
+                leader = task is not None and time.monotonic() < deadline
+            else:
+                if leader:
+                    deadline = started + ttl
+
+            if leader and task is None:
+                logger.info("lease %s: acquired by %s", name, holder)
+                task = asyncio.create_task(work())
+            elif not leader and task is not None:
+                logger.warning("lease %s: lost by %s, stopping", name, holder)
+                await _cancel(task)
+                task = None
+
+            if task is not None and task.done():
+                # work завершился сам — отдаём аренду, пусть решают заново
+                if not task.cancelled() and task.exception():
+                    logger.error("lease %s: work crashed", name, exc_info=task.exception())
+                task = None
+                with suppress(Exception):
+                    await release_lease(name, holder)
+
+            await asyncio.sleep(renew_every)
+    finally:
+        if task is not None:
+            await _cancel(task)
+            with suppress(Exception):
+                await release_lease(name, holder)
+
+
+async def _cancel(task: asyncio.Task) -> None:
+    task.cancel()
+    with suppress(asyncio.CancelledError, Exception):
+        await task
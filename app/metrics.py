@@ -0,0 +1,288 @@
+"""
+Метрики в формате Prometheus (text exposition 0.0.4) без внешних зависимостей
+и HTTP-сервер /metrics + /healthz на METRICS_PORT.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import math
+import time
+from contextlib import contextmanager, suppress
+from typing import Callable, Iterator, Optional
+
+from aiohttp import web
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LOOP_LAG_INTERVAL = 0.5  # как часто меряем задержку event loop
+
+_registry: list["_Metric"] = []
+
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.doc = doc
+        self.label_names = labels
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.label_names)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        head = f"# HELP {self.name} {self.doc}\n# TYPE {self.name} {self.kind}\n"
+        return head + "".join(line + "\n" for line in self.samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, doc, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.label_names, key)} {_fmt(value)}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, doc, labels)
+        self._values: dict[tuple, float] = {}
+        self._function = function  # значение вычисляется при чтении
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = float(value)
+
+    def value(self, **labels) -> Optional[float]:
+        if self._function is not None:
+            return float(self._function())
+        return self._values.get(self._key(labels))
+
+    def samples(self) -> Iterator[str]:
+        if self._function is not None:
+            try:
+                yield f"{self.name} {_fmt(self._function())}"
+            except Exception:
+                logger.exception("gauge %s failed", self.name)
+            return
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_labels(self.label_names, key)} {_fmt(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series: dict[tuple, list] = {}  # key -> [counts по бакетам..., sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return series[-1] if series else 0
+
+    def samples(self) -> Iterator[str]:
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                le = 'le="' + _fmt(bound) + '"'
+                yield f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, key)} {_fmt(series[-2])}"
+            yield f"{self.name}_count{_labels(self.label_names, key)} {series[-1]}"
+
+
+def render() -> str:
+    return "".join(m.render() for m in _registry)
+
+
+# --- метрики бота ---
+
+SCHEDULER_TICK_SECONDS = Histogram("bot_scheduler_tick_seconds", "Scheduler tick duration")
+SCHEDULER_USERS_SCANNED = Counter("bot_scheduler_users_scanned_total", "Users read by scheduler window queries")
+SCHEDULER_LAST_TICK = Gauge("bot_scheduler_last_tick_timestamp", "Unix time of the last scheduler loop iteration")
+
+NOTIFICATIONS = Counter("bot_notifications_total", "Notifications by type and outcome (queued/sent/retry/failed/expired)",
+                        ("kind", "status"))
+BROADCAST_MESSAGES = Counter("bot_broadcast_messages_total", "Admin broadcast messages by outcome (sent/failed)",
+                             ("status",))
+
+TELEGRAM_REQUEST_SECONDS = Histogram("bot_telegram_request_seconds", "Bot API request latency", ("method",))
+TELEGRAM_ERRORS = Counter("bot_telegram_errors_total", "Bot API request errors", ("method", "error"))
+TELEGRAM_RETRY_AFTER = Counter("bot_telegram_retry_after_total", "Flood control (429) responses")
+POLLING_LAST_SUCCESS = Gauge("bot_polling_last_success_timestamp", "Unix time of the last successful getUpdates")
+
+DB_COMMIT_SECONDS = Histogram("bot_db_commit_seconds", "Writer transaction duration (ops + commit)")
+DB_WRITE_BATCH = Histogram("bot_db_write_batch_ops", "Write ops per group commit",
+                           buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+DB_LOCK_RETRIES = Counter("bot_db_lock_retries_total", "Transactions replayed because the database was locked")
+DB_LOCK_WAIT_SECONDS = Counter("bot_db_lock_wait_seconds_total", "Time spent backing off on database locks")
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Update handler latency", ("handler",))
+UPDATE_SECONDS = Histogram("bot_update_seconds", "Whole update processing time (middlewares + filters + handler)",
+                           ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Update handler exceptions", ("handler",))
+
+def _user_cache_stat(key: str) -> float:
+    from app.db import user_cache_stats  # app.db сам импортирует metrics
+    return user_cache_stats()[key]
+
+
+USER_CACHE_HITS = Gauge("bot_user_cache_hits", "User status cache hits since start",
+                        function=lambda: _user_cache_stat("hits"))
+USER_CACHE_MISSES = Gauge("bot_user_cache_misses", "User status cache misses since start",
+                          function=lambda: _user_cache_stat("misses"))
+USER_CACHE_SIZE = Gauge("bot_user_cache_size", "User status cache entries",
+                        function=lambda: _user_cache_stat("size"))
+
+LOOP_LAG = Gauge("bot_event_loop_lag_last_seconds", "Last measured event loop lag")
+LOOP_LAG_HIST = Histogram("bot_event_loop_lag_seconds", "Event loop lag",
+                          buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0))
+
+
+async def _measure_loop_lag() -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - started - LOOP_LAG_INTERVAL)
+        LOOP_LAG.set(lag)
+        LOOP_LAG_HIST.observe(lag)
+
+
+# --- /healthz ---
+
+_health_checks: dict[str, Callable] = {}
+
+
+def add_health_check(name: str, check: Callable) -> None:
+    """check() -> (ok, detail); может быть корутиной."""
+    _health_checks[name] = check
+
+
+async def _run_health_checks() -> tuple[bool, dict]:
+    results, healthy = {}, True
+    for name, check in _health_checks.items():
+        try:
+            res = check()
+            if asyncio.iscoroutine(res):
+                res = await asyncio.wait_for(res, timeout=5)
+            ok, detail = res
+        except Exception as e:
+            ok, detail = False, repr(e)
+        healthy = healthy and ok
+        results[name] = {"ok": ok, "detail": detail}
+    return healthy, results
+
+
+def _loop_lag_check() -> tuple[bool, object]:
+    lag = LOOP_LAG.value() or 0.0
+    return lag < Config.HEALTH_MAX_LOOP_LAG, round(lag, 4)
+
+
+add_health_check("event_loop", _loop_lag_check)
+
+
+async def _metrics_handler(_request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def _health_handler(_request: web.Request) -> web.Response:
+    healthy, results = await _run_health_checks()
+    return web.json_response({"status": "ok" if healthy else "fail", "checks": results},
+                             status=200 if healthy else 503)
+
+
+def setup_routes(app: web.Application) -> None:
+    app.router.add_get("/metrics", _metrics_handler)
+    app.router.add_get("/healthz", _health_handler)
+
+
+class MetricsServer:
+    """HTTP /metrics и /healthz + замер задержки event loop."""
+
+    def __init__(self, host: str = Config.METRICS_HOST, port: int = Config.METRICS_PORT):
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+        self._lag_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._lag_task = asyncio.create_task(_measure_loop_lag())
+        if not self.port:
+            return
+        app = web.Application()
+        setup_routes(app)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info("Metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def close(self) -> None:
+        if self._lag_task:
+            task, self._lag_task = self._lag_task, None
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,161 @@
+from __future__ import annotations
+import cProfile
+import logging
+import os
+import random
+import time
+from contextlib import suppress
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject, Update
+
+from app import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+TIMING_KEY = "update_timing"  # dict в data: внутренний middleware пишет туда имя хэндлера
+
+
+def handler_name(data: Dict[str, Any]) -> str:
+    """Имя функции-хэндлера из data (есть только во внутренних middleware)."""
+    handler = data.get("handler")
+    callback = getattr(handler, "callback", None)
+    return getattr(callback, "__name__", "unknown")
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время и ошибки по хэндлерам (bot_handler_seconds)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        name = handler_name(data)
+        timing = data.get(TIMING_KEY)
+        if timing is not None:
+            timing["handler"] = name
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            metrics.HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+
+def _describe(update: Update) -> str:
+    """Что за апдейт — без пользовательского текста (кроме команд)."""
+    if update.callback_query:
+        return f"callback {update.callback_query.data!r}"
+    if update.message:
+        text = update.message.text or ""
+        return f"command {text.split()[0]!r}" if text.startswith("/") else "message"
+    return update.event_type
+
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware на dp.update: время обработки апдейта по имени хэндлера.
+    - дольше slow_ms — warning в лог;
+    - доля sample_rate апдейтов профилируется cProfile, профиль пишется в profile_dir
+      (.prof, открывать python -m pstats или snakeviz). Профилировщик видит весь поток,
+      то есть и соседние апдейты, обработанные за это время; одновременно — один профиль.
+    """
+
+    def __init__(
+        self,
+        slow_ms: float = Config.SLOW_UPDATE_MS,
+        sample_rate: float = Config.PROFILE_SAMPLE_RATE,
+        profile_dir: str = Config.PROFILE_DIR,
+        keep: int = Config.PROFILE_KEEP,
+    ):
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.profile_dir = profile_dir
+        self.keep = keep
+        self._profiling = False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        timing: Dict[str, Any] = {}
+        data[TIMING_KEY] = timing
+        profiler = self._maybe_start_profiler()
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            name = timing.get("handler", "unhandled")
+            metrics.UPDATE_SECONDS.observe(elapsed_ms / 1000, handler=name)
+            if profiler is not None:
+                self._finish_profiler(profiler, name, elapsed_ms)
+            if elapsed_ms >= self.slow_ms and isinstance(event, Update):
+                logger.warning("Slow update %s: %s -> %s took %.0f ms",
+                               event.update_id, _describe(event), name, elapsed_ms)
+
+    def _maybe_start_profiler(self) -> Optional[cProfile.Profile]:
+        if self._profiling or self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # уже работает другой профилировщик
+            return None
+        self._profiling = True
+        return profiler
+
+    def _finish_profiler(self, profiler: cProfile.Profile, name: str, elapsed_ms: float) -> None:
+        profiler.disable()
+        self._profiling = False
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"{time.strftime('%Y%m%d-%H%M%S')}_{name}_{elapsed_ms:.0f}ms.prof")
+            profiler.dump_stats(path)
+            self._rotate()
+        except OSError as e:
+            logger.warning("Cannot write profile to %s: %r", self.profile_dir, e)
+
+    def _rotate(self) -> None:
+        """Держим не больше keep последних профилей (/tmp в контейнере — tmpfs)."""
+        files = sorted(
+            (os.path.join(self.profile_dir, f) for f in os.listdir(self.profile_dir) if f.endswith(".prof")),
+            key=os.path.getmtime,
+        )
+        for path in files[:-self.keep] if self.keep > 0 else []:
+            with suppress(OSError):
+                os.remove(path)
+
+
+class RequestMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии Bot: задержка и ошибки запросов к Bot API."""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        api_method = getattr(method, "__api_method__", type(method).__name__)
+        started = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+        except TelegramRetryAfter:
+            metrics.TELEGRAM_RETRY_AFTER.inc()
+            metrics.TELEGRAM_ERRORS.inc(method=api_method, error="TelegramRetryAfter")
+            raise
+        except Exception as e:
+            metrics.TELEGRAM_ERRORS.inc(method=api_method, error=type(e).__name__)
+            raise
+        if api_method == "getUpdates":
+            # long polling висит до timeout — в гистограмму задержек не пишем
+            metrics.POLLING_LAST_SUCCESS.set(time.time())
+        else:
+            metrics.TELEGRAM_REQUEST_SECONDS.observe(time.perf_counter() - started, method=api_method)
+        return response
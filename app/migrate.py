@@ -0,0 +1,57 @@
+"""
+Миграции схемы БД без запуска бота — например, перед выкаткой новой версии,
+пока старый контейнер ещё работает:
+
+    python -m app.migrate                    # применить недостающие шаги
+    python -m app.migrate --status           # только показать версию и список шагов
+    python -m app.migrate --db ./data/bot.db
+
+Бот при старте делает то же самое сам (init_db), но на актуальной схеме
+ограничивается одним чтением.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+os.environ.setdefault("ADMIN_ID", "0")
+
+
+def _parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(prog="python -m app.migrate", description=__doc__,
+                                formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--db", help="путь к SQLite (по умолчанию env DB_PATH или /data/bot.db)")
+    p.add_argument("--status", action="store_true", help="ничего не менять, показать версию")
+    return p.parse_args(argv)
+
+
+async def _main(args: argparse.Namespace) -> int:
+    from app import db
+
+    try:
+        current = await db.get_schema_version()
+        print(f"{db.DB_PATH}: schema version {current}, latest {db.SCHEMA_VERSION}")
+        for version, title, _step in db.MIGRATIONS:
+            mark = "x" if version <= current else " "
+            print(f"  [{mark}] {version}: {title}")
+        if args.status:
+            return 0 if current >= db.SCHEMA_VERSION else 1
+        applied = await db.migrate()
+        print(f"applied: {', '.join(map(str, applied))}" if applied else "up to date")
+        return 0
+    finally:
+        await db.dispose_db()
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = _parse_args(argv)
+    if args.db:
+        os.environ["DB_PATH"] = args.db  # до импорта app.db
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    return asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from contextlib import suppress
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNotFound
+
+from app import metrics
+from app.db import claim_outbox, complete_outbox, prune_outbox, recover_outbox
+from app.sender import SendJob, get_sender
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = 30  # страховочный опрос, если пробуждение потерялось
+PRUNE_EVERY = 3600
+RECOVER_EVERY = 60  # как часто подбирать записи, зависшие в 'sending' у пропавшего отправителя
+RETRY_BASE_SECONDS = 30
+
+# ошибки, при которых повтор не поможет
+_PERMANENT = (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound)
+
+_wakeup = asyncio.Event()
+
+
+def wake() -> None:
+    """Сообщить дренажу, что в outbox появились записи."""
+    _wakeup.set()
+
+
+async def _drain_once(bot: Bot) -> int:
+    """Отправить одну порцию готовых записей. Возвращает их число."""
+    now_ts = int(time.time())
+    rows = await claim_outbox(Config.OUTBOX_BATCH, now_ts, Config.INSTANCE_ID)
+    if not rows:
+        return 0
+
+    jobs, expired = [], []
+    kinds = {r[0]: r[2] for r in rows}
+    for outbox_id, user_id, kind, text, _attempts, expires_at in rows:
+        if expires_at is not None and now_ts > expires_at:
+            expired.append((outbox_id, "expired", "window closed before delivery"))
+            metrics.NOTIFICATIONS.inc(kind=kind, status="expired")
+        else:
+            jobs.append(SendJob(user_id, text, key=outbox_id))
+    attempts = {r[0]: r[4] + 1 for r in rows}
+
+    sent, retry, failed = [], [], list(expired)
+    for result in await get_sender(bot).send_many(jobs):
+        if result.ok:
+            sent.append(result.key)
+            metrics.NOTIFICATIONS.inc(kind=kinds[result.key], status="sent")
+            continue
+        error = repr(result.error)
+        if isinstance(result.error, _PERMANENT) or attempts[result.key] >= Config.OUTBOX_MAX_ATTEMPTS:
+            logger.warning("outbox %s to %s failed: %s", result.key, result.chat_id, error)
+            failed.append((result.key, "failed", error))
+            metrics.NOTIFICATIONS.inc(kind=kinds[result.key], status="failed")
+        else:
+            delay = RETRY_BASE_SECONDS * 2 ** (attempts[result.key] - 1)
+            retry.append((result.key, int(time.time()) + delay, error))
+            metrics.NOTIFICATIONS.inc(kind=kinds[result.key], status="retry")
+    await complete_outbox(sent, retry, failed)
+    return len(rows)
+
+
+async def drain_loop(bot: Bot) -> None:
+    """Фоновая отправка outbox: не зависит от скорости сканирования планировщика."""
+    last_prune = last_recover = 0.0
+    while True:
+        _wakeup.clear()
+        try:
+            if time.monotonic() - last_recover > RECOVER_EVERY:
+                last_recover = time.monotonic()
+                stale_before = int(time.time()) - Config.OUTBOX_SENDING_TIMEOUT
+                recovered = await recover_outbox(Config.INSTANCE_ID, stale_before)
+                if recovered:
+                    logger.warning("outbox: %d in-flight notifications of a lost sender marked 'unknown'",
+                                   recovered)
+            while await _drain_once(bot) >= Config.OUTBOX_BATCH:
+                pass
+            if time.monotonic() - last_prune > PRUNE_EVERY:
+                last_prune = time.monotonic()
+                await prune_outbox(int(time.time()) - Config.OUTBOX_KEEP_DAYS * 86400)
+        except Exception:
+            logger.exception("outbox drain error")
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_SECONDS)
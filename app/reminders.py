@@ -0,0 +1,122 @@
+"""
+Моменты напоминаний по правилам notification_rules в часовом поясе пользователя.
+Чистые функции, без БД: ими пользуются и app.db (пересчёт users.next_due при записи),
+и планировщик.
+"""
+from __future__ import annotations
+import math
+from datetime import datetime, time, timedelta
+from functools import lru_cache
+from typing import Collection, NamedTuple, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from config import Config
+
+ANCHORS = ("day", "expiry")
+
+
+class Rule(NamedTuple):
+    """
+    Правило уведомления.
+    anchor="day":    дата окончания (по времени пользователя) + offset_days, в local_time
+                     (None — час пользователя), затем + offset_minutes;
+    anchor="expiry": момент окончания + offset_days + offset_minutes.
+    only_before_end — не слать, если к моменту отправки доступ уже истёк.
+    deactivate — после отправки снять users.active.
+    """
+    id: int
+    code: str
+    title: str
+    anchor: str
+    offset_days: int
+    offset_minutes: int
+    local_time: Optional[time]
+    window: timedelta
+    template: str
+    only_before_end: bool
+    deactivate: bool
+    enabled: bool
+
+
+class Event(NamedTuple):
+    rule: Rule
+    target: datetime      # aware, в поясе пользователя
+    window_end: datetime  # позже — не отправляем
+
+
+def parse_zone(name: str) -> Optional[ZoneInfo]:
+    """ZoneInfo по IANA-имени или None, если такого пояса нет."""
+    try:
+        return ZoneInfo(name.strip())
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+@lru_cache(maxsize=1024)
+def user_zone(name: Optional[str]) -> ZoneInfo:
+    """Пояс пользователя; пустой или неизвестный — DEFAULT_TZ."""
+    return (parse_zone(name) if name else None) or ZoneInfo(Config.DEFAULT_TZ)
+
+
+def user_hour(hour: Optional[int]) -> int:
+    return Config.REMINDER_HOUR if hour is None else hour
+
+
+def parse_local_time(raw: Optional[str]) -> Optional[time]:
+    """'HH:MM' -> time; пусто — None (час пользователя)."""
+    if not raw:
+        return None
+    return datetime.strptime(raw.strip(), "%H:%M").time()
+
+
+def render(rule: Rule, end: datetime) -> str:
+    """Текст по шаблону правила; в шаблоне доступна только {end} (datetime пользователя)."""
+    return rule.template.format_map({"end": end})
+
+
+def user_events(expiry: int, tz: Optional[str], hour: Optional[int],
+                rules: Collection[Rule], sent: Collection[int]) -> list[Event]:
+    """События по правилам, ещё не отправленные для этой версии end_time (sent — id правил)."""
+    zone = user_zone(tz)
+    end = datetime.fromtimestamp(expiry, zone)
+    shift = timedelta
+    events = []
+    for rule in rules:
+        if rule.id in sent:
+            continue
+        if rule.anchor == "expiry":
+            target = end + shift(days=rule.offset_days, minutes=rule.offset_minutes)
+        else:
+            at = rule.local_time or time(user_hour(hour))
+            day = end.date() + shift(days=rule.offset_days)
+            target = datetime.combine(day, at, tzinfo=zone) + shift(minutes=rule.offset_minutes)
+        if rule.only_before_end and target > end:
+            continue
+        events.append(Event(rule, target, target + rule.window))
+    return events
+
+
+def due_events(events: list[Event], now: datetime) -> list[Event]:
+    """События, окно которых открыто в now."""
+    return [e for e in events if e.target <= now < e.window_end]
+
+
+def next_due_minute(events: list[Event], now: datetime, include_open: bool = True) -> Optional[int]:
+    """
+    Минута UTC (epoch // 60, округление вверх) ближайшего события — значение users.next_due.
+    include_open: учитывать и уже открытые окна (после записи извне их надо успеть отправить);
+    планировщик после обработки передаёт False — открытые окна он уже разобрал.
+    Выключенные правила тоже учитываются: включить их можно, не пересчитывая next_due.
+    """
+    ts = [e.target.timestamp() for e in events
+          if (now < e.window_end if include_open else now < e.target)]
+    return math.ceil(min(ts) / 60) if ts else None
+
+
+def timing_signature(rules: Collection[Rule]) -> str:
+    """Всё, что влияет на next_due: при изменении next_due пересчитывается для всех."""
+    return ";".join(
+        f"{r.id}:{r.anchor}:{r.offset_days}:{r.offset_minutes}:{r.local_time}:{int(r.window.total_seconds())}:"
+        f"{int(r.only_before_end)}"
+        for r in sorted(rules, key=lambda r: r.id)
+    ) + f"|{Config.DEFAULT_TZ}|{Config.REMINDER_HOUR}"
@@ -1,130 +1,132 @@
 from __future__ import annotations
 import asyncio
 import logging
-from datetime import datetime, timedelta, time
+import time as _time
+from contextlib import suppress
+from datetime import datetime, timedelta
 
-from zoneinfo import ZoneInfo
 from aiogram import Bot
 
 from app.db import (
-    get_active_users_with_flags,
-    mark_flag,
-    update_active_status,
-    get_settings,
+    TZ,
+    DueUser,
+    get_due_users,
+    get_next_due_minute,
+    enqueue_notifications,
+    OutboxIntent,
+    reload_settings,
+    get_rules,
+    add_user_listener,
+    remove_user_listener,
 )
-
-# Важно: время берём по Берлину (как и раньше)
-TZ = ZoneInfo("Europe/Berlin")
+from app import broadcast, metrics, outbox
+from app.leader import run_as_leader
+from app.reminders import Event, due_events, render, user_events, user_zone
 
 logger = logging.getLogger(__name__)
 
-# --- утилиты времени ---
-
-WINDOW_MINUTES = 5  # окно "догонялки" после 11:00
-
-def _parse_local_berlin(end_time_str: str):
-    """Парсим TEXT 'YYYY-MM-DD HH:MM:SS' как локальное время Берлина."""
-    try:
-        naive = datetime.strptime(end_time_str, "%Y-%m-%d %H:%M:%S")
-        return naive.replace(tzinfo=TZ)
-    except Exception:
-        return None
-
-def _in_window(now: datetime, target: datetime, minutes: int = WINDOW_MINUTES) -> bool:
-    """True, если now в интервале [target, target+minutes)."""
-    delta = (now - target).total_seconds()
-    return 0 <= delta < minutes * 60
+RETRY_SECONDS = 60  # повтор тика, если запись в outbox не удалась
+DELIVERY_GRACE = timedelta(hours=1)  # сколько outbox может опоздать после закрытия окна
+# даже без событий просыпаемся раз в минуту: next_due могла переписать другая реплика,
+# а её запись будит только свой процесс (окна правил — минуты, опоздание до минуты допустимо)
+MAX_SLEEP_SECONDS = 60
+FLUSH_BATCH = 200  # пользователей из корзины за один запрос/транзакцию
+
+
+def _intent(user: DueUser, event: Event) -> OutboxIntent:
+    rule = event.rule
+    end = datetime.fromtimestamp(user.expiry, user_zone(user.tz))
+    return OutboxIntent(
+        user_id=user.user_id,
+        kind=rule.code,
+        idem_key=f"{rule.code}:{user.user_id}:{user.expiry}",
+        text=render(rule, end),
+        expires_at=int((event.window_end + DELIVERY_GRACE).timestamp()),
+        rule_id=rule.id,
+        version=user.expiry,
+        deactivate=rule.deactivate,
+    )
 
-def _at_11(dt: datetime) -> datetime:
-    """11:00:00 того же дня в TZ."""
-    return datetime.combine(dt.date(), time(11, 0), tzinfo=TZ)
 
 # --- уведомления ---
 
-async def _notify_pre_expiry(bot: Bot):
+async def _process_due(now: datetime) -> int:
     """
-    - За 3 дня @11:00 (с окном 5 минут)
-    - В день @11:00 (если доступ ещё не истёк к 11:00)
+    Разобрать корзины next_due <= текущей минуты UTC: обычно это одна минута,
+    после простоя — все пропущенные (закрытые окна просто пропускаются).
+    Каждому разобранному пользователю next_due сдвигается на следующее событие
+    в той же транзакции, что и постановка в outbox. Возвращает число уведомлений.
     """
-    now = datetime.now(TZ)
-    settings = await get_settings()
-    if not settings["master"]:
-        return
-
-    users = await get_active_users_with_flags()
-    for user_id, end_time, tminus3_sent, onday_sent, _after_sent in users:
-        if not end_time:
-            continue
-
-        end_dt = _parse_local_berlin(end_time)
-        if not end_dt:
-            continue
-
-        # --- за 3 дня в 11:00 ---
-        if settings["tminus3"] and not tminus3_sent:
-            target_dt = _at_11(end_dt - timedelta(days=3))
-            if _in_window(now, target_dt):
-                try:
-                    await bot.send_message(
-                        user_id,
-                        f"⚠️ Напоминание\n\nВаш доступ истекает через 3 дня — {end_dt:%Y-%m-%d %H:%M}."
-                    )
-                    await mark_flag(user_id, "tminus3_sent", True)
-                except Exception:
-                    logger.exception("t-3 notify failed for %s", user_id)
-
-        # --- в день в 11:00 (если к 11 доступ ещё не истёк) ---
-        if settings["onday"] and not onday_sent:
-            target_dt = _at_11(end_dt)
-            if _in_window(now, target_dt) and end_dt >= target_dt:
-                try:
-                    await bot.send_message(
-                        user_id,
-                        f"⏳ Сегодня — последний день\n\nДоступ истекает сегодня в {end_dt:%H:%M} ({end_dt:%Y-%m-%d})."
-                    )
-                    await mark_flag(user_id, "onday_sent", True)
-                except Exception:
-                    logger.exception("on-day notify failed for %s", user_id)
-
-async def _notify_after_expiry(bot: Bot):
-    """После окончания — однократно в течение часа после end_time."""
-    now = datetime.now(TZ)
-    settings = await get_settings()
-    if not settings["master"] or not settings["after"]:
-        return
+    settings = await reload_settings()  # могли переключить на другой реплике
+    rules = get_rules()
+    until = int(now.timestamp()) // 60
+    queued = 0
+    while True:
+        users = await get_due_users(until, FLUSH_BATCH)
+        if not users:
+            break
+        metrics.SCHEDULER_USERS_SCANNED.inc(len(users))
+        intents = []
+        for user in users:
+            if user.expiry is None:
+                continue
+            events = user_events(user.expiry, user.tz, user.notify_hour, rules, user.sent)
+            for event in due_events(events, now):
+                if settings["master"] and event.rule.enabled:
+                    intents.append(_intent(user, event))
+        await enqueue_notifications(intents, touched=[u.user_id for u in users], now=now)
+        for intent in intents:
+            metrics.NOTIFICATIONS.inc(kind=intent.kind, status="queued")
+        if intents:
+            outbox.wake()
+        queued += len(intents)
+        if len(users) < FLUSH_BATCH:
+            break
+    return queued
 
-    users = await get_active_users_with_flags()
-    for user_id, end_time, _tminus3, _onday, after_sent in users:
-        if after_sent or not end_time:
-            continue
 
-        end_dt = _parse_local_berlin(end_time)
-        if not end_dt:
-            continue
+# --- основной цикл ---
 
-        # В течение часа после окончания (догоняет даже если бот "спал" и проснулся позже 11:00)
-        if end_dt <= now <= end_dt + timedelta(hours=1):
-            try:
-                await bot.send_message(
-                    user_id,
-                    f"❌ Доступ завершён\n\nСрок действия истёк: {end_dt:%Y-%m-%d %H:%M}."
-                )
-                await mark_flag(user_id, "after_sent", True)
-                await update_active_status(user_id, False)
-            except Exception:
-                logger.exception("after-expiry notify failed for %s", user_id)
+async def _tick() -> float:
+    """Один проход; возвращает, сколько спать до следующей непустой корзины."""
+    now = datetime.now(TZ)
+    with metrics.SCHEDULER_TICK_SECONDS.time():
+        await _process_due(now)
+    next_minute = await get_next_due_minute()
+    if next_minute is None:
+        return MAX_SLEEP_SECONDS
+    return min(MAX_SLEEP_SECONDS, max(0.0, next_minute * 60 - _time.time()))
 
-# --- основной цикл ---
 
 async def loop(bot: Bot):
-    while True:
-        try:
-            await _notify_pre_expiry(bot)
-            await _notify_after_expiry(bot)
-        except Exception:
-            logger.exception("scheduler loop error")
-        finally:
-            await asyncio.sleep(60)  # тик раз в минуту
+    wakeup = asyncio.Event()
+
+    def on_user_changed(_user_id: int) -> None:
+        # next_due уже пересчитан при записи — достаточно перечитать ближайшую корзину
+        wakeup.set()
+
+    add_user_listener(on_user_changed)
+    drain_task = asyncio.create_task(outbox.drain_loop(bot))
+    broadcast_task = asyncio.create_task(broadcast.worker_loop(bot))
+    try:
+        while True:
+            wakeup.clear()
+            metrics.SCHEDULER_LAST_TICK.set(_time.time())
+            try:
+                timeout = await _tick()
+            except Exception:
+                # next_due не сдвинут — корзина разберётся на следующем тике
+                logger.exception("scheduler loop error")
+                timeout = RETRY_SECONDS
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(wakeup.wait(), timeout=timeout)
+    finally:
+        remove_user_listener(on_user_changed)
+        for task in (drain_task, broadcast_task):
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
 
 def start_scheduler(bot: Bot) -> asyncio.Task:
-    return asyncio.create_task(loop(bot))
+    """Планировщик, outbox и рассылки работают только на реплике, держащей аренду "scheduler"."""
+    return asyncio.create_task(run_as_leader("scheduler", lambda: loop(bot)))
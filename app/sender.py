@@ -0,0 +1,201 @@
+from __future__ import annotations
+import asyncio
+import itertools
+import logging
+import time
+from contextlib import suppress
+from dataclasses import dataclass, field
+from typing import Any, Iterable, Optional
+
+from aiogram import Bot, types
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+    TelegramUnauthorizedError,
+)
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3  # попыток на сообщение (RetryAfter не считается)
+PRIORITY_INTERACTIVE = 0  # ответы на действия админа/пользователя: вперёд массовых
+PRIORITY_BULK = 1         # outbox и рассылки
+MAX_RETRY_AFTER = 5  # сколько раз подряд терпим flood control на одно сообщение
+CHAT_SLOTS_PRUNE = 10_000  # чистим словарь слотов чатов, когда он разрастается
+
+# ошибки, после которых повторять бессмысленно
+_PERMANENT_ERRORS = (TelegramBadRequest, TelegramForbiddenError, TelegramNotFound, TelegramUnauthorizedError)
+
+
+@dataclass
+class SendJob:
+    chat_id: int
+    text: str
+    kwargs: dict = field(default_factory=dict)
+    key: Any = None  # произвольная метка вызывающего (вернётся в SendResult)
+
+
+@dataclass
+class SendResult:
+    chat_id: int
+    ok: bool
+    key: Any = None
+    message: Optional[types.Message] = None
+    error: Optional[BaseException] = None
+
+
+class _RateLimiter:
+    """Равномерный лимит: не больше rate вызовов в секунду на весь бот."""
+
+    def __init__(self, rate: float):
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self._interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class SendPipeline:
+    """
+    Очередь исходящих сообщений с пулом воркеров.
+    - глобальный лимит (~30 msg/s) и интервал между сообщениями в один чат;
+    - TelegramRetryAfter ставит на паузу все воркеры на retry_after секунд;
+    - каждое сообщение завершается SendResult, исключения наружу не летят;
+    - очередь с приоритетом: send() (интерактивные) обгоняет пачки send_many() (outbox,
+      рассылки), лимиты у них общие.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        workers: int = Config.SEND_WORKERS,
+        rate: float = Config.SEND_RATE,
+        chat_interval: float = Config.SEND_CHAT_INTERVAL,
+        max_attempts: int = MAX_ATTEMPTS,
+    ):
+        self.bot = bot
+        self._workers_count = max(1, workers)
+        self._limiter = _RateLimiter(rate)
+        self._chat_interval = chat_interval
+        self._max_attempts = max_attempts
+        # (приоритет, порядковый номер, job, future): внутри приоритета — FIFO
+        self._queue: asyncio.PriorityQueue[tuple[int, int, SendJob, asyncio.Future]] = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._chat_next: dict[int, float] = {}
+        self._paused_until = 0.0
+        self._workers: list[asyncio.Task] = []
+
+    def start(self) -> None:
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self._workers_count)]
+
+    async def close(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        for task in self._workers:
+            with suppress(asyncio.CancelledError):
+                await task
+        self._workers = []
+        while not self._queue.empty():
+            _priority, _seq, job, fut = self._queue.get_nowait()
+            if not fut.done():
+                fut.set_result(SendResult(job.chat_id, False, job.key, error=RuntimeError("sender closed")))
+
+    async def send(self, chat_id: int, text: str, priority: int = PRIORITY_INTERACTIVE, **kwargs) -> SendResult:
+        return (await self.send_many([SendJob(chat_id, text, kwargs)], priority))[0]
+
+    async def send_many(self, jobs: Iterable[SendJob], priority: int = PRIORITY_BULK) -> list[SendResult]:
+        """Поставить сообщения в очередь и дождаться результатов (в порядке jobs)."""
+        self.start()
+        loop = asyncio.get_running_loop()
+        futures = []
+        for job in jobs:
+            fut = loop.create_future()
+            self._queue.put_nowait((priority, next(self._seq), job, fut))
+            futures.append(fut)
+        return list(await asyncio.gather(*futures))
+
+    def _reserve_chat_slot(self, chat_id: int) -> float:
+        """Зарезервировать момент отправки в чат; вернуть, сколько ждать."""
+        now = time.monotonic()
+        if len(self._chat_next) > CHAT_SLOTS_PRUNE:
+            self._chat_next = {c: t for c, t in self._chat_next.items() if t > now}
+        slot = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = slot + self._chat_interval
+        return slot - now
+
+    async def _worker(self) -> None:
+        while True:
+            _priority, _seq, job, fut = await self._queue.get()
+            try:
+                result = await self._deliver(job)
+            except asyncio.CancelledError:
+                if not fut.done():
+                    fut.set_result(SendResult(job.chat_id, False, job.key, error=RuntimeError("sender closed")))
+                raise
+            except Exception as e:  # на всякий случай: воркер не должен умирать
+                result = SendResult(job.chat_id, False, job.key, error=e)
+            if not fut.done():
+                fut.set_result(result)
+            self._queue.task_done()
+
+    async def _deliver(self, job: SendJob) -> SendResult:
+        chat_wait = self._reserve_chat_slot(job.chat_id)
+        if chat_wait > 0:
+            await asyncio.sleep(chat_wait)
+
+        attempts, flood_waits, delay = 0, 0, 1.0
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            await self._limiter.acquire()
+            try:
+                message = await self.bot.send_message(job.chat_id, job.text, **job.kwargs)
+                return SendResult(job.chat_id, True, job.key, message=message)
+            except TelegramRetryAfter as e:
+                flood_waits += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                logger.warning("Flood control, pause %ss (chat %s)", e.retry_after, job.chat_id)
+                if flood_waits >= MAX_RETRY_AFTER:
+                    return SendResult(job.chat_id, False, job.key, error=e)
+            except _PERMANENT_ERRORS as e:
+                logger.info("Send to %s rejected: %s", job.chat_id, e)
+                return SendResult(job.chat_id, False, job.key, error=e)
+            except Exception as e:
+                attempts += 1
+                if attempts >= self._max_attempts:
+                    logger.warning("Send to %s failed after %d attempts: %r", job.chat_id, attempts, e)
+                    return SendResult(job.chat_id, False, job.key, error=e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 10.0)
+
+
+_pipelines: dict[int, SendPipeline] = {}  # id(bot) -> конвейер
+
+
+def get_sender(bot: Bot) -> SendPipeline:
+    """
+    Общий конвейер отправки для данного Bot (создаётся лениво). У каждого Bot свой:
+    появление нового Bot не закрывает конвейер старого вместе с его очередью.
+    """
+    pipeline = _pipelines.get(id(bot))
+    if pipeline is None or pipeline.bot is not bot:
+        pipeline = _pipelines[id(bot)] = SendPipeline(bot)
+    return pipeline
+
+
+async def close_sender() -> None:
+    pipelines = list(_pipelines.values())
+    _pipelines.clear()
+    for pipeline in pipelines:
+        await pipeline.close()
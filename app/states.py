@@ -13,3 +13,12 @@ class SetEndSG(StatesGroup):
 
 class CheckUserSG(StatesGroup):
     user_id = State()
+
+class ImportUsersSG(StatesGroup):
+    file = State()      # ждём документ CSV/JSON
+
+class BroadcastSG(StatesGroup):
+    text = State()      # ждём текст рассылки
+
+class ReminderTimeSG(StatesGroup):
+    value = State()     # "<пояс> <час>", напр. "Europe/Moscow 9"
@@ -0,0 +1,259 @@
+"""
+Индекс users и pending в памяти процесса (USER_INDEX=1): чтения app.db обслуживаются
+отсюда, без SQLite. Источник истины — БД: индекс загружается в init_db() и обновляется
+писателем после коммита строками, перечитанными в той же транзакции (см. app.db._index_capture).
+Только структуры и запросы, без ввода-вывода.
+"""
+from __future__ import annotations
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+
+from app.db import END_TIME_FORMAT, MAX_USER_ID, TZ, _truthy
+
+# Ключи сортированных списков — одно int вместо кортежа (major, user_id): вдвое меньше памяти.
+# У Telegram id не больше 52 значащих бит; больший id испортил бы major — UserRecord его не примет.
+_UID_BITS = 53
+_UID_MASK = (1 << _UID_BITS) - 1
+
+
+def _key(major: int, user_id: int) -> int:
+    return (major << _UID_BITS) | user_id
+
+
+def _key_uid(key: int) -> int:
+    return key & _UID_MASK
+
+
+_EMPTY: frozenset[int] = frozenset()
+_sent_pool: dict[frozenset[int], frozenset[int]] = {_EMPTY: _EMPTY}
+_str_pool: dict[str, str] = {}
+
+
+def _shared_sent(raw) -> frozenset[int]:
+    """group_concat(rule_id) -> frozenset; одинаковые множества — один объект на все записи."""
+    if not raw:
+        return _EMPTY
+    sent = frozenset(int(x) for x in str(raw).split(","))
+    return _sent_pool.setdefault(sent, sent)
+
+
+def _shared_str(value: Optional[str]) -> Optional[str]:
+    return None if value is None else _str_pool.setdefault(value, value)
+
+
+class UserRecord:
+    """
+    Строка users + id правил, отправленных для текущей версии end_time.
+    end_time хранится, только если не восстанавливается из expiry (обычно — не хранится).
+    """
+    __slots__ = ("user_id", "name", "_end_time", "expiry", "active", "approved",
+                 "tz", "notify_hour", "next_due", "sent")
+
+    def __init__(self, row):
+        (self.user_id, self.name, end_time, self.expiry, active, approved,
+         tz, self.notify_hour, self.next_due, sent) = row
+        if not 0 < self.user_id <= MAX_USER_ID:
+            raise ValueError(f"user_id out of range: {self.user_id}")
+        self.active = _truthy(active)
+        self.approved = _truthy(approved)
+        self.tz = _shared_str(tz)
+        self.sent = _shared_sent(sent)
+        self._end_time = None if end_time is None or end_time == self._format(self.expiry) else end_time
+
+    @staticmethod
+    def _format(expiry: Optional[int]) -> Optional[str]:
+        return None if expiry is None else datetime.fromtimestamp(expiry, TZ).strftime(END_TIME_FORMAT)
+
+    @property
+    def end_time(self) -> Optional[str]:
+        return self._end_time if self._end_time is not None else self._format(self.expiry)
+
+    def dashboard_row(self) -> tuple:
+        """(user_id, name, end_time, approved, active, expiry) — как app.db.DashboardRow."""
+        return (self.user_id, self.name, self.end_time, self.approved, self.active, self.expiry)
+
+
+class UserIndex:
+    """
+    _users — записи по user_id; отсортированные списки для range-запросов:
+    _ids (все user_id), _dated (_key(expiry, user_id) с датой), _undated (user_id без даты),
+    _due (_key(next_due, user_id), корзины планировщика).
+    Вставка/удаление в списке — bisect + сдвиг, чтение диапазона — срез.
+    """
+
+    def __init__(self):
+        self._users: dict[int, UserRecord] = {}
+        self._pending: dict[int, str] = {}
+        self._ids: list[int] = []
+        self._dated: list[int] = []
+        self._undated: list[int] = []
+        self._due: list[int] = []
+        self._active = 0
+
+    # --- загрузка и обновление ---
+
+    def load_rows(self, rows: Iterable) -> None:
+        """Загрузка: добавить пачку строк users (см. app.db._INDEX_COLUMNS); потом build()."""
+        for row in rows:
+            r = UserRecord(row)
+            self._users[r.user_id] = r
+
+    def build(self, pending: Iterable[tuple[int, str]]) -> None:
+        """Загрузка: построить отсортированные списки одной сортировкой каждый."""
+        records = self._users.values()
+        self._ids = sorted(self._users)
+        self._dated = sorted(_key(r.expiry, r.user_id) for r in records if r.expiry is not None)
+        self._undated = [r.user_id for r in records if r.expiry is None]
+        self._undated.sort()
+        self._due = sorted(_key(r.next_due, r.user_id) for r in records if r.next_due is not None)
+        self._active = sum(1 for r in records if r.active)
+        self._pending = dict(pending)
+
+    def apply(self, rows: Iterable) -> None:
+        """Строки users после коммита (см. app.db._INDEX_COLUMNS) — заменить записи целиком."""
+        for new in [UserRecord(row) for row in rows]:  # сначала проверить все строки, потом менять
+            old = self._users.get(new.user_id)
+            if old is None:
+                insort(self._ids, new.user_id)
+            else:
+                self._unlink(old)
+            self._users[new.user_id] = new
+            self._link(new)
+
+    def set_pending(self, user_id: int, created_at: Optional[str]) -> None:
+        """created_at=None — заявка удалена."""
+        if created_at is None:
+            self._pending.pop(user_id, None)
+        else:
+            self._pending[user_id] = created_at
+
+    def _link(self, r: UserRecord) -> None:
+        if r.expiry is None:
+            insort(self._undated, r.user_id)
+        else:
+            insort(self._dated, _key(r.expiry, r.user_id))
+        if r.next_due is not None:
+            insort(self._due, _key(r.next_due, r.user_id))
+        self._active += r.active
+
+    def _unlink(self, r: UserRecord) -> None:
+        if r.expiry is None:
+            _remove(self._undated, r.user_id)
+        else:
+            _remove(self._dated, _key(r.expiry, r.user_id))
+        if r.next_due is not None:
+            _remove(self._due, _key(r.next_due, r.user_id))
+        self._active -= r.active
+
+    # --- точечные чтения ---
+
+    def get(self, user_id: int) -> Optional[UserRecord]:
+        return self._users.get(user_id)
+
+    def pending(self) -> list[tuple[int, str]]:
+        return list(self._pending.items())
+
+    def is_pending(self, user_id: int) -> bool:
+        return user_id in self._pending
+
+    # --- агрегаты ---
+
+    def counts(self) -> tuple[int, int]:
+        """(всего, с датой)"""
+        return len(self._users), len(self._dated)
+
+    def active_count(self) -> int:
+        return self._active
+
+    def summary(self) -> dict:
+        """То же, что считает app.db._db_summary() по таблицам, — для сверки при старте."""
+        return dict(users=len(self._users), active=self._active, dated=len(self._dated),
+                    approved=sum(1 for r in self._users.values() if r.approved),
+                    expiry_sum=sum(k >> _UID_BITS for k in self._dated),
+                    due=len(self._due), due_sum=sum(k >> _UID_BITS for k in self._due),
+                    pending=len(self._pending))
+
+    # --- диапазоны ---
+
+    def due(self, until_minute: int, limit: int) -> list[UserRecord]:
+        """next_due <= until_minute по возрастанию next_due, не больше limit."""
+        end = bisect_right(self._due, _key(until_minute, _UID_MASK), hi=min(len(self._due), limit))
+        return [self._users[_key_uid(k)] for k in self._due[:end]]
+
+    def next_due_minute(self) -> Optional[int]:
+        return self._due[0] >> _UID_BITS if self._due else None
+
+    def ids_after(self, after: Optional[int], limit: int, active_only: bool = False) -> list[UserRecord]:
+        """Keyset-страница по user_id (> after)."""
+        i = 0 if after is None else bisect_right(self._ids, after)
+        out: list[UserRecord] = []
+        ids, users = self._ids, self._users
+        while i < len(ids) and len(out) < limit:
+            r = users[ids[i]]
+            if r.active or not active_only:
+                out.append(r)
+            i += 1
+        return out
+
+    def active_batches(self, chunk: int) -> Iterator[list[UserRecord]]:
+        """
+        Активные пачками по chunk в порядке ix_users_active_expiry: сначала без даты
+        (по user_id), затем по (expiry, user_id). Позиция между пачками — по ключу,
+        поэтому изменения индекса между ними не сбивают обход.
+        """
+        after_uid: Optional[int] = None
+        while True:
+            i = 0 if after_uid is None else bisect_right(self._undated, after_uid)
+            keys = self._undated[i:i + chunk]
+            if not keys:
+                break
+            after_uid = keys[-1]
+            batch = [r for r in map(self._users.get, keys) if r is not None and r.active]
+            if batch:
+                yield batch
+        after_key: Optional[int] = None
+        while True:
+            i = 0 if after_key is None else bisect_right(self._dated, after_key)
+            keys = self._dated[i:i + chunk]
+            if not keys:
+                break
+            after_key = keys[-1]
+            batch = [r for r in (self._users.get(_key_uid(k)) for k in keys) if r is not None and r.active]
+            if batch:
+                yield batch
+
+    def dated_rows(self, cursor: Optional[tuple[int, int]], backward: bool, limit: int) -> list[tuple]:
+        """Как app.db._dated_rows: по (expiry, user_id) после cursor или до него (тогда по убыванию)."""
+        if backward:
+            j = len(self._dated) if cursor is None else bisect_left(self._dated, _key(*cursor))
+            keys = self._dated[max(0, j - limit):j][::-1]
+        else:
+            i = 0 if cursor is None else bisect_right(self._dated, _key(*cursor))
+            keys = self._dated[i:i + limit]
+        return [self._users[_key_uid(k)].dashboard_row() for k in keys]
+
+    def undated_rows(self, after_uid: Optional[int], backward: bool, limit: int) -> list[tuple]:
+        """Как app.db._undated_rows: без даты по user_id."""
+        if backward:
+            j = len(self._undated) if after_uid is None else bisect_left(self._undated, after_uid)
+            keys = self._undated[max(0, j - limit):j][::-1]
+        else:
+            i = 0 if after_uid is None else bisect_right(self._undated, after_uid)
+            keys = self._undated[i:i + limit]
+        return [self._users[uid].dashboard_row() for uid in keys]
+
+    def slice(self, offset: int, limit: int) -> list[tuple]:
+        """Срез в порядке дашборда: с датой, затем без даты."""
+        dated = self._dated[offset:offset + limit]
+        rows = [self._users[_key_uid(k)].dashboard_row() for k in dated]
+        if len(rows) < limit:
+            start = max(0, offset - len(self._dated))
+            rows += [self._users[uid].dashboard_row() for uid in self._undated[start:start + limit - len(rows)]]
+        return rows
+
+
+def _remove(items: list, key) -> None:
+    i = bisect_left(items, key)
+    if i < len(items) and items[i] == key:
+        del items[i]
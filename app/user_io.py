@@ -0,0 +1,170 @@
+"""
+Массовый импорт/экспорт пользователей.
+Импорт: CSV (user_id,name,end_time; заголовок необязателен), JSON Lines или JSON-массив объектов.
+Файл читается потоково и пишется пачками по IMPORT_BATCH строк — одна транзакция на пачку.
+"""
+from __future__ import annotations
+import csv
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import IO, Any, Iterator, Optional
+
+from app.db import END_TIME_FORMAT, MAX_USER_ID, stream_all_users, upsert_users
+
+IMPORT_BATCH = 2000
+MAX_ERRORS_SHOWN = 10
+NAME_MAX_LEN = 128
+_JSON_READ_SIZE = 64 * 1024
+_JSON_MAX_ITEM = 256 * 1024  # элемент массива длиннее — файл битый: дальше не читаем
+
+COLUMNS = ("user_id", "name", "end_time")
+EXPORT_COLUMNS = ("user_id", "name", "end_time", "approved", "active")
+
+
+@dataclass
+class ImportReport:
+    inserted: int = 0
+    updated: int = 0
+    rejected: int = 0
+    errors: list[str] = field(default_factory=list)  # первые MAX_ERRORS_SHOWN причин
+
+    def reject(self, where: Any, reason: str) -> None:
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS_SHOWN:
+            self.errors.append(f"{where}: {reason}")
+
+
+def _parse_record(rec: dict) -> tuple[int, Optional[str], Optional[str]]:
+    """Проверить запись; ValueError с причиной, если она не годится."""
+    raw_uid = rec.get("user_id")
+    try:
+        uid = int(str(raw_uid).strip())
+    except (TypeError, ValueError):
+        raise ValueError(f"bad user_id {raw_uid!r}")
+    if not 0 < uid <= MAX_USER_ID:
+        raise ValueError(f"bad user_id {raw_uid!r}")
+
+    name = str(rec.get("name") or "").strip() or None
+    if name and len(name) > NAME_MAX_LEN:
+        raise ValueError("name too long")
+
+    end_time = str(rec.get("end_time") or "").strip() or None
+    if end_time:
+        try:
+            end_time = datetime.strptime(end_time, END_TIME_FORMAT).strftime(END_TIME_FORMAT)
+        except ValueError:
+            raise ValueError(f"bad end_time {end_time!r}, expected YYYY-MM-DD HH:MM:SS")
+    return uid, name, end_time
+
+
+def _iter_csv(f: IO[str]) -> Iterator[tuple[int, Any]]:
+    reader = csv.reader(f)
+    columns = COLUMNS
+    for row in reader:
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        if reader.line_num == 1 and not row[0].strip().lstrip("-").isdigit():
+            columns = tuple(cell.strip().lower() for cell in row)  # заголовок
+            continue
+        yield reader.line_num, dict(zip(columns, row))
+
+
+def _iter_json_array(f: IO[str]) -> Iterator[tuple[int, Any]]:
+    """Элементы JSON-массива по одному, не читая файл целиком."""
+    decoder = json.JSONDecoder()
+    buf, index, eof = f.read(_JSON_READ_SIZE), 0, False
+    pos = buf.index("[") + 1
+    while True:
+        while True:  # пропускаем пробелы и запятые
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf, pos = f.read(_JSON_READ_SIZE), 0
+            eof = not buf
+        if pos >= len(buf) or buf[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if len(buf) - pos > _JSON_MAX_ITEM:
+                raise ValueError(f"element {index + 1} is not valid JSON within {_JSON_MAX_ITEM} chars")
+            chunk = "" if eof else f.read(_JSON_READ_SIZE)
+            if not chunk:
+                raise
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        index += 1
+        yield index, item
+        pos = end
+        if pos > _JSON_READ_SIZE:
+            buf, pos = buf[pos:], 0
+
+
+def _iter_jsonl(f: IO[str]) -> Iterator[tuple[int, Any]]:
+    for line_no, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, e
+
+
+def iter_records(f: IO[str]) -> Iterator[tuple[int, Any]]:
+    """(номер строки/элемента, dict | ошибка) — формат определяется по первому символу."""
+    head = f.read(1)
+    while head and head.isspace():
+        head = f.read(1)
+    f.seek(0)
+    if head == "[":
+        return _iter_json_array(f)
+    if head == "{":
+        return _iter_jsonl(f)
+    return _iter_csv(f)
+
+
+async def import_users_file(path: str) -> ImportReport:
+    report = ImportReport()
+    batch: list[tuple[int, Optional[str], Optional[str]]] = []
+
+    async def flush() -> None:
+        inserted, updated = await upsert_users(batch)
+        report.inserted += inserted
+        report.updated += updated
+        batch.clear()
+
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        try:
+            for where, rec in iter_records(f):
+                if not isinstance(rec, dict):
+                    report.reject(where, "not an object" if not isinstance(rec, Exception) else str(rec))
+                    continue
+                try:
+                    batch.append(_parse_record(rec))
+                except ValueError as e:
+                    report.reject(where, str(e))
+                    continue
+                if len(batch) >= IMPORT_BATCH:
+                    await flush()
+        except UnicodeDecodeError:  # подкласс ValueError: не в UTF-8 — это не «частичный» импорт
+            raise
+        except (ValueError, csv.Error) as e:  # битый файл: то, что успели, уже записано
+            report.reject("file", f"parse stopped: {e}")
+    if batch:
+        await flush()
+    return report
+
+
+async def export_users_csv(path: str) -> int:
+    """Выгрузить users в CSV (совместим с импортом). Возвращает число строк."""
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(EXPORT_COLUMNS)
+        async for uid, name, end_time, approved, active in stream_all_users():
+            writer.writerow((uid, name or "", end_time or "", int(approved), int(active)))
+            count += 1
+    return count
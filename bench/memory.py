@@ -0,0 +1,110 @@
+"""
+Бенчмарк памяти: полный список против потокового чтения users.
+
+    python -m bench.memory --users 100000 1000000 --chunk 1000
+
+Для каждого N временная БД заполняется заново, затем каждый вариант читает
+всю выборку в отдельном процессе (spawn), чтобы пики RSS не смешивались.
+Метрика — прирост пикового RSS (ru_maxrss) относительно момента после init_db:
+у get_* он растёт с N, у stream_* должен оставаться примерно постоянным.
+В RSS попадают и страницы файла БД, отображённые через mmap (до DB_MMAP_BYTES):
+чтобы видеть только память процесса, запускайте с DB_MMAP_BYTES=0.
+Результат — JSON в stdout.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import resource
+import sqlite3
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("ADMIN_ID", "0")
+
+CASES = ("get_all_users", "stream_all_users", "get_active_users_with_flags", "stream_active_users_with_flags")
+
+
+def _peak_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Linux: KiB
+
+
+def _init_schema(path: str) -> None:
+    os.environ["DB_PATH"] = path  # app.db читает DB_PATH при импорте — поэтому в своём процессе
+    from app import db
+
+    async def init() -> None:
+        await db.init_db()
+        await db.dispose_db()
+    asyncio.run(init())
+
+
+def _seed(ctx, path: str, users: int) -> None:
+    """Схема — через init_db (заодно записывается rules_hash), строки — напрямую через sqlite3."""
+    proc = ctx.Process(target=_init_schema, args=(path,))
+    proc.start()
+    proc.join()
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO users (user_id, name, end_time, expiry, active, approved) "
+            "VALUES (?, ?, '2030-01-01 10:00:00', 1893488400, 1, 1)",
+            ((uid, f"user {uid}") for uid in range(1, users + 1)),
+        )
+    conn.close()
+
+
+def _child(path: str, case: str, chunk: int, out) -> None:
+    os.environ["DB_PATH"] = path
+    from app import db
+
+    async def run() -> dict:
+        await db.init_db()
+        base = _peak_rss_kb()
+        started = time.perf_counter()
+        if case.startswith("stream_"):
+            rows = 0
+            async for _row in getattr(db, case)(chunk):
+                rows += 1
+        else:
+            rows = len(await getattr(db, case)())
+        elapsed = time.perf_counter() - started
+        await db.dispose_db()
+        return {"rows": rows, "seconds": round(elapsed, 2),
+                "peak_rss_mb": round(_peak_rss_kb() / 1024, 1),
+                "peak_growth_mb": round((_peak_rss_kb() - base) / 1024, 1)}
+
+    out.put(asyncio.run(run()))
+
+
+def main(argv: list[str] | None = None) -> None:
+    p = argparse.ArgumentParser(prog="python -m bench.memory")
+    p.add_argument("--users", type=int, nargs="+", default=[100_000, 1_000_000])
+    p.add_argument("--chunk", type=int, default=1000, help="yield_per для stream_*")
+    p.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    args = p.parse_args(argv)
+
+    ctx = mp.get_context("spawn")
+    runs = []
+    for users in args.users:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "bench.db")
+            _seed(ctx, path, users)
+            cases = {}
+            for case in args.cases:
+                out = ctx.Queue()
+                proc = ctx.Process(target=_child, args=(path, case, args.chunk, out))
+                proc.start()
+                cases[case] = out.get()
+                proc.join()
+                print(f"{users} {case}: {cases[case]}", file=sys.stderr)
+            runs.append({"users": users, "cases": cases})
+    json.dump({"chunk": args.chunk, "runs": runs}, sys.stdout, ensure_ascii=False, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Бенчмарк чтения: одно соединение против пула читателей (WAL).
+
+    python -m bench.read_pool --users 100000 --readers 32 --queries 20000
+
+Создаёт временную БД, заполняет её и гоняет одинаковую нагрузку из точечных
+запросов статуса пользователя через оба варианта, в двух режимах:
+- reads_only — только чтения. Точечный запрос по PK в основном тратит время
+  в Python/aiosqlite, а не в SQLite, поэтому выигрыш пула здесь небольшой;
+- with_writes — те же чтения, пока фоновая задача непрерывно коммитит UPDATE.
+  С одним соединением чтения стоят в очереди за транзакциями записи (как было
+  до отдельного писателя); с пулом они идут мимо писателя, который пишет
+  через своё соединение (app.db._write).
+Результат — JSON в stdout: qps и p95 задержки чтения по режимам.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+
+def _seed(path: str, users: int) -> None:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, name TEXT, end_time TEXT, "
+        "expiry INTEGER, active BOOLEAN, approved BOOLEAN, tminus3_sent BOOLEAN, onday_sent BOOLEAN, "
+        "after_sent BOOLEAN)"
+    )
+    conn.executemany(
+        "INSERT INTO users VALUES (?, ?, '2030-01-01 10:00:00', 1893488400, 1, 1, 0, 0, 0)",
+        ((uid, f"user {uid}") for uid in range(1, users + 1)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def _p95(samples: list[float]) -> float:
+    samples = sorted(samples)
+    return samples[int(len(samples) * 0.95)] if samples else 0.0
+
+
+async def _run(session_factory, users: int, readers: int, queries: int, write=None) -> dict:
+    """write — async fn(uid), которую фоновая задача вызывает без пауз, пока идут чтения."""
+    from sqlalchemy import select
+    from app.db import User
+
+    per_reader = queries // readers
+    rnd = random.Random(42)
+    ids = [[rnd.randint(1, users) for _ in range(per_reader)] for _ in range(readers)]
+    latencies: list[float] = []
+
+    async def reader(batch):
+        for uid in batch:
+            started = time.perf_counter()
+            async with session_factory() as session:
+                result = await session.execute(
+                    select(User.approved, User.end_time, User.active).where(User.user_id == uid)
+                )
+                result.first()
+            latencies.append(time.perf_counter() - started)
+
+    writes = 0
+    done = asyncio.Event()
+
+    async def writer():
+        nonlocal writes
+        wrnd = random.Random(7)
+        while not done.is_set():
+            await write(wrnd.randint(1, users))
+            writes += 1
+
+    writer_task = asyncio.create_task(writer()) if write else None
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(reader(b) for b in ids))
+    finally:
+        elapsed = time.perf_counter() - started
+        done.set()
+        if writer_task:
+            await writer_task
+    out = {"qps": round(per_reader * readers / elapsed, 1), "p95_ms": round(_p95(latencies) * 1000, 2)}
+    if write:
+        out["writes_per_s"] = round(writes / elapsed, 1)
+    return out
+
+
+async def main_async(args) -> dict:
+    from sqlalchemy import update
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+    from app import db
+
+    _seed(str(db.DB_PATH), args.users)
+    await db.init_db()
+
+    single = create_async_engine(db._DB_URL, pool_size=1, max_overflow=0, connect_args={"timeout": 30})
+    single_session = sessionmaker(single, class_=AsyncSession, expire_on_commit=False)
+
+    def stmt(uid: int):
+        return update(db.User).where(db.User.user_id == uid).values(name=f"user {uid} {time.time()}")
+
+    async def single_write(uid: int) -> None:
+        async with single_session() as session:  # та же единственная очередь соединения, что и у чтений
+            await session.execute(stmt(uid))
+            await session.commit()
+
+    async def pool_write(uid: int) -> None:
+        async def op(session):
+            await session.execute(stmt(uid))
+        await db._write(op)
+
+    run = lambda factory, write=None: _run(factory, args.users, args.readers, args.queries, write)
+    try:
+        modes = {
+            "reads_only": {"single": await run(single_session), "pool": await run(db.async_session)},
+            "with_writes": {"single": await run(single_session, single_write),
+                            "pool": await run(db.async_session, pool_write)},
+        }
+    finally:
+        await single.dispose()
+        await db.dispose_db()
+    for m in modes.values():
+        m["speedup"] = round(m["pool"]["qps"] / m["single"]["qps"], 2)
+    return {
+        "users": args.users,
+        "readers": args.readers,
+        "queries": args.queries,
+        "read_pool_size": db.DB_READ_POOL,
+        "modes": modes,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--readers", type=int, default=32)
+    parser.add_argument("--queries", type=int, default=20_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DB_PATH"] = os.path.join(tmp, "bench.db")
+        os.environ.setdefault("ADMIN_ID", "0")
+        print(json.dumps(asyncio.run(main_async(args)), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+Набор бенчмарков слоя БД, тика планировщика и дашборда на синтетических данных.
+
+    python -m bench --users 10000 100000 --repeat 5 --out bench.json
+
+Для каждого N временная БД заполняется заново: ~10% без даты, остальные даты
+равномерно в [-30; +90] дней от «сейчас» (11:01 по Берлину), ~1% истекают в последний час.
+Кейсы:
+- active_users_with_flags — get_active_users_with_flags();
+- tick — разбор корзин next_due планировщиком (постановка в outbox вместе с notification_log);
+- outbox_drain — отправка поставленного в outbox через заглушку Bot (без лимитов);
+- dashboard_first / dashboard_last — keyset-страница + _format_dashboard_page;
+- set_picker_last — последняя страница пикера (OFFSET);
+- writes — approve_user/set_end_time/update_active_status из --concurrency задач одновременно.
+С USER_INDEX=1 те же кейсы читают из индекса в памяти (app/user_index.py).
+Результат — JSON (stdout или --out), пригодный для сравнения между коммитами.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+CASES = ("active_users_with_flags", "tick", "outbox_drain", "dashboard_first", "dashboard_last",
+         "set_picker_last", "writes")
+
+
+class StubBot:
+    """Вместо Telegram: считает вызовы send_message."""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+
+
+def _bench_now() -> datetime:
+    from app.db import TZ
+    today = datetime.now(TZ).date()
+    return datetime(today.year, today.month, today.day, 11, 1, tzinfo=TZ)
+
+
+def _seed(path: str, users: int, now: datetime, seed: int = 42) -> None:
+    """Перезаполнить users (и очистить outbox) напрямую через sqlite3 — быстро и без писателя."""
+    from app.db import END_TIME_FORMAT, _end_time_to_epoch, _next_due
+
+    rnd = random.Random(seed)
+    naive_now = now.replace(tzinfo=None)
+
+    def rows():
+        for uid in range(1, users + 1):
+            r = rnd.random()
+            if r < 0.10:
+                end_time = None
+            elif r < 0.11:
+                end_time = (naive_now - timedelta(seconds=rnd.randint(1, 3599))).strftime(END_TIME_FORMAT)
+            else:
+                end_time = (naive_now + timedelta(seconds=rnd.randint(-30 * 86400, 90 * 86400))).strftime(END_TIME_FORMAT)
+            expiry = _end_time_to_epoch(end_time)
+            active = end_time is not None
+            yield (uid, f"user {uid}", end_time, expiry, active, True,
+                   _next_due(expiry, None, None, active, now=now))
+
+    conn = sqlite3.connect(path, timeout=30)
+    with conn:
+        conn.execute("DELETE FROM users")
+        conn.execute("DELETE FROM outbox")
+        conn.execute("DELETE FROM notification_log")
+        conn.executemany(
+            "INSERT INTO users (user_id, name, end_time, expiry, active, approved, next_due) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows(),
+        )
+    conn.execute("ANALYZE")
+    conn.close()
+
+
+async def _timed(fn: Callable[[], Awaitable[object]], repeat: int) -> dict:
+    times, result = [], None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = await fn()
+        times.append(time.perf_counter() - started)
+    out = {
+        "repeat": repeat,
+        "min_ms": round(min(times) * 1000, 3),
+        "median_ms": round(statistics.median(times) * 1000, 3),
+        "max_ms": round(max(times) * 1000, 3),
+    }
+    if isinstance(result, int):
+        out["items"] = result
+    return out
+
+
+async def _run_size(users: int, args, db_path: str) -> dict:
+    from app import db, outbox, scheduler
+    from app.handlers import admin
+
+    now = _bench_now()
+    _seed(db_path, users, now)
+    db._user_cache.clear()
+    if db.USER_INDEX:
+        await db._load_user_index()  # seed пишет в обход писателя — перечитываем
+    results: dict[str, dict] = {}
+    wanted = set(args.cases)
+
+    if "active_users_with_flags" in wanted:
+        async def active():
+            return len(await db.get_active_users_with_flags())
+        results["active_users_with_flags"] = await _timed(active, args.repeat)
+
+    async def dashboard(backward: bool):
+        rows, _more = await db.get_dashboard_page("all", None, backward, admin.PAGE_SIZE)
+        total, with_date = await db.get_dashboard_counts()
+        admin._format_dashboard_page(rows, total, with_date, "all", 0)
+        return len(rows)
+
+    if "dashboard_first" in wanted:
+        results["dashboard_first"] = await _timed(lambda: dashboard(False), args.repeat)
+    if "dashboard_last" in wanted:
+        results["dashboard_last"] = await _timed(lambda: dashboard(True), args.repeat)
+    if "set_picker_last" in wanted:
+        async def picker():
+            items, _page, _total = await admin._set_picker_items(10 ** 9)
+            return len(items)
+        results["set_picker_last"] = await _timed(picker, args.repeat)
+
+    if "tick" in wanted or "outbox_drain" in wanted:
+        # тик меняет флаги, поэтому одна итерация на свежих данных
+        async def tick():
+            await scheduler._process_due(now)
+            return await _count_outbox(db_path)
+        results["tick"] = await _timed(tick, 1)
+
+    if "outbox_drain" in wanted:
+        bot = StubBot()
+
+        async def drain():
+            # окна считаем от реальных часов — снимаем срок годности, чтобы мерить саму отправку
+            conn = sqlite3.connect(db_path, timeout=30)
+            with conn:
+                conn.execute("UPDATE outbox SET expires_at = NULL, next_at = 0")
+            conn.close()
+            while await outbox._drain_once(bot):
+                pass
+            return bot.sent
+        results["outbox_drain"] = await _timed(drain, 1)
+
+    if "writes" in wanted:
+        async def writes():
+            rnd = random.Random(7)
+            per_task = args.writes // args.concurrency
+            end_time = (now + timedelta(days=10)).strftime(db.END_TIME_FORMAT)
+
+            async def worker():
+                for _ in range(per_task):
+                    uid = rnd.randint(1, users)
+                    op = rnd.random()
+                    if op < 0.4:
+                        await db.approve_user(uid, f"user {uid}")
+                    elif op < 0.7:
+                        await db.set_end_time(uid, end_time)
+                    else:
+                        await db.update_active_status(uid, True)
+            await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+            return per_task * args.concurrency
+        res = await _timed(writes, args.repeat)
+        res["concurrency"] = args.concurrency
+        res["ops_per_s"] = round(res["items"] / (res["median_ms"] / 1000), 1)
+        results["writes"] = res
+
+    return {"users": users, "cases": results}
+
+
+async def _count_outbox(db_path: str) -> int:
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=5, check=True).stdout.strip() or None
+    except Exception:
+        return None
+
+
+async def main_async(args, db_path: str) -> dict:
+    from app import db
+    from app.sender import close_sender
+
+    await db.init_db()
+    runs = []
+    try:
+        for users in args.users:
+            runs.append(await _run_size(users, args, db_path))
+    finally:
+        await close_sender()
+        await db.dispose_db()
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "repeat": args.repeat,
+        },
+        "runs": runs,
+    }
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--writes", type=int, default=2000, help="операций записи за прогон")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--out", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        os.environ["DB_PATH"] = db_path
+        os.environ.setdefault("ADMIN_ID", "0")
+        os.environ["SEND_RATE"] = "0"           # заглушка Bot: лимиты Telegram не меряем
+        os.environ["SEND_CHAT_INTERVAL"] = "0"
+        report = asyncio.run(main_async(args, db_path))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
@@ -1,4 +1,62 @@
 import os
+import socket
 class Config:
     BOT_TOKEN = os.getenv('BOT_TOKEN')
-    ADMIN_ID = int(os.getenv('ADMIN_ID'))
\ No newline at end of file
+    ADMIN_ID = int(os.getenv('ADMIN_ID'))
+
+    # исходящие сообщения (app/sender.py)
+    SEND_WORKERS = int(os.getenv('SEND_WORKERS', '8'))
+    SEND_RATE = float(os.getenv('SEND_RATE', '30'))                    # сообщений/сек на бота
+    SEND_CHAT_INTERVAL = float(os.getenv('SEND_CHAT_INTERVAL', '1.0')) # сек между сообщениями в один чат
+
+    # режим получения апдейтов: polling (по умолчанию) или webhook
+    BOT_MODE = os.getenv('BOT_MODE', 'polling').strip().lower()
+    WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '').rstrip('/')  # https://bot.example.com; пусто — setWebhook не вызываем
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')                   # X-Telegram-Bot-Api-Secret-Token
+    WEBAPP_HOST = os.getenv('WEBAPP_HOST', '0.0.0.0')
+    WEBAPP_PORT = int(os.getenv('WEBAPP_PORT', '8080'))
+    TELEGRAM_API_BASE = os.getenv('TELEGRAM_API_BASE', '')            # напр. http://127.0.0.1:8081 (локальный/фейковый Bot API)
+
+    # HTTP-клиент Bot API (app/bot.py): одна сессия на процесс, переживает переподключения polling
+    HTTP_TIMEOUT = float(os.getenv('HTTP_TIMEOUT', '15'))              # сек на обычный запрос (sendMessage и т.п.)
+    POLL_TIMEOUT = int(os.getenv('POLL_TIMEOUT', '30'))                # сек long polling getUpdates; запрос ждёт POLL_TIMEOUT + HTTP_TIMEOUT
+    HTTP_POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', '100'))         # соединений к Bot API (0 — без лимита)
+    HTTP_DNS_TTL = int(os.getenv('HTTP_DNS_TTL', '3600'))              # сек кэша DNS
+    HTTP_KEEPALIVE = float(os.getenv('HTTP_KEEPALIVE', '60'))          # сек держать простаивающее соединение открытым
+
+    # outbox уведомлений (app/outbox.py)
+    OUTBOX_BATCH = int(os.getenv('OUTBOX_BATCH', '200'))               # записей за один проход
+    OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+    OUTBOX_KEEP_DAYS = int(os.getenv('OUTBOX_KEEP_DAYS', '30'))        # сколько хранить завершённые записи
+    OUTBOX_SENDING_TIMEOUT = int(os.getenv('OUTBOX_SENDING_TIMEOUT', '600'))  # сек в 'sending' без итога — отправитель пропал
+
+    # лидерство между репликами (app/leader.py): планировщик работает только у держателя аренды
+    INSTANCE_ID = os.getenv('INSTANCE_ID') or f"{socket.gethostname()}:{os.getpid()}"
+    LEASE_TTL = float(os.getenv('LEASE_TTL', '30'))                    # сек: после — аренду забирает другая реплика
+    LEASE_RENEW = float(os.getenv('LEASE_RENEW', '10'))                # сек между продлениями
+
+    # метрики Prometheus и /healthz (app/metrics.py)
+    METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))              # 0 — не поднимать HTTP
+    HEALTH_MAX_LOOP_LAG = float(os.getenv('HEALTH_MAX_LOOP_LAG', '5'))  # сек
+    HEALTH_POLL_STALE = float(os.getenv('HEALTH_POLL_STALE', '180'))    # сек без успешного getUpdates
+
+    # медленные апдейты и выборочное профилирование (UpdateTimingMiddleware)
+    SLOW_UPDATE_MS = float(os.getenv('SLOW_UPDATE_MS', '500'))         # дольше — warning в лог
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))  # доля апдейтов под cProfile (0 — выкл)
+    PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/bot-profiles')        # /tmp доступен на read-only FS
+    PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '50'))                # сколько последних профилей хранить
+
+    # FSM-состояния в SQLite (app/fsm_storage.py)
+    FSM_TTL = float(os.getenv('FSM_TTL', '86400'))                     # сек без изменений — состояние сбрасывается (0 — без TTL)
+    FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', '1000'))          # ключей в памяти
+    FSM_FLUSH_SECONDS = float(os.getenv('FSM_FLUSH_SECONDS', '1.0'))   # интервал write-back в БД
+
+    # рассылки админа (app/broadcast.py)
+    BROADCAST_CHUNK = int(os.getenv('BROADCAST_CHUNK', '100'))         # получателей между чекпоинтами
+    BROADCAST_PROGRESS_SECONDS = float(os.getenv('BROADCAST_PROGRESS_SECONDS', '3'))  # как часто править прогресс
+
+    # время напоминаний (app/reminders.py): у пользователя можно переопределить пояс и час
+    DEFAULT_TZ = os.getenv('DEFAULT_TZ', 'Europe/Berlin')              # IANA-имя
+    REMINDER_HOUR = int(os.getenv('REMINDER_HOUR', '11'))              # час отправки T-3 и «в день»
@@ -0,0 +1,185 @@
+"""
+Локальный фейковый Telegram Bot API (aiohttp) для проверки отправки без сети.
+
+    python -m tools.fake_bot_api --messages 200 --latency 0.1 --flood 0.05
+
+Запускает сервер, направляет на него Bot и прогоняет сообщения через SendPipeline.
+Умеет getUpdates (long polling из очереди push_update), sendMessage, editMessageText,
+answerCallbackQuery; остальные методы отвечают True. Нагрузочный прогон — tools.load_test.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from collections import deque
+from contextlib import suppress
+from typing import Any, Callable
+
+from aiohttp import web
+
+os.environ.setdefault("ADMIN_ID", "0")
+
+FAKE_TOKEN = "123456:TEST-fake-token"
+
+
+class FakeBotAPI:
+    """Отвечает на методы Bot API; latency — задержка ответа, flood — доля ответов 429."""
+
+    def __init__(self, latency: float = 0.0, flood: float = 0.0, retry_after: int = 1,
+                 host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.flood = flood
+        self.retry_after = retry_after
+        self.host = host
+        self.port = port
+        self.calls: list[tuple[str, dict, float]] = []
+        self.record_calls = True
+        self.flooded = 0  # сколько раз ответили 429
+        self.listeners: list[Callable[[str, dict, float], None]] = []  # (method, payload, monotonic)
+        self._updates: deque[dict] = deque()
+        self._updates_ready = asyncio.Event()
+        self.polled = asyncio.Event()  # бот хотя бы раз пришёл за апдейтами
+        self._message_id = 0
+        self._runner: web.AppRunner | None = None
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self._handle)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]  # type: ignore[union-attr]
+
+    async def close(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def _payload(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        data = await request.post()
+        return {k: v for k, v in data.items() if isinstance(v, str)}
+
+    def push_update(self, update: dict) -> None:
+        """Положить Update в очередь, которую бот заберёт через getUpdates."""
+        self._updates.append(update)
+        self._updates_ready.set()
+
+    async def _get_updates(self, payload: dict) -> list[dict]:
+        offset = int(payload.get("offset") or 0)
+        limit = int(payload.get("limit") or 100)
+        timeout = float(payload.get("timeout") or 0)
+        self.polled.set()
+        while self._updates and self._updates[0]["update_id"] < offset:  # подтверждённые
+            self._updates.popleft()
+        if not self._updates and timeout:
+            self._updates_ready.clear()
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._updates_ready.wait(), timeout)
+        return [self._updates[i] for i in range(min(limit, len(self._updates)))]
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        payload = await self._payload(request)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(payload)})
+        if self.flood and random.random() < self.flood:
+            self.flooded += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+        now = time.monotonic()
+        if self.record_calls:
+            self.calls.append((method, payload, now))
+        for listener in self.listeners:
+            listener(method, payload, now)
+        return web.json_response({"ok": True, "result": self.result(method, payload)})
+
+    def _message(self, chat_id: int, text: str, message_id: int | None = None) -> dict:
+        if message_id is None:
+            self._message_id += 1
+            message_id = self._message_id
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text,
+        }
+
+    def result(self, method: str, payload: dict) -> Any:
+        if method == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "fake", "username": "fake_bot"}
+        if method == "sendMessage":
+            return self._message(int(payload.get("chat_id", 0)), payload.get("text", ""))
+        if method == "editMessageText":
+            if payload.get("inline_message_id"):
+                return True
+            return self._message(int(payload.get("chat_id", 0)), payload.get("text", ""),
+                                 int(payload.get("message_id", 0)))
+        return True
+
+
+def make_bot(api: FakeBotAPI, **session_kwargs):
+    """Bot, который ходит в FakeBotAPI вместо api.telegram.org."""
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api.base_url), **session_kwargs)
+    return Bot(token=FAKE_TOKEN, session=session)
+
+
+async def _check(args) -> dict:
+    from app.sender import SendJob, SendPipeline
+
+    api = FakeBotAPI(latency=args.latency, flood=args.flood)
+    await api.start()
+    bot = make_bot(api)
+    pipeline = SendPipeline(bot, workers=args.workers, rate=args.rate, chat_interval=args.chat_interval)
+    try:
+        jobs = [SendJob(1000 + i % args.chats, f"msg {i}", key=i) for i in range(args.messages)]
+        started = time.monotonic()
+        results = await pipeline.send_many(jobs)
+        elapsed = time.monotonic() - started
+    finally:
+        await pipeline.close()
+        await bot.session.close()
+        await api.close()
+    ok = sum(1 for r in results if r.ok)
+    return {
+        "messages": args.messages,
+        "ok": ok,
+        "failed": len(results) - ok,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_msg_s": round(len(results) / elapsed, 2) if elapsed else None,
+        "requests_seen": len(api.calls),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--chats", type=int, default=200, help="число разных chat_id")
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--flood", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=30.0)
+    parser.add_argument("--chat-interval", type=float, default=1.0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(_check(args)), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Проверка аренды лидерства на нескольких процессах с одним SQLite-файлом.
+
+    python -m tools.lease_check --procs 3 --seconds 20 --ttl 2 --renew 0.5
+
+Каждый процесс крутит run_as_leader("check", work); work, пока жив, пишет
+"<pid> <time>" в общий лог. Посередине лидера убивают SIGKILL — аренду должен
+забрать другой процесс не позже чем через ttl. В конце лог проверяется:
+интервалы лидерства разных процессов не пересекаются.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import multiprocessing as mp
+import os
+import signal
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("ADMIN_ID", "0")
+
+TICK = 0.1  # как часто лидер отмечается в логе
+GAP = 0.5   # разрыв в отметках больше этого — конец интервала лидерства
+
+
+def _worker(db_path: str, log_path: str, seconds: float, ttl: float, renew: float) -> None:
+    os.environ["DB_PATH"] = db_path
+    from app.db import init_db, dispose_db
+    from app.leader import run_as_leader
+
+    async def work() -> None:
+        fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            while True:
+                os.write(fd, f"{os.getpid()} {time.time():.3f}\n".encode())
+                await asyncio.sleep(TICK)
+        finally:
+            os.close(fd)
+
+    async def main() -> None:
+        await init_db()
+        try:
+            await asyncio.wait_for(
+                run_as_leader("check", work, holder=f"pid-{os.getpid()}", ttl=ttl, renew_every=renew),
+                timeout=seconds,
+            )
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await dispose_db()
+
+    asyncio.run(main())
+
+
+def _intervals(log_path: str) -> list[tuple[int, float, float]]:
+    """(pid, начало, конец) непрерывных интервалов лидерства."""
+    marks: dict[int, list[float]] = {}
+    with open(log_path) as f:
+        for line in f:
+            pid, ts = line.split()
+            marks.setdefault(int(pid), []).append(float(ts))
+    out = []
+    for pid, stamps in marks.items():
+        stamps.sort()
+        start = prev = stamps[0]
+        for ts in stamps[1:]:
+            if ts - prev > GAP:
+                out.append((pid, start, prev))
+                start = ts
+            prev = ts
+        out.append((pid, start, prev))
+    return sorted(out, key=lambda i: i[1])
+
+
+def _current_leader(log_path: str) -> int | None:
+    try:
+        with open(log_path) as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return None
+    return int(lines[-1].split()[0]) if lines else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--procs", type=int, default=3)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--ttl", type=float, default=2)
+    parser.add_argument("--renew", type=float, default=0.5)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="lease_check_")
+    db_path, log_path = os.path.join(tmp, "bot.db"), os.path.join(tmp, "leader.log")
+
+    ctx = mp.get_context("spawn")
+    procs = [ctx.Process(target=_worker, args=(db_path, log_path, args.seconds, args.ttl, args.renew))
+             for _ in range(args.procs)]
+    for p in procs:
+        p.start()
+        time.sleep(0.2)  # init_db у первого процесса создаёт схему
+
+    time.sleep(args.seconds / 3)
+    killed = _current_leader(log_path)
+    if killed:
+        os.kill(killed, signal.SIGKILL)
+        killed_at = time.time()
+        print(f"killed leader pid={killed}")
+    for p in procs:
+        p.join(args.seconds + 30)
+
+    intervals = _intervals(log_path)
+    for pid, start, end in intervals:
+        print(f"pid={pid} leader {start:.2f} .. {end:.2f} ({end - start:.1f}s)")
+
+    errors = []
+    for (pid_a, _s, end_a), (pid_b, start_b, _e) in zip(intervals, intervals[1:]):
+        if pid_a != pid_b and start_b < end_a:
+            errors.append(f"overlap: pid={pid_a} until {end_a:.2f}, pid={pid_b} from {start_b:.2f}")
+    if killed:
+        takeover = [start for pid, start, _e in intervals if pid != killed and start >= killed_at - TICK]
+        if not takeover:
+            errors.append("nobody took over after the leader was killed")
+        else:
+            delay = takeover[0] - killed_at
+            print(f"takeover after {delay:.2f}s (ttl {args.ttl}s)")
+            if delay > args.ttl + args.renew + 1:
+                errors.append(f"takeover too slow: {delay:.2f}s")
+
+    for e in errors:
+        print("FAIL", e)
+    print("OK" if not errors else "FAILED", tmp)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Нагрузочный прогон хэндлеров целиком, без сети: фейковый Bot API + long polling.
+
+    python -m tools.load_test --rate 1000 --duration 10 --latency 0.005 --flood 0.01
+
+В отдельном процессе поднимаются tools.fake_bot_api и генератор (чтобы не делить
+с ботом event loop и CPU), в основном — временная БД с --users одобренными
+пользователями и диспетчер с роутерами app.handlers в режиме long polling.
+Генератор кладёт апдейты в очередь getUpdates с частотой --rate: /start, кнопка
+user_check, админские admin_dashboard и страница дашборда (доли — --mix).
+Задержка «апдейт → ответ» считается от постановки апдейта до первого ответа бота:
+sendMessage в тот же чат для сообщений, answerCallbackQuery для колбэков.
+Итог — JSON: p50/p95/p99, пропускная способность, потерянные ответы.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import random
+import tempfile
+import time
+from collections import Counter, deque
+from contextlib import suppress
+
+os.environ.setdefault("ADMIN_ID", "1")
+
+KINDS = ("start", "user_check", "admin_dashboard", "admin_page")
+DEFAULT_MIX = "start=4,user_check=4,admin_dashboard=1,admin_page=1"
+USER_ID_BASE = 10_000
+
+
+def _parse_mix(raw: str) -> tuple[list[str], list[float]]:
+    weights = {}
+    for part in raw.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in KINDS:
+            raise SystemExit(f"unknown kind in --mix: {kind!r} (known: {', '.join(KINDS)})")
+        weights[kind.strip()] = float(weight or 1)
+    return list(weights), list(weights.values())
+
+
+def _percentile(sorted_values: list[float], p: float) -> float | None:
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[idx]
+
+
+class Tracker:
+    """Сопоставляет ответы бота с апдейтами и копит задержки."""
+
+    def __init__(self):
+        self.by_chat: dict[int, deque[tuple[str, float]]] = {}  # сообщения: FIFO по чату
+        self.by_callback: dict[str, tuple[str, float]] = {}
+        self.latencies: dict[str, list[float]] = {k: [] for k in KINDS}
+        self.first_push: float | None = None
+        self.last_reply: float | None = None
+
+    def pushed_message(self, kind: str, chat_id: int, ts: float) -> None:
+        self.first_push = self.first_push or ts
+        self.by_chat.setdefault(chat_id, deque()).append((kind, ts))
+
+    def pushed_callback(self, kind: str, callback_id: str, ts: float) -> None:
+        self.first_push = self.first_push or ts
+        self.by_callback[callback_id] = (kind, ts)
+
+    def on_call(self, method: str, payload: dict, ts: float) -> None:
+        item = None
+        if method == "sendMessage":
+            queue = self.by_chat.get(int(payload.get("chat_id", 0)))
+            if queue:
+                item = queue.popleft()
+        elif method == "answerCallbackQuery":
+            item = self.by_callback.pop(str(payload.get("callback_query_id")), None)
+        if item:
+            kind, pushed = item
+            self.latencies[kind].append(ts - pushed)
+            self.last_reply = ts
+
+    @property
+    def outstanding(self) -> int:
+        return len(self.by_callback) + sum(len(q) for q in self.by_chat.values())
+
+
+def _message_update(update_id: int, user_id: int, text: str) -> dict:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def _callback_update(update_id: int, user_id: int, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": str(user_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": 123456, "is_bot": True, "first_name": "fake"},
+                "text": "Меню:",
+            },
+        },
+    }
+
+
+async def _seed(users: int) -> None:
+    from app.db import upsert_users
+    end_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(time.time() + 30 * 86400))
+    rows = [(USER_ID_BASE + i, f"Load {i}", end_time) for i in range(users)]
+    for i in range(0, len(rows), 5000):
+        await upsert_users(rows[i:i + 5000])
+
+
+async def _generate(api, tracker: Tracker, args, kinds, weights) -> int:
+    from config import Config
+
+    rnd = random.Random(42)
+    update_id, carry, tick = 0, 0.0, 0.01
+    started = time.monotonic()
+    while time.monotonic() - started < args.duration:
+        carry += args.rate * tick
+        for _ in range(int(carry)):
+            update_id += 1
+            kind = rnd.choices(kinds, weights)[0]
+            now = time.monotonic()
+            if kind == "start":
+                user_id = USER_ID_BASE + rnd.randrange(args.users)
+                tracker.pushed_message(kind, user_id, now)
+                api.push_update(_message_update(update_id, user_id, "/start"))
+            elif kind == "user_check":
+                user_id = USER_ID_BASE + rnd.randrange(args.users)
+                tracker.pushed_callback(kind, str(update_id), now)
+                api.push_update(_callback_update(update_id, user_id, "user_check"))
+            else:
+                data = "admin_dashboard" if kind == "admin_dashboard" else "admin_dash:with:0"
+                tracker.pushed_callback(kind, str(update_id), now)
+                api.push_update(_callback_update(update_id, Config.ADMIN_ID, data))
+        carry -= int(carry)
+        await asyncio.sleep(tick)
+    return update_id
+
+
+def _summary(values: list[float]) -> dict:
+    values = sorted(values)
+    out = {"count": len(values)}
+    for p in (50, 95, 99):
+        v = _percentile(values, p)
+        out[f"p{p}_ms"] = round(v * 1000, 2) if v is not None else None
+    out["max_ms"] = round(values[-1] * 1000, 2) if values else None
+    return out
+
+
+async def _api_side(args, port_q, done, stop) -> dict:
+    """Процесс фейкового API: генерирует апдейты и меряет ответы."""
+    from tools.fake_bot_api import FakeBotAPI
+
+    kinds, weights = _parse_mix(args.mix)
+    api = FakeBotAPI(latency=args.latency, flood=args.flood)
+    api.record_calls = False
+    tracker = Tracker()
+    calls = Counter()
+    api.listeners.append(tracker.on_call)
+    api.listeners.append(lambda method, _payload, _ts: calls.update((method,)))
+    await api.start()
+    port_q.put(api.port)
+    try:
+        await asyncio.wait_for(api.polled.wait(), timeout=60)
+        gen_started = time.monotonic()
+        pushed = await _generate(api, tracker, args, kinds, weights)
+        gen_elapsed = time.monotonic() - gen_started
+        deadline = time.monotonic() + args.drain
+        while tracker.outstanding and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+    finally:
+        done.set()  # основной процесс может останавливать polling
+        # сервер отвечает, пока бот штатно не остановится
+        waited = time.monotonic()
+        while not stop.is_set() and time.monotonic() - waited < 30:
+            await asyncio.sleep(0.1)
+        await api.close()
+
+    all_lat = sorted(x for values in tracker.latencies.values() for x in values)
+    replied = len(all_lat)
+    elapsed = (tracker.last_reply - tracker.first_push) if replied and tracker.first_push else 0.0
+    return {
+        "pushed": pushed,
+        "pushed_rate": round(pushed / gen_elapsed, 1) if gen_elapsed else None,
+        "replied": replied,
+        "lost": pushed - replied,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(replied / elapsed, 1) if elapsed else None,
+        "latency": _summary(all_lat),
+        "by_kind": {k: _summary(v) for k, v in tracker.latencies.items() if v},
+        "api_calls": dict(calls),
+        "api_429": api.flooded,
+    }
+
+
+def _api_process(args, port_q, result_q, done, stop) -> None:
+    result_q.put(asyncio.run(_api_side(args, port_q, done, stop)))
+
+
+async def main_async(args) -> dict:
+    from aiogram import Dispatcher
+    from app.db import init_db, dispose_db, user_cache_stats
+    from app.handlers.admin import router as admin_router
+    from app.handlers.user import router as user_router
+    from tools.fake_bot_api import FakeBotAPI, make_bot
+
+    _parse_mix(args.mix)  # ошибки в --mix — до запуска процессов
+    await init_db()
+    await _seed(args.users)
+
+    ctx = mp.get_context("spawn")
+    port_q, result_q, done, stop = ctx.Queue(), ctx.Queue(), ctx.Event(), ctx.Event()
+    proc = ctx.Process(target=_api_process, args=(args, port_q, result_q, done, stop), daemon=True)
+    proc.start()
+    loop = asyncio.get_running_loop()
+    port = await loop.run_in_executor(None, port_q.get, True, 60)
+
+    dp = Dispatcher()
+    dp.include_router(user_router)
+    dp.include_router(admin_router)
+    bot = make_bot(FakeBotAPI(port=port))
+    polling = asyncio.create_task(
+        dp.start_polling(bot, polling_timeout=args.polling_timeout, handle_signals=False)
+    )
+    try:
+        await loop.run_in_executor(None, done.wait)  # генерация и ожидание ответов закончились
+    finally:
+        with suppress(Exception):
+            await dp.stop_polling()
+        with suppress(asyncio.CancelledError, asyncio.TimeoutError):
+            await asyncio.wait_for(polling, timeout=args.polling_timeout + 5)
+        stop.set()
+        report = await loop.run_in_executor(None, result_q.get, True, 60)
+        proc.join(10)
+        await dispose_db()
+
+    return {
+        "config": {
+            "rate": args.rate, "duration_s": args.duration, "users": args.users, "mix": args.mix,
+            "api_latency_s": args.latency, "flood": args.flood,
+        },
+        **report,
+        "user_cache": user_cache_stats(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=500, help="апдейтов в секунду")
+    parser.add_argument("--duration", type=float, default=10, help="секунд генерации")
+    parser.add_argument("--users", type=int, default=10_000, help="одобренных пользователей в БД")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"доли видов апдейтов ({', '.join(KINDS)})")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа фейкового API, сек")
+    parser.add_argument("--flood", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--polling-timeout", type=int, default=1)
+    parser.add_argument("--drain", type=float, default=10, help="сколько ждать ответов после генерации")
+    parser.add_argument("--out", help="куда записать JSON (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["DB_PATH"] = os.path.join(tmp, "load.db")
+        os.environ.setdefault("BOT_TOKEN", "123456:TEST-fake-token")
+        report = asyncio.run(main_async(args))
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
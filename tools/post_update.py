@@ -0,0 +1,67 @@
+"""
+Отправить записанные апдейты в локальный webhook-сервер бота.
+
+    python -m tools.post_update updates.json --url http://127.0.0.1:8080/webhook --secret S3CRET
+
+Файл — один JSON-объект Update, JSON-массив или JSON Lines (по апдейту на строку).
+Без файла шлёт синтетический /start от --user-id.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+
+import aiohttp
+
+
+def load_updates(path: str | None, user_id: int) -> list[dict]:
+    if not path:
+        return [synthetic_start(1, user_id)]
+    raw = Path(path).read_text(encoding="utf-8").strip()
+    if raw.startswith("["):
+        return json.loads(raw)
+    if raw.startswith("{") and "\n{" not in raw:
+        return [json.loads(raw)]
+    return [json.loads(line) for line in raw.splitlines() if line.strip()]
+
+
+def synthetic_start(update_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+
+async def post_updates(url: str, updates: list[dict], secret: str = "") -> list[int]:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    statuses = []
+    async with aiohttp.ClientSession() as session:
+        for update in updates:
+            async with session.post(url, json=update, headers=headers) as resp:
+                statuses.append(resp.status)
+    return statuses
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", nargs="?")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--user-id", type=int, default=111111)
+    args = parser.parse_args()
+    updates = load_updates(args.file, args.user_id)
+    statuses = asyncio.run(post_updates(args.url, updates, args.secret))
+    print(json.dumps({"posted": len(statuses), "statuses": statuses}))
+
+
+if __name__ == "__main__":
+    main()